@@ -0,0 +1,476 @@
+# benchmark.py
+"""Bộ benchmark tái lập được cho các đoạn code nóng của bot
+
+Chạy trên tập người chơi tổng hợp theo nhiều quy mô (mặc định 1k/10k/100k),
+lưu kết quả dạng JSON và so với lần chạy trước để đánh dấu các trường hợp
+chậm đi quá ngưỡng cho phép.
+
+Ví dụ:
+    python benchmark.py --save-baseline             # Ghi kết quả làm mốc
+    python benchmark.py                             # So với mốc đã lưu
+    python benchmark.py --sizes 1000,10000 --only combat.simulate_combat
+"""
+import argparse
+import asyncio
+import copy
+import gc
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Callable
+
+# config.py yêu cầu token và cấu hình MongoDB khi import: benchmark không kết nối Discord
+os.environ.setdefault('DISCORD_TOKEN', 'benchmark')
+os.environ.setdefault('DATABASE_BACKEND', 'memory')
+
+from bson import ObjectId
+
+from config import SECTS
+from database.memory_handler import MemoryDB
+from modules.utils import MongoUtils
+from modules.levels import level_table
+from modules.combat_stats import combat_stats
+from modules.combat import Combat
+from modules.monster import Monster
+from modules.sect import Sect
+from modules.error_handler import ErrorHandler
+
+DEFAULT_SIZES = "1000,10000,100000"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# Chậm hơn mốc quá tỷ lệ này thì bị đánh dấu là hồi quy
+DEFAULT_THRESHOLD = 0.15
+
+# Tên lệnh và lỗi gõ thường gặp (đầu vào cho các hàm so khớp chuỗi)
+COMMAND_NAMES = [
+    "tuvi", "danhquai", "danhboss", "combat", "daily", "top", "tongmon", "sect_info",
+    "mysect", "sectrank", "pvphistory", "pvpstats", "streak", "calendar", "levels", "help"
+]
+MONSTER_NAMES = [
+    "Yêu Lang", "Hắc Hổ", "Độc Xà", "Huyết Điểu", "Thiết Bối Hùng", "Hỏa Kỳ Lân",
+    "Cửu Vĩ Hồ", "Huyền Vũ", "Bạch Cốt Tinh", "Thanh Long"
+]
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    """Đăng ký một benchmark
+
+    Hàm được đăng ký nhận (env, size), chuẩn bị dữ liệu (không tính giờ) và
+    trả về hàm không tham số (đồng bộ hoặc async) thực hiện đúng size thao tác.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def typo(word: str, rng: random.Random) -> str:
+    """Tạo lỗi gõ ngẫu nhiên: xóa, thêm hoặc đổi một ký tự"""
+    index = rng.randrange(len(word))
+    choice = rng.random()
+    if choice < 0.33 and len(word) > 1:
+        return word[:index] + word[index + 1:]
+    if choice < 0.66:
+        return word[:index] + rng.choice("aeiouhnt") + word[index:]
+    return word[:index] + rng.choice("aeiouhnt") + word[index + 1:]
+
+
+def synthetic_players(size: int, seed: int) -> List[Dict[str, Any]]:
+    """Tập người chơi tổng hợp giống dữ liệu thật (đa số ở cảnh giới thấp)"""
+    rng = random.Random(seed)
+    sects = list(SECTS)
+    now = datetime.now()
+    players = []
+    for i in range(size):
+        index = min(int(rng.random() ** 2 * len(level_table)), level_table.max_index)
+        low = level_table.exp_required(index)
+        high = level_table.exp_required(index + 1) if index < level_table.max_index else low * 2 + 1
+        stats = level_table.get_stats(index)
+        created_at = now - timedelta(days=rng.randint(0, 365))
+        players.append({
+            "_id": ObjectId(),
+            "user_id": 100_000_000 + i,
+            "schema_version": MongoUtils.SCHEMA_VERSION,
+            "level": level_table.name_at(index),
+            "exp": rng.randint(low, max(low, high - 1)),
+            "sect": rng.choice(sects),
+            "hp": stats.get("hp", 100),
+            "attack": stats.get("attack", 10),
+            "defense": stats.get("defense", 5),
+            "last_train": now - timedelta(minutes=rng.randint(0, 600)),
+            "last_monster": now - timedelta(minutes=rng.randint(0, 600)),
+            "last_boss": now - timedelta(minutes=rng.randint(0, 6000)),
+            "last_daily": now - timedelta(hours=rng.randint(0, 72)),
+            "daily_streak": rng.randint(0, 60),
+            "created_at": created_at,
+            "updated_at": now,
+            "sect_joined_at": created_at,
+            "stats": {
+                "monsters_killed": rng.randint(0, 2000),
+                "bosses_killed": rng.randint(0, 100),
+                "pvp_wins": rng.randint(0, 300),
+                "pvp_losses": rng.randint(0, 300),
+                "total_exp_gained": rng.randint(0, 500_000)
+            },
+            "inventory": [
+                {"name": f"Vật phẩm {rng.randint(1, 50)}", "type": "Nguyên Liệu",
+                 "rarity": rng.choice(["normal", "elite"]), "quantity": rng.randint(1, 20)}
+                for _ in range(rng.randint(0, 6))
+            ]
+        })
+    return players
+
+
+def legacy_players(players: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Bản sao dữ liệu schema 1 (thời gian lưu dạng chuỗi) để đo đường chuyển đổi"""
+    legacy = []
+    for player in players:
+        doc = dict(player, schema_version=1)
+        for field in MongoUtils.DATETIME_FIELDS:
+            if isinstance(doc.get(field), datetime):
+                doc[field] = doc[field].strftime(MongoUtils.LEGACY_DATETIME_FORMAT)
+        legacy.append(doc)
+    return legacy
+
+
+class Environment:
+    """Các cog và dữ liệu dùng chung giữa các benchmark (dữ liệu được tạo một lần cho mỗi quy mô)"""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self._players: Dict[int, List[Dict[str, Any]]] = {}
+        self._databases: Dict[int, MemoryDB] = {}
+
+    async def setup(self):
+        """Khởi tạo các cog với bot tối giản (không cần kết nối Discord)"""
+        async def wait_until_ready():
+            pass
+
+        self.bot = SimpleNamespace(
+            loop=asyncio.get_running_loop(),
+            wait_until_ready=wait_until_ready,
+            is_closed=lambda: True,  # Dừng ngay các vòng lặp định kỳ của cog
+            add_view=lambda view: None
+        )
+        self.combat = Combat(self.bot, None)
+        self.monster = Monster(self.bot, None)
+
+    def players(self, size: int) -> List[Dict[str, Any]]:
+        if size not in self._players:
+            self._players[size] = synthetic_players(size, self.seed)
+        return self._players[size]
+
+    async def database(self, size: int) -> MemoryDB:
+        """Database trong bộ nhớ chứa size người chơi tổng hợp"""
+        if size not in self._databases:
+            db = MemoryDB()
+            for player in self.players(size):
+                db.players[player["user_id"]] = copy.deepcopy(player)
+            self._databases[size] = db
+        return self._databases[size]
+
+
+@benchmark("mongo.prepare_for_mongo")
+async def bench_prepare_for_mongo(env: Environment, size: int):
+    players = env.players(size)
+    prepare = MongoUtils.prepare_for_mongo
+
+    def run():
+        for player in players:
+            prepare(player)
+    return run
+
+
+@benchmark("mongo.prepare_from_mongo")
+async def bench_prepare_from_mongo(env: Environment, size: int):
+    players = env.players(size)
+    prepare = MongoUtils.prepare_from_mongo
+
+    def run():
+        for player in players:
+            prepare(player)
+    return run
+
+
+@benchmark("mongo.prepare_from_mongo_legacy")
+async def bench_prepare_from_mongo_legacy(env: Environment, size: int):
+    # Hàm sửa trực tiếp document nên mỗi lần đo cần bản sao mới
+    players = legacy_players(env.players(size))
+    prepare = MongoUtils.prepare_from_mongo
+
+    def run():
+        for player in players:
+            prepare(player)
+    return run
+
+
+@benchmark("levels.check_level_up")
+async def bench_check_level_up(env: Environment, size: int):
+    # Phần tra cảnh giới của Cultivation.check_level_up (không gồm ghi database và gửi tin)
+    rng = random.Random(env.seed)
+    updates = [(player["level"], player["exp"] + rng.randint(0, 5000)) for player in env.players(size)]
+    resolve = level_table.resolve
+
+    def run():
+        for current_level, new_exp in updates:
+            resolve(current_level, new_exp)
+    return run
+
+
+@benchmark("combat.calculate_combat_stats")
+async def bench_calculate_combat_stats(env: Environment, size: int):
+    players = env.players(size)
+    calculate = env.combat.calculate_combat_stats
+
+    def run():
+        for player in players:
+            calculate(player)
+    return run
+
+
+@benchmark("combat.calculate_damage")
+async def bench_calculate_damage(env: Environment, size: int):
+    pairs = [combat_stats.effective_stats(player) for player in env.players(size)]
+    calculate = env.combat.calculate_damage
+
+    def run():
+        for attack, defense in pairs:
+            calculate(attack, defense)
+    return run
+
+
+@benchmark("combat.simulate_combat")
+async def bench_simulate_combat(env: Environment, size: int):
+    monster = env.monster
+    rng = random.Random(env.seed)
+    fights = []
+    for player in env.players(size):
+        is_elite = rng.random() < 0.2
+        scaled = monster.scale_monster_stats(player, is_elite)
+        player_stats = {'name': f"Tu sĩ {player['user_id']}", 'hp': player['hp'], 'attack': player['attack'],
+                        'defense': player['defense'], 'level': player['level'], 'current_hp': player['hp']}
+        monster_stats = {'name': rng.choice(MONSTER_NAMES), 'hp': scaled['hp'], 'attack': scaled['attack'],
+                         'is_elite': is_elite, 'current_hp': scaled['hp']}
+        fights.append((player_stats, monster_stats))
+
+    async def run():
+        for player_stats, monster_stats in fights:
+            await monster.simulate_combat(player_stats, monster_stats)
+    return run
+
+
+@benchmark("monster.roll_for_items")
+async def bench_roll_for_items(env: Environment, size: int):
+    monster = env.monster
+    rng = random.Random(env.seed)
+    rolls = [(rng.choice(["monster", "monster", "monster", "boss"]), rng.random() < 0.2) for _ in range(size)]
+
+    async def run():
+        for enemy_type, is_elite in rolls:
+            await monster.roll_for_items(enemy_type, is_elite)
+    return run
+
+
+@benchmark("error_handler.calculate_similarity")
+async def bench_error_similarity(env: Environment, size: int):
+    rng = random.Random(env.seed)
+    # Gợi ý lệnh: so lỗi gõ với từng tên lệnh, mỗi thao tác là một cặp chuỗi
+    pairs = [(typo(rng.choice(COMMAND_NAMES), rng), rng.choice(COMMAND_NAMES)) for _ in range(size)]
+    calculate = ErrorHandler.calculate_similarity
+
+    async def run():
+        for s1, s2 in pairs:
+            await calculate(None, s1, s2)  # Không dùng self, tránh khởi tạo cog (ghi file thống kê lỗi)
+    return run
+
+
+@benchmark("monster.string_similarity")
+async def bench_monster_similarity(env: Environment, size: int):
+    rng = random.Random(env.seed)
+    pairs = [(typo(rng.choice(MONSTER_NAMES).lower(), rng), rng.choice(MONSTER_NAMES).lower()) for _ in range(size)]
+    similarity = env.monster.string_similarity
+
+    def run():
+        for s1, s2 in pairs:
+            similarity(s1, s2)
+    return run
+
+
+@benchmark("sect.get_sect_stats")
+async def bench_sect_stats(env: Environment, size: int):
+    # Gom thống kê môn phái trên size người chơi rồi chạy các vòng xếp hạng của Sect
+    sect = Sect(env.bot, await env.database(size))
+
+    async def run():
+        all_stats = await sect.get_sect_stats(refresh=True)
+        for stats in all_stats.values():
+            sect.get_highest_level(stats["level_distribution"])
+            sect.sort_level_distribution(stats["level_distribution"])
+        for key in ("total_exp", "members", "avg_exp"):
+            sorted(all_stats.items(), key=lambda item: item[1][key], reverse=True)
+    return run
+
+
+async def measure(env: Environment, name: str, size: int, repeats: int) -> Dict[str, Any]:
+    """Chạy một benchmark nhiều lần, trả về thời gian mỗi thao tác (ns)"""
+    factory = BENCHMARKS[name]
+    samples = []
+    for _ in range(repeats):
+        random.seed(env.seed)
+        run = await factory(env, size)
+
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            if inspect.iscoroutinefunction(run):
+                await run()
+            else:
+                run()
+            elapsed = time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        samples.append(elapsed / size)
+
+    return {
+        "name": name,
+        "size": size,
+        "repeats": repeats,
+        "best_ns": min(samples),
+        "median_ns": statistics.median(samples),
+        "ops_per_sec": 1e9 / statistics.median(samples) if samples else 0.0
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[str]:
+    """So với mốc theo thời gian trung vị, trả về danh sách benchmark bị chậm đi"""
+    regressions = []
+    print(f"\n=== SO VỚI MỐC (ngưỡng {threshold:.0%}) ===")
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            print(f"  {key:<46} (chưa có mốc)")
+            continue
+
+        change = result["median_ns"] / previous["median_ns"] - 1
+        if change > threshold:
+            status = "❌ CHẬM ĐI"
+            regressions.append(key)
+        elif change < -threshold:
+            status = "✓ nhanh hơn"
+        else:
+            status = "✓"
+        print(f"  {key:<46} {previous['median_ns']:>12.1f} -> {result['median_ns']:>12.1f} ns  "
+              f"{change:+7.1%}  {status}")
+    return regressions
+
+
+def load_results(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"❌ Lỗi khi đọc kết quả benchmark {path}: {e}")
+        return None
+
+
+def save_results(path: str, payload: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"✓ Đã lưu kết quả vào {path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark các đoạn code nóng của Tu Tiên Bot")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Các quy mô tập người chơi, cách nhau bởi dấu phẩy")
+    parser.add_argument("--repeats", type=int, default=5, help="Số lần đo mỗi benchmark (lấy trung vị)")
+    parser.add_argument("--only", default="", help="Chỉ chạy các benchmark có tên chứa chuỗi này (cách nhau bởi dấu phẩy)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed cho dữ liệu tổng hợp")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="File JSON kết quả mốc")
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả lần chạy này làm mốc")
+    parser.add_argument("--output", help="Ghi kết quả lần chạy này ra file JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Tỷ lệ chậm đi tối đa so với mốc (0.15 = 15%%)")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các benchmark rồi thoát")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    filters = [name.strip() for name in args.only.split(',') if name.strip()]
+    names = [name for name in BENCHMARKS if not filters or any(f in name for f in filters)]
+    if not names:
+        print(f"❌ Không có benchmark nào khớp '{args.only}'")
+        return 2
+
+    env = Environment(args.seed)
+    await env.setup()
+
+    print("=== BENCHMARK ===")
+    print(f"Python {platform.python_version()} | {platform.system()} {platform.machine()} | "
+          f"quy mô: {', '.join(map(str, sizes))} | {args.repeats} lần đo")
+    print(f"  {'Benchmark':<46} {'trung vị ns/op':>14} {'tốt nhất':>12} {'op/s':>12}")
+
+    results = {}
+    for size in sizes:
+        for name in names:
+            result = await measure(env, name, size, args.repeats)
+            key = f"{name}@{size}"
+            results[key] = result
+            print(f"  {key:<46} {result['median_ns']:>14.1f} {result['best_ns']:>12.1f} "
+                  f"{result['ops_per_sec']:>12,.0f}")
+
+    payload = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": f"{platform.system()} {platform.release()} {platform.machine()}",
+            "seed": args.seed,
+            "repeats": args.repeats
+        },
+        "results": results
+    }
+
+    if args.output:
+        save_results(args.output, payload)
+
+    if args.save_baseline:
+        save_results(args.baseline, payload)
+        return 0
+
+    baseline = load_results(args.baseline)
+    if not baseline:
+        print(f"\nChưa có mốc ({args.baseline}), chạy với --save-baseline để tạo.")
+        return 0
+
+    if baseline.get("meta", {}).get("platform") != payload["meta"]["platform"]:
+        print("⚠️ Mốc được đo trên máy khác, kết quả so sánh chỉ mang tính tham khảo")
+
+    regressions = compare(results, baseline.get("results", {}), args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark chậm đi quá {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+
+    print("\n✓ Không có benchmark nào chậm đi quá ngưỡng")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
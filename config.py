@@ -18,6 +18,12 @@ logger = logging.getLogger('config')
 # Load biến môi trường từ file .env
 load_dotenv()
 
+# ======== Database Backend ========
+# mongodb (mặc định), sqlite (chạy một máy/CI, không cần MongoDB Atlas)
+# hoặc memory (dữ liệu trong bộ nhớ, dùng cho kiểm thử tải)
+DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'mongodb').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', os.path.join('database', 'tutien_bot.db'))
+
 # ======== MongoDB Configuration ========
 # Hỗ trợ cả format cũ (URI hoàn chỉnh) và format mới (thành phần riêng lẻ)
 MONGODB_URI = os.getenv('MONGODB_URI')
@@ -37,7 +43,7 @@ if not MONGODB_URI:
 
         # Tạo MongoDB URI từ các thành phần
         MONGODB_URI = f"mongodb+srv://{encoded_username}:{encoded_password}@{MONGODB_CLUSTER}/?retryWrites=true&w=majority"
-    else:
+    elif DATABASE_BACKEND == 'mongodb':
         # Hiển thị thông báo lỗi chi tiết
         error_message = "\n=== LỖI CẤU HÌNH MONGODB ===\n"
         error_message += "Vui lòng cấu hình một trong hai cách sau trong file .env:\n\n"
@@ -56,6 +62,18 @@ if not MONGODB_URI:
 if not MONGODB_DB:
     MONGODB_DB = "tutien_bot"  # Mặc định nếu không được cấu hình
 
+# Cache người chơi dùng chung (LRU + TTL)
+PLAYER_CACHE_SIZE = int(os.getenv('PLAYER_CACHE_SIZE', '5000'))
+PLAYER_CACHE_TTL = int(os.getenv('PLAYER_CACHE_TTL', '60'))  # seconds
+
+# Ghi nhớ đối thủ thường gặp (xóa khi có trận mới)
+OPPONENT_CACHE_SIZE = 2000
+OPPONENT_CACHE_TTL = 600  # seconds
+RECENT_OPPONENT_WINDOW = 100  # Số trận gần nhất dùng để thống kê đối thủ
+
+# Kiểm tra explain các truy vấn khi khởi động (cảnh báo nếu COLLSCAN)
+CHECK_QUERY_PLANS = os.getenv('CHECK_QUERY_PLANS', 'true').lower() == 'true'
+
 # ======== Bot Configuration ========
 TOKEN = os.getenv('DISCORD_TOKEN')
 if not TOKEN:
@@ -353,6 +371,24 @@ VOICE_EXP = 2  # EXP per minute in voice
 MONSTER_EXP = 10  # Base EXP for killing monster
 BOSS_EXP = 50  # Base EXP for killing boss
 DAILY_EXP = 100  # Base EXP for daily check-in
+EXP_FLUSH_INTERVAL = 10  # Seconds between buffered chat/voice EXP flushes
+EXP_FLUSH_THRESHOLD = 500  # Flush early once this many players have pending EXP
+VOICE_TICK_INTERVAL = 60  # Seconds between batched voice EXP ticks
+LEADERBOARD_RESYNC_INTERVAL = 600  # Seconds between full leaderboard resyncs from the database
+
+# Combat history write queue
+COMBAT_HISTORY_FLUSH_INTERVAL = 5  # Seconds between batched combat_history inserts
+COMBAT_HISTORY_BATCH_SIZE = 100  # Records per insert_many
+COMBAT_HISTORY_MAX_QUEUE = 5000  # Queue bound before backpressure kicks in
+COMBAT_HISTORY_OVERFLOW = "block"  # "block" (wait up to the put timeout) or "drop_oldest"
+COMBAT_HISTORY_PUT_TIMEOUT = 2  # Seconds a writer waits for space under the "block" policy
+
+# Boss battle playback
+BOSS_MAX_ROUNDS = 20  # Round limit for a boss fight
+BOSS_COUNTDOWN = 5  # Seconds of countdown before the first round is shown
+BOSS_ROUND_INTERVAL = 2  # Seconds between replayed boss rounds
+BATTLE_EDITS_PER_SECOND = 5  # Global budget for battle frames handed to the edit coalescer
+EDIT_FRAME_RATE = float(os.getenv('EDIT_FRAME_RATE', 1.0))  # Max message edits per second per channel
 
 # Combat Multipliers
 MONSTER_HP_MULTIPLIER = 0.3  # Monster HP = Player HP * 0.3
@@ -361,6 +397,11 @@ BOSS_HP_MULTIPLIER = 0.5  # Boss HP = Player HP * 0.5
 BOSS_ATK_MULTIPLIER = 0.5  # Boss ATK = Player ATK * 0.5
 DAMAGE_VARIATION = 0.2  # Damage varies by ±20%
 
+# Win probability estimator (!dudoan, matchmaking)
+WIN_ESTIMATE_SAMPLES = 2000  # Simulated fights per estimate
+WIN_ESTIMATE_CACHE_SIZE = 2000  # Cached (level, sect) matchups
+WIN_ESTIMATE_CACHE_TTL = 3600  # seconds
+
 # Level Up Configuration
 EXP_STEAL_PERCENT = 0.1  # Steal 10% of opponent's EXP in PvP
 MAX_EXP_STEAL = 500  # Maximum EXP that can be stolen in PvP
@@ -404,6 +445,12 @@ VERSION = "1.0.0"
 SUPPORT_SERVER = "https://discord.gg/example"
 GITHUB_REPO = "https://github.com/example/tutien-bot"
 
+# ======== Metrics Configuration ========
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Chỉ mở cục bộ cho Prometheus scrape
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 = không mở cổng HTTP /metrics
+METRICS_SAMPLE_SIZE = int(os.getenv('METRICS_SAMPLE_SIZE', '512'))  # Số mẫu gần nhất để tính p50/p95
+
 # ======== Logging Configuration ========
 LOG_LEVEL = logging.INFO if not DEBUG_MODE else logging.DEBUG
 LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
@@ -0,0 +1,154 @@
+# database/combat_history_writer.py
+import asyncio
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+from config import (
+    COMBAT_HISTORY_FLUSH_INTERVAL, COMBAT_HISTORY_BATCH_SIZE,
+    COMBAT_HISTORY_MAX_QUEUE, COMBAT_HISTORY_OVERFLOW, COMBAT_HISTORY_PUT_TIMEOUT
+)
+
+
+class CombatHistoryWriter:
+    """Hàng đợi ghi lịch sử trận đấu theo lô (insert_many ordered=False)
+
+    Các trận đấu được gom trong bộ nhớ và ghi xuống database định kỳ hoặc khi
+    đủ một lô. Hàng đợi có giới hạn; khi đầy, theo chính sách:
+      - "block": bên ghi chờ tối đa put_timeout giây để có chỗ, quá hạn thì bỏ bản ghi cũ nhất
+      - "drop_oldest": bỏ ngay bản ghi cũ nhất để nhận bản ghi mới
+    """
+
+    def __init__(self, db, flush_interval: float = COMBAT_HISTORY_FLUSH_INTERVAL,
+                 batch_size: int = COMBAT_HISTORY_BATCH_SIZE, max_queue: int = COMBAT_HISTORY_MAX_QUEUE,
+                 overflow: str = COMBAT_HISTORY_OVERFLOW, put_timeout: float = COMBAT_HISTORY_PUT_TIMEOUT):
+        if overflow not in ("block", "drop_oldest"):
+            raise ValueError(f"Chính sách tràn hàng đợi không hợp lệ: {overflow}")
+
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+
+        self.queue: deque = deque()
+        self.flush_lock = asyncio.Lock()
+        self.flush_event = asyncio.Event()
+        self.space_event = asyncio.Event()
+        self.space_event.set()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Thống kê
+        self.total_written = 0
+        self.total_dropped = 0
+        self.total_failed = 0
+        self.total_flushes = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        """Khởi động task flush định kỳ"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, record: Dict[str, Any]):
+        """Đưa một trận đấu vào hàng đợi (áp dụng backpressure khi đầy)"""
+        if self._closed:
+            # Đã tắt: ghi trực tiếp để không mất dữ liệu
+            await self.db.insert_combat_history([record])
+            return
+
+        if len(self.queue) >= self.max_queue:
+            self.flush_event.set()
+            if self.overflow == "block":
+                try:
+                    await asyncio.wait_for(self._wait_for_space(), timeout=self.put_timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            # Vẫn đầy: bỏ bản ghi cũ nhất
+            while len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.total_dropped += 1
+
+        self.queue.append(record)
+        if len(self.queue) >= self.batch_size:
+            self.flush_event.set()
+
+    async def _wait_for_space(self):
+        while len(self.queue) >= self.max_queue:
+            self.space_event.clear()
+            await self.space_event.wait()
+
+    async def _run(self):
+        """Vòng lặp flush theo thời gian hoặc theo kích thước lô (dừng khi close() được gọi)"""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi flush lịch sử trận đấu: {e}")
+
+    async def flush(self) -> int:
+        """Ghi toàn bộ hàng đợi theo từng lô, trả về số bản ghi đã ghi"""
+        written = 0
+        async with self.flush_lock:
+            start = time.perf_counter()
+            while self.queue:
+                batch: List[Dict[str, Any]] = []
+                while self.queue and len(batch) < self.batch_size:
+                    batch.append(self.queue.popleft())
+                self.space_event.set()
+
+                try:
+                    inserted = await self.db.insert_combat_history(batch)
+                except Exception as e:
+                    # Lỗi kết nối: trả lô về đầu hàng đợi để lần sau ghi lại
+                    self.queue.extendleft(reversed(batch))
+                    while len(self.queue) > self.max_queue:
+                        self.queue.popleft()
+                        self.total_dropped += 1
+                    print(f"❌ Lỗi khi ghi lịch sử trận đấu hàng loạt: {e}")
+                    break
+
+                written += inserted
+                self.total_failed += len(batch) - inserted
+
+            if written:
+                self.total_flushes += 1
+                self.total_written += written
+                self.last_flush_ms = (time.perf_counter() - start) * 1000
+        return written
+
+    async def close(self):
+        """Dừng task định kỳ và ghi nốt hàng đợi
+
+        Không hủy task: lô đang ghi đã được lấy khỏi hàng đợi, hủy giữa chừng
+        sẽ làm mất lô đó. Đánh thức vòng lặp và chờ nó tự kết thúc.
+        """
+        self._closed = True
+        if self._task:
+            self.flush_event.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+        self.space_event.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của hàng đợi"""
+        return {
+            "queued": len(self.queue),
+            "max_queue": self.max_queue,
+            "overflow": self.overflow,
+            "written": self.total_written,
+            "dropped": self.total_dropped,
+            "failed": self.total_failed,
+            "flushes": self.total_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2)
+        }
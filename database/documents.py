@@ -0,0 +1,124 @@
+# database/documents.py
+import copy
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+# Giá trị đánh dấu trường không tồn tại (khác với None)
+MISSING = object()
+
+
+def get_path(doc: Dict[str, Any], path: str, default: Any = MISSING) -> Any:
+    """Lấy giá trị theo đường dẫn dấu chấm (ví dụ 'stats.pvp_wins')"""
+    current: Any = doc
+    for part in path.split('.'):
+        if not isinstance(current, dict) or part not in current:
+            return default
+        current = current[part]
+    return current
+
+
+def set_path(doc: Dict[str, Any], path: str, value: Any):
+    """Gán giá trị theo đường dẫn dấu chấm, tạo dict trung gian nếu thiếu"""
+    parts = path.split('.')
+    current = doc
+    for part in parts[:-1]:
+        if not isinstance(current.get(part), dict):
+            current[part] = {}
+        current = current[part]
+    current[parts[-1]] = value
+
+
+def apply_update(doc: Dict[str, Any], set_fields: Optional[Dict[str, Any]] = None,
+                 inc_fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Áp dụng $set và $inc (khóa dạng dấu chấm) lên document, sửa trực tiếp và trả về doc"""
+    for path, value in (set_fields or {}).items():
+        set_path(doc, path, copy.deepcopy(value))
+    for path, amount in (inc_fields or {}).items():
+        current = get_path(doc, path, 0)
+        set_path(doc, path, (current or 0) + amount)
+    return doc
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$eq":
+        return _equals(value, operand)
+    if operator == "$ne":
+        return not _equals(value, operand)
+    if operator == "$in":
+        return any(_equals(value, item) for item in operand)
+    if operator == "$nin":
+        return not any(_equals(value, item) for item in operand)
+    if operator == "$exists":
+        return (value is not MISSING) == bool(operand)
+    if operator == "$not":
+        return not _match_value(value, operand)
+
+    # So sánh thứ tự: trường thiếu hoặc khác kiểu không khớp (giống MongoDB)
+    if value is MISSING or value is None:
+        return False
+    try:
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Toán tử truy vấn không được hỗ trợ: {operator}")
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    if operand is None:
+        return value is MISSING or value is None
+    return value is not MISSING and value == operand
+
+
+def _match_value(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        return all(_compare(value, operator, operand) for operator, operand in condition.items())
+    return _equals(value, condition)
+
+
+def matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    """Kiểm tra document có khớp truy vấn kiểu MongoDB không
+
+    Hỗ trợ so sánh bằng, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/$not và
+    $and/$or/$nor - đủ cho các truy vấn mà các cog đang dùng.
+    """
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_value(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: Dict[str, Any], fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    """Chỉ giữ các trường được chọn (đường dẫn dấu chấm giữ nguyên cấu trúc lồng nhau)"""
+    if fields is None:
+        return doc
+    projected: Dict[str, Any] = {}
+    for field in fields:
+        value = get_path(doc, field)
+        if value is not MISSING:
+            set_path(projected, field, value)
+    return projected
+
+
+def sort_documents(docs: List[Dict[str, Any]], sort: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """Sắp xếp theo nhiều khóa như cursor.sort(); trường thiếu/None đứng thấp nhất"""
+    for field, direction in reversed(sort):
+        def key(doc, field=field):
+            value = get_path(doc, field, None)
+            return (value is not None, value if value is not None else 0)
+        docs.sort(key=key, reverse=direction < 0)
+    return docs
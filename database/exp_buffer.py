@@ -0,0 +1,128 @@
+# database/exp_buffer.py
+import asyncio
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from database.storage import PartialWriteError
+from config import EXP_FLUSH_INTERVAL, EXP_FLUSH_THRESHOLD
+
+
+class ExpBuffer:
+    """Bộ đệm ghi sau (write-behind) cho exp từ chat và voice
+
+    Gom exp theo từng người chơi trong bộ nhớ, định kỳ (hoặc khi vượt ngưỡng)
+    ghi xuống database bằng một lần bulk_write $inc duy nhất.
+    """
+
+    def __init__(self, db, flush_interval: float = EXP_FLUSH_INTERVAL,
+                 max_pending: int = EXP_FLUSH_THRESHOLD):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.pending: Dict[int, int] = {}  # user_id -> exp chờ ghi
+        self.members: Dict[int, Any] = {}  # user_id -> member để thông báo thăng cấp
+        self.flush_lock = asyncio.Lock()
+        self.flush_event = asyncio.Event()
+        self.on_flush: Optional[Callable[[List[Dict[str, Any]], Dict[int, Any]], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Thống kê
+        self.total_flushes = 0
+        self.total_users_flushed = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        """Khởi động task flush định kỳ"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def add(self, user_id: int, amount: int, member: Any = None):
+        """Cộng dồn exp cho người chơi (không truy cập database)"""
+        if amount <= 0:
+            return
+
+        self.pending[user_id] = self.pending.get(user_id, 0) + amount
+        if member is not None:
+            self.members[user_id] = member
+
+        if len(self.pending) >= self.max_pending:
+            self.flush_event.set()
+
+    def pending_exp(self, user_id: int) -> int:
+        """Lượng exp đang chờ ghi của người chơi"""
+        return self.pending.get(user_id, 0)
+
+    async def _run(self):
+        """Vòng lặp flush theo thời gian hoặc theo ngưỡng (dừng khi close() đặt cờ dừng)"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Lỗi khi flush exp: {e}")
+
+    async def flush(self) -> int:
+        """Ghi toàn bộ exp đang chờ xuống database, trả về số người chơi đã ghi"""
+        async with self.flush_lock:
+            if not self.pending:
+                return 0
+
+            # Tách bộ đệm hiện tại để các lượt cộng mới không bị chặn
+            deltas, self.pending = self.pending, {}
+            members, self.members = self.members, {}
+
+            start = time.perf_counter()
+            try:
+                players = await self.db.bulk_increment_exp(deltas)
+            except PartialWriteError as e:
+                # Chỉ trả lại các thao tác hỏng, phần đã ghi không được cộng lại
+                self._requeue(e.failed, members)
+                players = e.players
+                deltas = {user_id: amount for user_id, amount in deltas.items() if user_id not in e.failed}
+            except Exception as e:
+                # Trả lại exp vào bộ đệm để không bị mất
+                self._requeue(deltas, members)
+                print(f"❌ Lỗi khi ghi exp hàng loạt: {e}")
+                return 0
+
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self.total_flushes += 1
+            self.total_users_flushed += len(deltas)
+
+        # Kiểm tra thăng cấp trên tổng exp đã ghi
+        if self.on_flush and players:
+            try:
+                await self.on_flush(players, members)
+            except Exception as e:
+                print(f"❌ Lỗi khi xử lý sau flush exp: {e}")
+
+        return len(deltas)
+
+    def _requeue(self, deltas: Dict[int, int], members: Dict[int, Any]):
+        """Trả exp chưa ghi được về bộ đệm"""
+        for user_id, amount in deltas.items():
+            self.pending[user_id] = self.pending.get(user_id, 0) + amount
+            if user_id in members:
+                self.members.setdefault(user_id, members[user_id])
+
+    async def close(self):
+        """Dừng task định kỳ và ghi nốt exp còn lại
+
+        Không hủy task: lần flush đang chạy đã tách bộ đệm ra biến cục bộ, hủy
+        giữa chừng sẽ làm mất cả lô. Đặt cờ dừng, đánh thức vòng lặp rồi chờ nó
+        tự kết thúc sau lần flush hiện tại.
+        """
+        if self._task:
+            self._stopping = True
+            self.flush_event.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
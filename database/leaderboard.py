@@ -0,0 +1,331 @@
+# database/leaderboard.py
+import asyncio
+import time
+from bisect import bisect_left, insort
+from typing import Optional, Dict, Any, List, Tuple, Hashable
+from config import LEADERBOARD_RESYNC_INTERVAL
+
+
+class SortedScores:
+    """Danh sách điểm đã sắp xếp giảm dần, tra thứ hạng bằng bisect
+
+    Mỗi mục là (khóa_sắp_xếp, user_id) với khóa là bộ giá trị đã đảo dấu,
+    nên điểm cao đứng trước. Thứ hạng = số mục có điểm lớn hơn hẳn + 1.
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[Tuple, Hashable]] = []
+        self._keys: Dict[Hashable, Tuple] = {}
+
+    @staticmethod
+    def _key(values) -> Tuple:
+        return tuple(-value for value in values)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: Hashable) -> bool:
+        return user_id in self._keys
+
+    def update(self, user_id: Hashable, *values):
+        """Đặt điểm mới cho người chơi"""
+        key = self._key(values)
+        old_key = self._keys.get(user_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._remove_entry(old_key, user_id)
+        insort(self._entries, (key, user_id))
+        self._keys[user_id] = key
+
+    def remove(self, user_id: Hashable):
+        """Xóa người chơi khỏi bảng"""
+        old_key = self._keys.pop(user_id, None)
+        if old_key is not None:
+            self._remove_entry(old_key, user_id)
+
+    def _remove_entry(self, key: Tuple, user_id: Hashable):
+        index = bisect_left(self._entries, (key, user_id))
+        if index < len(self._entries) and self._entries[index] == (key, user_id):
+            del self._entries[index]
+
+    def rank(self, user_id: Hashable) -> Optional[int]:
+        """Thứ hạng (bắt đầu từ 1) của người chơi, None nếu không có trong bảng"""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._entries, (key,)) + 1
+
+    def rank_of(self, *values) -> int:
+        """Thứ hạng mà một điểm số bất kỳ sẽ có trong bảng"""
+        return bisect_left(self._entries, (self._key(values),)) + 1
+
+    def top(self, limit: int) -> List[Hashable]:
+        """Danh sách user_id đứng đầu"""
+        return [user_id for _, user_id in self._entries[:limit]]
+
+
+class _BoardState:
+    """Dữ liệu của bảng xếp hạng (dựng mới hoàn toàn mỗi lần đồng bộ)"""
+
+    def __init__(self):
+        self.players: Dict[int, Dict[str, Any]] = {}  # user_id -> exp, level, sect, pvp_wins, pvp_losses
+        self.exp_index = SortedScores()
+        self.pvp_index = SortedScores()
+        self.sects: Dict[str, Dict[str, int]] = {}  # sect -> {"exp", "members"}
+        self.level_counts: Dict[str, int] = {}
+
+    def unindex(self, entry: Dict[str, Any]):
+        sect = entry.get("sect")
+        if sect and sect in self.sects:
+            totals = self.sects[sect]
+            totals["exp"] -= entry.get("exp", 0)
+            totals["members"] -= 1
+            if totals["members"] <= 0:
+                del self.sects[sect]
+
+        level = entry.get("level")
+        if level in self.level_counts:
+            self.level_counts[level] -= 1
+            if self.level_counts[level] <= 0:
+                del self.level_counts[level]
+
+    def set_player(self, user_id: int, fields: Dict[str, Any]):
+        entry = self.players.get(user_id)
+        if entry is None:
+            entry = {"exp": 0, "level": "Phàm Nhân", "sect": None, "pvp_wins": 0, "pvp_losses": 0}
+            self.players[user_id] = entry
+        else:
+            self.unindex(entry)
+
+        entry.update(fields)
+        entry["exp"] = entry.get("exp") or 0
+
+        # Tổng môn phái và phân bố cảnh giới
+        sect = entry.get("sect")
+        if sect:
+            totals = self.sects.setdefault(sect, {"exp": 0, "members": 0})
+            totals["exp"] += entry["exp"]
+            totals["members"] += 1
+        level = entry.get("level")
+        if level:
+            self.level_counts[level] = self.level_counts.get(level, 0) + 1
+
+        # Chỉ số sắp xếp
+        self.exp_index.update(user_id, entry["exp"])
+        wins = entry.get("pvp_wins") or 0
+        losses = entry.get("pvp_losses") or 0
+        if wins or losses:
+            self.pvp_index.update(user_id, wins, wins / (wins + losses))
+        else:
+            self.pvp_index.remove(user_id)
+
+    def remove(self, user_id: int):
+        entry = self.players.pop(user_id, None)
+        if entry is None:
+            return
+        self.unindex(entry)
+        self.exp_index.remove(user_id)
+        self.pvp_index.remove(user_id)
+
+
+class Leaderboard:
+    """Bảng xếp hạng vật chất hóa (exp, pvp, môn phái) giữ trong bộ nhớ
+
+    Được cập nhật dần mỗi khi database handler ghi exp/pvp, và định kỳ đồng bộ
+    lại toàn bộ từ database để sửa sai lệch. Trả lời "top N" và "tôi hạng mấy"
+    mà không cần truy vấn database.
+    """
+
+    PVP_FIELDS = ("pvp_wins", "pvp_losses")
+
+    def __init__(self, db, resync_interval: float = LEADERBOARD_RESYNC_INTERVAL):
+        self.db = db
+        self.resync_interval = resync_interval
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+        self.state = _BoardState()
+
+        # Cập nhật xảy ra trong lúc đang đồng bộ, phát lại sau khi đồng bộ xong.
+        # Chỉ ghi giá trị tuyệt đối: phát lại một lần cộng dồn sẽ tính trùng
+        # nếu lần quét đã đọc người chơi sau khi database ghi xong
+        self._resyncing = False
+        self._replay: List[Tuple[int, Dict[str, Any]]] = []
+
+        # Thống kê
+        self.total_resyncs = 0
+        self.last_resync_ms = 0.0
+        self.last_resync_at: Optional[float] = None
+
+    # ======== Vòng đời ========
+
+    def start(self):
+        """Nạp dữ liệu lần đầu và khởi động task đồng bộ định kỳ"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Dừng task đồng bộ"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.resync()
+            except Exception as e:
+                print(f"❌ Lỗi khi đồng bộ bảng xếp hạng: {e}")
+            await asyncio.sleep(self.resync_interval)
+
+    async def resync(self):
+        """Dựng lại toàn bộ bảng xếp hạng từ database"""
+        start = time.perf_counter()
+        self._resyncing = True
+        self._replay = []
+
+        # Dựng bản mới trong khi bản cũ vẫn phục vụ truy vấn
+        fresh = _BoardState()
+        try:
+            async for player in self.db.iter_players(
+                    projection=["user_id", "exp", "level", "sect", "stats.pvp_wins", "stats.pvp_losses"],
+                    raise_errors=True):
+                fresh.set_player(player.get("user_id"), self._extract(player))
+        except BaseException:
+            self._resyncing = False
+            self._replay = []
+            raise
+        self.state = fresh
+
+        # Phát lại các cập nhật đã đến trong lúc quét
+        replay, self._replay = self._replay, []
+        self._resyncing = False
+        for user_id, fields in replay:
+            self.apply(user_id, **fields)
+
+        self.ready = True
+        self.total_resyncs += 1
+        self.last_resync_ms = (time.perf_counter() - start) * 1000
+        self.last_resync_at = time.time()
+
+    # ======== Cập nhật ========
+
+    @classmethod
+    def _extract(cls, player: Dict[str, Any]) -> Dict[str, Any]:
+        """Lấy các trường cần cho bảng xếp hạng từ dữ liệu người chơi"""
+        fields = {}
+        for key in ("exp", "level", "sect"):
+            if key in player:
+                fields[key] = player[key]
+
+        stats = player.get("stats")
+        if isinstance(stats, dict):
+            for key in cls.PVP_FIELDS:
+                if key in stats:
+                    fields[key] = stats[key]
+
+        # Hỗ trợ ký hiệu stats__pvp_wins / stats.pvp_wins
+        for key in cls.PVP_FIELDS:
+            for alias in (f"stats__{key}", f"stats.{key}"):
+                if alias in player:
+                    fields[key] = player[alias]
+        return fields
+
+    def apply_player(self, player: Dict[str, Any]):
+        """Cập nhật từ một bản ghi người chơi (đầy đủ hoặc một phần)"""
+        user_id = player.get("user_id")
+        if user_id is not None:
+            self.apply(user_id, **self._extract(player))
+
+    def apply(self, user_id: int, **fields):
+        """Cập nhật giá trị tuyệt đối (exp, level, sect, pvp_wins, pvp_losses)"""
+        fields = {key: value for key, value in fields.items()
+                  if key in ("exp", "level", "sect") + self.PVP_FIELDS}
+        if not fields:
+            return
+        if self._resyncing:
+            self._replay.append((user_id, fields))
+
+        # Người chơi chưa có trong bảng: chỉ thêm khi biết môn phái, còn lại chờ lần đồng bộ sau
+        if user_id not in self.state.players and "sect" not in fields:
+            return
+        self.state.set_player(user_id, fields)
+
+    def apply_stats(self, user_id: int, **deltas):
+        """Cộng dồn các chỉ số pvp (dùng cho các lần ghi $inc không trả về dữ liệu)
+
+        Khi đang đồng bộ thì bỏ qua: không biết lần quét đã thấy lần cộng này
+        hay chưa, nên để lần đồng bộ kế tiếp sửa lại. Handler nên ưu tiên
+        apply_player với giá trị đọc lại sau khi ghi.
+        """
+        deltas = {key: value for key, value in deltas.items() if key in self.PVP_FIELDS}
+        if not deltas or self._resyncing:
+            return
+
+        entry = self.state.players.get(user_id)
+        if entry is None:
+            return
+        self.state.set_player(user_id, {key: entry.get(key, 0) + value for key, value in deltas.items()})
+
+    def remove(self, user_id: int):
+        """Xóa người chơi khỏi bảng xếp hạng"""
+        self.state.remove(user_id)
+
+    # ======== Truy vấn ========
+
+    def _player_view(self, user_id: int) -> Dict[str, Any]:
+        entry = self.state.players[user_id]
+        return {
+            "user_id": user_id,
+            "exp": entry["exp"],
+            "level": entry.get("level", "Phàm Nhân"),
+            "sect": entry.get("sect"),
+            "stats": {key: entry.get(key, 0) for key in self.PVP_FIELDS}
+        }
+
+    def top_exp(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Top người chơi theo exp"""
+        return [self._player_view(user_id) for user_id in self.state.exp_index.top(limit)]
+
+    def top_pvp(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Top người chơi theo số trận thắng PvP, sau đó theo tỷ lệ thắng"""
+        return [self._player_view(user_id) for user_id in self.state.pvp_index.top(limit)]
+
+    def top_sects(self, limit: int = 10) -> List[Tuple[str, Dict[str, int]]]:
+        """Các môn phái xếp theo tổng exp"""
+        ranked = sorted(self.state.sects.items(), key=lambda item: item[1]["exp"], reverse=True)
+        return [(sect, dict(totals)) for sect, totals in ranked[:limit]]
+
+    def exp_rank(self, user_id: int) -> Optional[int]:
+        """Thứ hạng exp của người chơi"""
+        return self.state.exp_index.rank(user_id)
+
+    def exp_rank_of(self, exp: int) -> int:
+        """Thứ hạng tương ứng với một lượng exp"""
+        return self.state.exp_index.rank_of(exp)
+
+    def pvp_rank(self, user_id: int) -> Optional[int]:
+        """Thứ hạng PvP của người chơi"""
+        return self.state.pvp_index.rank(user_id)
+
+    def level_count(self, level: str) -> int:
+        """Số người chơi đang ở một cảnh giới"""
+        return self.state.level_counts.get(level, 0)
+
+    def __len__(self) -> int:
+        return len(self.state.players)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của bảng xếp hạng"""
+        return {
+            "ready": self.ready,
+            "players": len(self.state.players),
+            "pvp_players": len(self.state.pvp_index),
+            "sects": len(self.state.sects),
+            "total_resyncs": self.total_resyncs,
+            "last_resync_ms": round(self.last_resync_ms, 2)
+        }
@@ -0,0 +1,129 @@
+# database/locks.py
+import asyncio
+import time
+import weakref
+from typing import Hashable, Dict, Any, List
+
+# Mọi registry đang tồn tại (để thu thập thời gian chờ lock cho metrics)
+_registries: "weakref.WeakSet[LockRegistry]" = weakref.WeakSet()
+
+
+class _LockEntry:
+    """Lock kèm số lượng người đang giữ hoặc đang chờ"""
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class _LockHandle:
+    """Context manager giữ lock của một khóa trong registry"""
+    __slots__ = ("registry", "key", "entry")
+
+    def __init__(self, registry: "LockRegistry", key: Hashable):
+        self.registry = registry
+        self.key = key
+        self.entry = None
+
+    async def __aenter__(self):
+        self.entry = self.registry._acquire_ref(self.key)
+        contended = self.entry.lock.locked()
+        started = time.perf_counter()
+        try:
+            await self.entry.lock.acquire()
+        except BaseException:
+            # Bị hủy khi đang chờ: trả lại tham chiếu
+            self.registry._release_ref(self.key, self.entry)
+            raise
+        self.registry._record_acquire(time.perf_counter() - started if contended else 0.0)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.entry.lock.release()
+        self.registry._release_ref(self.key, self.entry)
+        return False
+
+
+class LockRegistry:
+    """Bảng lock theo khóa (ví dụ user_id) có đếm tham chiếu
+
+    Lock chỉ tồn tại khi có người đang giữ hoặc đang chờ; khi lượt cuối
+    cùng nhả lock, mục tương ứng được xóa khỏi bảng nên kích thước bảng
+    chỉ bằng số người chơi đang hoạt động thay vì tăng mãi theo số user.
+
+    Cách dùng:
+        async with registry.hold(user_id):
+            ...
+    """
+
+    def __init__(self, name: str = "locks"):
+        self.name = name
+        self._entries: Dict[Hashable, _LockEntry] = {}
+
+        # Thống kê
+        self.peak_size = 0
+        self.created = 0
+        self.reclaimed = 0
+        self.acquisitions = 0
+        self.waits = 0  # Số lần phải chờ vì lock đang bị giữ
+        self.wait_total = 0.0  # Tổng thời gian chờ (giây)
+        self.wait_max = 0.0
+        _registries.add(self)
+
+    def hold(self, key: Hashable) -> _LockHandle:
+        """Trả về context manager giữ lock của khóa"""
+        return _LockHandle(self, key)
+
+    def locked(self, key: Hashable) -> bool:
+        """Kiểm tra khóa có đang bị giữ không (không tạo lock mới)"""
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def _acquire_ref(self, key: Hashable) -> _LockEntry:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _LockEntry()
+            self._entries[key] = entry
+            self.created += 1
+            if len(self._entries) > self.peak_size:
+                self.peak_size = len(self._entries)
+        entry.refs += 1
+        return entry
+
+    def _record_acquire(self, waited: float):
+        self.acquisitions += 1
+        if waited > 0:
+            self.waits += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+    def _release_ref(self, key: Hashable, entry: _LockEntry):
+        entry.refs -= 1
+        if entry.refs <= 0 and self._entries.get(key) is entry:
+            del self._entries[key]
+            self.reclaimed += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của registry"""
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "locked": sum(1 for entry in self._entries.values() if entry.lock.locked()),
+            "peak_size": self.peak_size,
+            "created": self.created,
+            "reclaimed": self.reclaimed,
+            "acquisitions": self.acquisitions,
+            "waits": self.waits,
+            "wait_total_ms": round(self.wait_total * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2)
+        }
+
+
+def all_registries() -> List[LockRegistry]:
+    """Các LockRegistry đang tồn tại (của database và các cog)"""
+    return list(_registries)
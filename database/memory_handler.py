@@ -0,0 +1,316 @@
+# database/memory_handler.py
+import copy
+import heapq
+import itertools
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from database.locks import LockRegistry
+from database.player_cache import PlayerCache
+from database.leaderboard import Leaderboard
+from database.storage import new_player_document
+from database.documents import apply_update, matches, project, sort_documents
+from config import (
+    PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL,
+    OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL, RECENT_OPPONENT_WINDOW
+)
+from modules.utils import mongo_utils
+
+# Số trận giữ lại cho mỗi người chơi (đủ cho thống kê đối thủ và !pvphistory)
+HISTORY_PER_PLAYER = RECENT_OPPONENT_WINDOW
+
+
+class MemoryDB:
+    """Backend lưu trong bộ nhớ (dict) với cùng giao diện như MongoDB
+
+    Dùng cho kiểm thử tải và so sánh backend: không I/O, dữ liệu mất khi tắt
+    bot. Mọi thao tác chạy đồng bộ trên event loop nên tự nhiên là nguyên tử;
+    document được sao chép khi đọc/ghi để bên gọi không sửa nhầm dữ liệu gốc.
+    """
+
+    def __init__(self):
+        self.db_name = "memory"
+        self.players: Dict[int, Dict[str, Any]] = {}
+        self.history: Dict[int, deque] = {}  # user_id -> các trận gần nhất (mới nhất ở cuối)
+        self._history_ids = itertools.count(1)
+        self.is_connected = False
+        self.locks = LockRegistry("db")  # Lock theo user_id, tự thu hồi khi không dùng
+        self.cache = PlayerCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)  # Cache người chơi dùng chung cho mọi cog
+        self.leaderboard = Leaderboard(self)  # Bảng xếp hạng trong bộ nhớ, cập nhật theo mỗi lần ghi
+        self.opponent_cache = PlayerCache(OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL)  # Đối thủ thường gặp theo user_id
+
+    async def connect(self) -> bool:
+        """Không cần kết nối; chỉ đánh dấu sẵn sàng"""
+        self.is_connected = True
+        return True
+
+    def get_lock(self, user_id: int):
+        """Lấy lock cho người chơi để tránh race condition"""
+        return self.locks.hold(user_id)
+
+    async def setup(self):
+        """Khởi tạo kết nối và setup database"""
+        await self.setup_indexes()
+
+    async def setup_indexes(self):
+        """Không có index: tra người chơi theo user_id bằng dict"""
+        await self.connect()
+        print("✓ Đang dùng database trong bộ nhớ (dữ liệu không được lưu lại)")
+
+    async def check_query_plans(self) -> List[str]:
+        """Không có query plan để kiểm tra"""
+        return []
+
+    def _update(self, user_id: int, set_fields: Optional[Dict[str, Any]] = None,
+                inc_fields: Optional[Dict[str, Any]] = None, floor_exp: bool = False) -> Optional[Dict[str, Any]]:
+        player = self.players.get(user_id)
+        if player is None:
+            return None
+        apply_update(player, set_fields, inc_fields)
+        if floor_exp and player.get("exp", 0) < 0:
+            player["exp"] = 0
+        return copy.deepcopy(player)
+
+    async def get_player(self, user_id: int, use_cache: bool = True) -> Optional[Dict]:
+        """Lấy thông tin người chơi (ưu tiên cache dùng chung)"""
+        if use_cache:
+            player = self.cache.get(user_id)
+            if player is not None:
+                return player
+
+        player = self.players.get(user_id)
+        if player is None:
+            return None
+        player = copy.deepcopy(player)
+        self.cache.set(user_id, player)
+        return player
+
+    async def create_player(self, user_id: int, sect: str) -> bool:
+        """Tạo người chơi mới với dữ liệu ban đầu"""
+        if user_id in self.players:
+            print(f"❌ Lỗi khi tạo người chơi {user_id}: người chơi đã tồn tại")
+            return False
+
+        player_data = new_player_document(user_id, sect)
+        self.players[user_id] = copy.deepcopy(player_data)
+        self.cache.invalidate(user_id)
+        self.leaderboard.apply_player(player_data)
+        return True
+
+    async def update_player(self, user_id: int, **kwargs) -> bool:
+        """Cập nhật thông tin người chơi với khóa để tránh xung đột"""
+        async with self.get_lock(user_id):
+            # Hỗ trợ ký hiệu stats__pvp_wins -> stats.pvp_wins
+            update_data = {key.replace('__', '.'): value for key, value in kwargs.items()}
+            update_data['updated_at'] = datetime.now()
+
+            updated = self._update(user_id, update_data)
+            self.cache.invalidate(user_id)
+            self.leaderboard.apply_player({"user_id": user_id, **kwargs})
+            return updated is not None
+
+    async def increment_exp(self, user_id: int, amount: int, stats: Optional[Dict[str, int]] = None,
+                            **fields) -> Optional[Dict]:
+        """Cộng/trừ exp nguyên tử và trả về dữ liệu người chơi sau cập nhật
+
+        stats: các chỉ số stats.* cần tăng cùng lúc; fields: các trường cần $set cùng lúc.
+        Khi trừ exp, exp không xuống dưới 0.
+        """
+        set_data = dict(fields)
+        set_data['updated_at'] = datetime.now()
+        inc_data = {"exp": amount}
+        inc_data.update({f"stats.{k}": v for k, v in (stats or {}).items()})
+
+        player = self._update(user_id, set_data, inc_data, floor_exp=amount < 0)
+        if player:
+            self.cache.set(user_id, player)
+            self.leaderboard.apply_player(player)
+            return player
+        self.cache.invalidate(user_id)
+        return None
+
+    async def increment_player_stats(self, user_id: int, **stats) -> bool:
+        """Tăng các chỉ số thống kê của người chơi"""
+        async with self.get_lock(user_id):
+            updated = self._update(user_id, inc_fields={f"stats.{k}": v for k, v in stats.items()})
+            self.cache.invalidate(user_id)
+            if updated is not None:
+                self.leaderboard.apply_player(updated)
+            return updated is not None
+
+    async def bulk_increment_exp(self, deltas: Dict[int, int]) -> List[Dict]:
+        """Cộng exp cho nhiều người chơi, trả về user_id, exp và level sau khi cập nhật"""
+        if not deltas:
+            return []
+
+        current_time = datetime.now()
+        players = []
+        for user_id, amount in deltas.items():
+            self.cache.invalidate(user_id)
+            player = self._update(user_id, {"updated_at": current_time},
+                                  {"exp": amount, "stats.total_exp_gained": amount})
+            if player:
+                players.append({"user_id": user_id, "exp": player.get("exp", 0), "level": player.get("level")})
+
+        for player in players:
+            self.leaderboard.apply_player(player)
+        return players
+
+    async def bulk_increment_rewards(self, exp: Dict[int, int], stats: Optional[Dict[str, int]] = None,
+                                     **fields) -> Dict[int, Dict]:
+        """Phát thưởng cho nhiều người chơi, trả về dữ liệu sau cập nhật theo user_id"""
+        if not exp:
+            return {}
+
+        set_data = dict(fields)
+        set_data['updated_at'] = datetime.now()
+        stat_data = {f"stats.{k}": v for k, v in (stats or {}).items()}
+
+        players = {}
+        for user_id, amount in exp.items():
+            player = self._update(user_id, set_data, {"exp": amount, **stat_data})
+            if player:
+                self.cache.set(user_id, player)
+                self.leaderboard.apply_player(player)
+                players[user_id] = player
+            else:
+                self.cache.invalidate(user_id)
+        return players
+
+    async def iter_players(self, query: Optional[Dict] = None, projection: Optional[List[str]] = None,
+                           batch_size: int = 500, sort: Optional[List] = None,
+                           limit: int = 0, raise_errors: bool = False) -> AsyncIterator[Dict]:
+        """Duyệt người chơi khớp truy vấn, chỉ trả về các trường cần thiết"""
+        players = [player for player in list(self.players.values()) if matches(player, query)]
+        if sort:
+            sort_documents(players, sort)
+        if limit:
+            players = players[:limit]
+
+        for player in players:
+            yield copy.deepcopy(project(player, projection))
+
+    async def get_player_ranking(self, limit: int = 10) -> List[Dict]:
+        """Lấy xếp hạng người chơi dựa trên exp"""
+        top = heapq.nlargest(limit, self.players.values(), key=lambda player: player.get("exp", 0))
+        return copy.deepcopy(top)
+
+    async def get_top_players(self, limit: int = 10) -> List[Dict]:
+        """Top người chơi theo exp (lấy từ bảng xếp hạng trong bộ nhớ nếu đã sẵn sàng)"""
+        if self.leaderboard.ready:
+            return self.leaderboard.top_exp(limit)
+        return await self.get_player_ranking(limit)
+
+    async def get_sect_ranking(self, sect: str, limit: int = 10) -> List[Dict]:
+        """Lấy xếp hạng người chơi trong môn phái"""
+        members = (player for player in self.players.values() if player.get("sect") == sect)
+        return copy.deepcopy(heapq.nlargest(limit, members, key=lambda player: player.get("exp", 0)))
+
+    async def get_sect_stats(self, sect: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Thống kê môn phái, cùng cấu trúc với MongoDB.get_sect_stats"""
+        stat_names = ("monsters_killed", "bosses_killed", "pvp_wins", "pvp_losses", "total_exp_gained")
+
+        result = {}
+        for player in self.players.values():
+            player_sect = player.get("sect")
+            if player_sect is None or (sect and player_sect != sect):
+                continue
+
+            entry = result.setdefault(player_sect, {
+                "members": 0,
+                "total_exp": 0,
+                "avg_exp": 0,
+                "highest_exp": 0,
+                "total_daily_streak": 0,
+                "level_distribution": {},
+                "stats": {name: 0 for name in stat_names}
+            })
+            exp = player.get("exp", 0)
+            level = player.get("level") or "Phàm Nhân"
+            entry["members"] += 1
+            entry["total_exp"] += exp
+            entry["highest_exp"] = max(entry["highest_exp"], exp)
+            entry["total_daily_streak"] += player.get("daily_streak", 0)
+            entry["level_distribution"][level] = entry["level_distribution"].get(level, 0) + 1
+            player_stats = player.get("stats", {})
+            for name in stat_names:
+                entry["stats"][name] += player_stats.get(name, 0)
+
+        for entry in result.values():
+            entry["avg_exp"] = entry["total_exp"] // entry["members"] if entry["members"] else 0
+        return result
+
+    async def add_combat_history(self, attacker_id: int, defender_id: int, result: str,
+                                 exp_gained: int = 0, friendly: bool = False,
+                                 rounds: Optional[List[Dict]] = None) -> bool:
+        """Thêm lịch sử đánh nhau giữa người chơi (ghi ngay một bản ghi)"""
+        combat_data = {
+            "attacker_id": attacker_id,
+            "defender_id": defender_id,
+            "result": result,
+            "exp_gained": exp_gained,
+            "friendly": friendly,
+            "rounds": rounds or [],
+            "timestamp": datetime.now()
+        }
+        return await self.insert_combat_history([combat_data]) > 0
+
+    async def insert_combat_history(self, records: List[Dict[str, Any]]) -> int:
+        """Ghi nhiều trận đấu, mỗi người chơi giữ HISTORY_PER_PLAYER trận gần nhất"""
+        for record in records:
+            document = copy.deepcopy(record)
+            document.setdefault("timestamp", datetime.now())
+            document["schema_version"] = mongo_utils.SCHEMA_VERSION
+            document["_id"] = next(self._history_ids)
+
+            for user_id in {document.get("attacker_id"), document.get("defender_id")}:
+                self.history.setdefault(user_id, deque(maxlen=HISTORY_PER_PLAYER)).append(document)
+                # Có trận mới: bỏ kết quả đối thủ thường gặp đã ghi nhớ
+                self.opponent_cache.invalidate(user_id)
+        return len(records)
+
+    async def get_recent_opponents(self, user_id: int, limit: int = 3) -> List[Tuple[int, int]]:
+        """Các đối thủ gặp nhiều nhất trong RECENT_OPPONENT_WINDOW trận gần đây
+
+        Trả về danh sách (opponent_id, số_trận).
+        """
+        cached = self.opponent_cache.get(user_id)
+        if cached is not None and cached["limit"] >= limit:
+            return cached["opponents"][:limit]
+
+        counts: Dict[int, List] = {}
+        for match in self.history.get(user_id, ()):
+            opponent_id = match["defender_id"] if match["attacker_id"] == user_id else match["attacker_id"]
+            entry = counts.setdefault(opponent_id, [0, match["timestamp"]])
+            entry[0] += 1
+            entry[1] = max(entry[1], match["timestamp"])
+
+        ranked = sorted(counts.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)
+        opponents = [(opponent_id, count) for opponent_id, (count, _) in ranked[:limit]]
+        self.opponent_cache.set(user_id, {"limit": limit, "opponents": opponents})
+        return opponents
+
+    async def get_combat_history(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Lấy lịch sử đánh nhau của người chơi (mới nhất trước)"""
+        entries = self.history.get(user_id, ())
+        return copy.deepcopy(list(itertools.islice(reversed(entries), limit)))
+
+    async def test_connection(self) -> Dict[str, Any]:
+        """Thông tin backend trong bộ nhớ"""
+        start_time = time.perf_counter()
+        players = len(self.players)
+        return {
+            "success": True,
+            "database": self.db_name,
+            "ping_ms": round((time.perf_counter() - start_time) * 1000, 2),
+            "server_version": "in-memory",
+            "connection_count": 0,
+            "players": players
+        }
+
+    async def close(self):
+        """Dừng bảng xếp hạng; dữ liệu trong bộ nhớ được giữ tới khi đối tượng bị hủy"""
+        await self.leaderboard.stop()
+        self.is_connected = False
+        print("✓ Đã đóng database trong bộ nhớ")
@@ -0,0 +1,88 @@
+# database/migrations.py
+import asyncio
+from datetime import datetime
+from pymongo import UpdateOne
+from modules.utils import MongoUtils
+
+SCHEMA_META_ID = "schema"
+
+
+async def get_schema_version(db) -> int:
+    """Phiên bản lược đồ đã ghi nhận trong collection meta (1 nếu chưa có)"""
+    meta = await db.meta.find_one({"_id": SCHEMA_META_ID})
+    return meta.get("version", 1) if meta else 1
+
+
+async def migrate_collection_datetimes(collection, batch_size: int = 500) -> int:
+    """Chuyển các trường thời gian dạng chuỗi sang BSON datetime cho một collection
+
+    Trả về số document đã cập nhật. Chạy lại nhiều lần vẫn an toàn.
+    """
+    fields = MongoUtils.DATETIME_FIELDS
+    query = {"schema_version": {"$not": {"$gte": MongoUtils.SCHEMA_VERSION}}}
+    projection = {field: 1 for field in fields}
+
+    migrated = 0
+    operations = []
+    async for doc in collection.find(query, projection).batch_size(batch_size):
+        update = {"schema_version": MongoUtils.SCHEMA_VERSION}
+        for field in fields:
+            value = doc.get(field)
+            if isinstance(value, str):
+                parsed = MongoUtils.parse_legacy_datetime(value)
+                if isinstance(parsed, datetime):
+                    update[field] = parsed
+
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(operations) >= batch_size:
+            await collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+
+    return migrated
+
+
+async def migrate_to_native_datetimes(db, batch_size: int = 500) -> bool:
+    """Migration một lần: schema 1 (chuỗi thời gian) -> schema 2 (BSON datetime)
+
+    Bỏ qua ngay nếu collection meta đã ghi nhận phiên bản hiện tại.
+    """
+    if not db.is_connected:
+        await db.connect()
+
+    try:
+        if await get_schema_version(db) >= MongoUtils.SCHEMA_VERSION:
+            return False
+
+        print("⏳ Đang chuyển dữ liệu thời gian sang BSON datetime...")
+        players = await migrate_collection_datetimes(db.players, batch_size)
+        history = await migrate_collection_datetimes(db.combat_history, batch_size)
+
+        await db.meta.update_one(
+            {"_id": SCHEMA_META_ID},
+            {"$set": {"version": MongoUtils.SCHEMA_VERSION, "migrated_at": datetime.now()}},
+            upsert=True
+        )
+        db.cache.clear()
+        print(f"✓ Đã chuyển {players} người chơi và {history} lịch sử đấu sang schema {MongoUtils.SCHEMA_VERSION}")
+        return True
+    except Exception as e:
+        print(f"❌ Lỗi khi migrate dữ liệu thời gian: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    from database.mongo_handler import MongoDB
+
+    async def main():
+        db = MongoDB()
+        try:
+            await migrate_to_native_datetimes(db)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -1,9 +1,20 @@
 # database/mongo_handler.py
 import motor.motor_asyncio
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Union
+from typing import Optional, Dict, Any, List, Union, AsyncIterator, Tuple
 import asyncio
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from database.locks import LockRegistry
+from database.player_cache import PlayerCache
+from database.leaderboard import Leaderboard
+from database.storage import new_player_document, PartialWriteError
+from database.query_plans import INDEX_SPECS, OBSOLETE_INDEXES, explain_query_shapes
+from config import (
+    PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL,
+    OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL, RECENT_OPPONENT_WINDOW
+)
 from modules.utils import mongo_utils
 import certifi
 import os
@@ -26,7 +37,10 @@ class MongoDB:
         self._client = None
         self._db = None
         self.is_connected = False
-        self.locks = {}
+        self.locks = LockRegistry("db")  # Lock theo user_id, tự thu hồi khi không dùng
+        self.cache = PlayerCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)  # Cache người chơi dùng chung cho mọi cog
+        self.leaderboard = Leaderboard(self)  # Bảng xếp hạng trong bộ nhớ, cập nhật theo mỗi lần ghi
+        self.opponent_cache = PlayerCache(OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL)  # Đối thủ thường gặp theo user_id
         self.connection_retries = 3
         self.retry_delay = 5
 
@@ -69,6 +83,7 @@ class MongoDB:
                 self._db = self._client[self.db_name]
                 self.players = self._db.players
                 self.combat_history = self._db.combat_history
+                self.meta = self._db.meta
 
                 self.is_connected = True
                 print("✓ Kết nối MongoDB thành công!")
@@ -110,11 +125,9 @@ class MongoDB:
                     logging.error(f"Không thể kết nối MongoDB sau {self.connection_retries} lần thử: {str(e)}")
                     raise ConnectionError(error_msg)
 
-    async def get_lock(self, user_id: int) -> asyncio.Lock:
+    def get_lock(self, user_id: int):
         """Lấy lock cho người chơi để tránh race condition"""
-        if user_id not in self.locks:
-            self.locks[user_id] = asyncio.Lock()
-        return self.locks[user_id]
+        return self.locks.hold(user_id)
 
     async def setup(self):
         """Khởi tạo kết nối và setup database"""
@@ -128,26 +141,19 @@ class MongoDB:
             await self.connect()
 
         try:
-            # Index cho players collection
-            await self.players.create_index("user_id", unique=True)
-            await self.players.create_index([("exp", -1)])  # Descending for top players
-            await self.players.create_index([
-                ("sect", 1),
-                ("exp", -1)
-            ])  # Compound index for sect rankings
-
-            # Index cho combat_history
-            await self.combat_history.create_index([
-                ("timestamp", -1),
-                ("attacker_id", 1),
-                ("defender_id", 1)
-            ])
-
-            # Thêm TTL index cho combat_history (tự động xóa sau 30 ngày)
-            await self.combat_history.create_index(
-                "timestamp",
-                expireAfterSeconds=30 * 24 * 60 * 60
-            )
+            for collection_name, specs in INDEX_SPECS.items():
+                collection = self._db[collection_name]
+
+                # Bỏ các index cũ đã được thiết kế mới thay thế
+                existing = await collection.index_information()
+                for index_name in OBSOLETE_INDEXES.get(collection_name, []):
+                    if index_name in existing:
+                        await collection.drop_index(index_name)
+                        print(f"✓ Đã xóa index cũ {collection_name}.{index_name}")
+
+                for spec in specs:
+                    options = {key: value for key, value in spec.items() if key != "keys"}
+                    await collection.create_index(spec["keys"], **options)
 
             print("✓ Đã tạo indexes thành công!")
 
@@ -155,15 +161,28 @@ class MongoDB:
             print(f"❌ Lỗi khi tạo indexes: {e}")
             raise
 
-    async def get_player(self, user_id: int) -> Optional[Dict]:
-        """Lấy thông tin người chơi từ database"""
+    async def check_query_plans(self) -> List[str]:
+        """Kiểm tra explain cho các dạng truy vấn đã đăng ký, trả về các truy vấn bị COLLSCAN"""
+        if not self.is_connected:
+            await self.connect()
+        return await explain_query_shapes(self._db)
+
+    async def get_player(self, user_id: int, use_cache: bool = True) -> Optional[Dict]:
+        """Lấy thông tin người chơi (ưu tiên cache dùng chung)"""
+        if use_cache:
+            player = self.cache.get(user_id)
+            if player is not None:
+                return player
+
         if not self.is_connected:
             await self.connect()
 
         try:
             player = await self.players.find_one({"user_id": user_id})
             if player:
-                return await mongo_utils.prepare_from_mongo(player)
+                player = await mongo_utils.prepare_from_mongo_async(player)
+                self.cache.set(user_id, player)
+                return player
             return None
         except Exception as e:
             print(f"❌ Lỗi khi lấy thông tin người chơi {user_id}: {e}")
@@ -175,34 +194,13 @@ class MongoDB:
             await self.connect()
 
         try:
-            current_time = datetime.now()
-            player_data = {
-                "user_id": user_id,
-                "level": "Phàm Nhân",
-                "exp": 0,
-                "sect": sect,
-                "hp": 100,
-                "attack": 10,
-                "defense": 5,
-                "last_train": current_time,
-                "last_monster": current_time,
-                "last_boss": current_time,
-                "last_daily": current_time,
-                "daily_streak": 0,
-                "created_at": current_time,
-                "updated_at": current_time,
-                "stats": {
-                    "monsters_killed": 0,
-                    "bosses_killed": 0,
-                    "pvp_wins": 0,
-                    "pvp_losses": 0,
-                    "total_exp_gained": 0
-                }
-            }
+            player_data = new_player_document(user_id, sect)
 
             await self.players.insert_one(
-                await mongo_utils.prepare_for_mongo(player_data)
+                await mongo_utils.prepare_for_mongo_async(player_data)
             )
+            self.cache.invalidate(user_id)
+            self.leaderboard.apply_player(player_data)
             return True
         except Exception as e:
             print(f"❌ Lỗi khi tạo người chơi {user_id}: {e}")
@@ -214,36 +212,216 @@ class MongoDB:
             await self.connect()
 
         try:
-            async with await self.get_lock(user_id):
-                update_data = await mongo_utils.prepare_for_mongo(kwargs)
+            async with self.get_lock(user_id):
+                update_data = await mongo_utils.prepare_for_mongo_async(kwargs)
+                # Hỗ trợ ký hiệu stats__pvp_wins -> stats.pvp_wins
+                update_data = {key.replace('__', '.'): value for key, value in update_data.items()}
                 update_data['updated_at'] = datetime.now()
 
                 result = await self.players.update_one(
                     {"user_id": user_id},
                     {"$set": update_data}
                 )
+                self.cache.invalidate(user_id)
+                self.leaderboard.apply_player({"user_id": user_id, **kwargs})
                 return result.modified_count > 0
         except Exception as e:
             print(f"❌ Lỗi khi cập nhật người chơi {user_id}: {e}")
             return False
 
+    async def increment_exp(self, user_id: int, amount: int, stats: Optional[Dict[str, int]] = None,
+                            **fields) -> Optional[Dict]:
+        """Cộng/trừ exp nguyên tử và trả về dữ liệu người chơi sau cập nhật
+
+        stats: các chỉ số stats.* cần tăng cùng lúc; fields: các trường cần $set cùng lúc.
+        Khi trừ exp, dùng update pipeline để exp không xuống dưới 0.
+        """
+        if not self.is_connected:
+            await self.connect()
+
+        try:
+            set_data = await mongo_utils.prepare_for_mongo_async(fields)
+            set_data['updated_at'] = datetime.now()
+            stats = stats or {}
+
+            if amount >= 0:
+                inc_data = {"exp": amount}
+                inc_data.update({f"stats.{k}": v for k, v in stats.items()})
+                update = {"$inc": inc_data, "$set": set_data}
+            else:
+                stage = {key: {"$literal": value} for key, value in set_data.items()}
+                stage["exp"] = {"$max": [0, {"$add": [{"$ifNull": ["$exp", 0]}, amount]}]}
+                for k, v in stats.items():
+                    stage[f"stats.{k}"] = {"$add": [{"$ifNull": [f"$stats.{k}", 0]}, v]}
+                update = [{"$set": stage}]
+
+            player = await self.players.find_one_and_update(
+                {"user_id": user_id},
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+            if player:
+                # Dữ liệu trả về là bản mới nhất, đưa luôn vào cache
+                player = await mongo_utils.prepare_from_mongo_async(player)
+                self.cache.set(user_id, player)
+                self.leaderboard.apply_player(player)
+                return player
+            self.cache.invalidate(user_id)
+            return None
+        except Exception as e:
+            print(f"❌ Lỗi khi cộng exp cho người chơi {user_id}: {e}")
+            return None
+
     async def increment_player_stats(self, user_id: int, **stats) -> bool:
         """Tăng các chỉ số thống kê của người chơi"""
         if not self.is_connected:
             await self.connect()
 
         try:
-            async with await self.get_lock(user_id):
+            async with self.get_lock(user_id):
                 update_data = {f"stats.{k}": v for k, v in stats.items()}
-                result = await self.players.update_one(
+                # Lấy lại giá trị sau khi cộng để bảng xếp hạng nhận giá trị tuyệt đối
+                player = await self.players.find_one_and_update(
                     {"user_id": user_id},
-                    {"$inc": update_data}
+                    {"$inc": update_data},
+                    projection={"_id": 0, "user_id": 1, **{f"stats.{k}": 1 for k in stats}},
+                    return_document=ReturnDocument.AFTER
                 )
-                return result.modified_count > 0
+                self.cache.invalidate(user_id)
+                if player:
+                    self.leaderboard.apply_player(player)
+                return player is not None
         except Exception as e:
             print(f"❌ Lỗi khi tăng chỉ số người chơi {user_id}: {e}")
             return False
 
+    async def bulk_increment_exp(self, deltas: Dict[int, int]) -> List[Dict]:
+        """Cộng exp cho nhiều người chơi bằng một lần bulk_write $inc
+
+        Trả về user_id, exp và level sau khi cập nhật (một truy vấn $in).
+        Lỗi ghi toàn bộ được ném ra để bên gọi giữ lại exp; lỗi một phần ném
+        PartialWriteError chỉ chứa các thao tác hỏng. Lỗi khi đọc lại sau khi
+        đã ghi không được ném ra (exp đã được cộng, ghi lại sẽ bị cộng trùng).
+        """
+        if not deltas:
+            return []
+        if not self.is_connected:
+            await self.connect()
+
+        current_time = datetime.now()
+        operations = [
+            UpdateOne(
+                {"user_id": user_id},
+                {
+                    "$inc": {"exp": amount, "stats.total_exp_gained": amount},
+                    "$set": {"updated_at": current_time}
+                }
+            )
+            for user_id, amount in deltas.items()
+        ]
+        user_ids = list(deltas)
+        failed: Dict[int, int] = {}
+        try:
+            await self.players.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: các thao tác không nằm trong writeErrors đã được ghi
+            for error in e.details.get("writeErrors", []):
+                user_id = user_ids[error["index"]]
+                failed[user_id] = deltas[user_id]
+            print(f"❌ Lỗi khi cộng exp hàng loạt: {len(failed)}/{len(deltas)} thao tác thất bại")
+        finally:
+            for user_id in deltas:
+                self.cache.invalidate(user_id)
+
+        players = []
+        written = [user_id for user_id in user_ids if user_id not in failed]
+        if written:
+            try:
+                cursor = self.players.find(
+                    {"user_id": {"$in": written}},
+                    {"_id": 0, "user_id": 1, "exp": 1, "level": 1}
+                )
+                players = await cursor.to_list(length=len(written))
+                for player in players:
+                    self.leaderboard.apply_player(player)
+            except Exception as e:
+                print(f"❌ Lỗi khi đọc lại exp sau khi ghi hàng loạt: {e}")
+                players = []
+
+        if failed:
+            raise PartialWriteError(failed, players)
+        return players
+
+    async def bulk_increment_rewards(self, exp: Dict[int, int], stats: Optional[Dict[str, int]] = None,
+                                     **fields) -> Dict[int, Dict]:
+        """Phát thưởng cho nhiều người chơi bằng một lần bulk_write $inc
+
+        exp: user_id -> exp được cộng (không âm); stats và fields áp dụng chung cho
+        mọi người giống increment_exp. Trả về dữ liệu sau cập nhật theo user_id,
+        lấy bằng một truy vấn $in.
+        """
+        if not exp:
+            return {}
+        if not self.is_connected:
+            await self.connect()
+
+        try:
+            set_data = await mongo_utils.prepare_for_mongo_async(fields)
+            set_data['updated_at'] = datetime.now()
+            stat_data = {f"stats.{k}": v for k, v in (stats or {}).items()}
+
+            operations = [
+                UpdateOne({"user_id": user_id}, {"$inc": {"exp": amount, **stat_data}, "$set": set_data})
+                for user_id, amount in exp.items()
+            ]
+            try:
+                await self.players.bulk_write(operations, ordered=False)
+            finally:
+                for user_id in exp:
+                    self.cache.invalidate(user_id)
+
+            cursor = self.players.find({"user_id": {"$in": list(exp.keys())}}, {"_id": 0})
+            players = {}
+            for player in await cursor.to_list(length=len(exp)):
+                player = await mongo_utils.prepare_from_mongo_async(player)
+                self.cache.set(player['user_id'], player)
+                self.leaderboard.apply_player(player)
+                players[player['user_id']] = player
+            return players
+        except Exception as e:
+            print(f"❌ Lỗi khi phát thưởng cho {len(exp)} người chơi: {e}")
+            return {}
+
+    async def iter_players(self, query: Optional[Dict] = None, projection: Optional[List[str]] = None,
+                           batch_size: int = 500, sort: Optional[List] = None,
+                           limit: int = 0, raise_errors: bool = False) -> AsyncIterator[Dict]:
+        """Duyệt người chơi theo luồng từ cursor, chỉ lấy các trường cần thiết
+
+        Dùng thay cho việc tải toàn bộ collection vào bộ nhớ khi thực sự cần quét hết.
+        raise_errors: ném lỗi ra ngoài thay vì dừng im lặng (khi bên gọi cần dữ liệu đầy đủ).
+        """
+        if not self.is_connected:
+            await self.connect()
+
+        try:
+            fields = None
+            if projection is not None:
+                fields = {field: 1 for field in projection}
+                fields["_id"] = 0
+
+            cursor = self.players.find(query or {}, fields).batch_size(batch_size)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+
+            async for player in cursor:
+                yield mongo_utils.prepare_from_mongo(player)
+        except Exception as e:
+            print(f"❌ Lỗi khi duyệt danh sách người chơi: {e}")
+            if raise_errors:
+                raise
+
     async def get_player_ranking(self, limit: int = 10) -> List[Dict]:
         """Lấy xếp hạng người chơi dựa trên exp"""
         if not self.is_connected:
@@ -252,11 +430,17 @@ class MongoDB:
         try:
             cursor = self.players.find().sort("exp", -1).limit(limit)
             players = await cursor.to_list(length=limit)
-            return [await mongo_utils.prepare_from_mongo(player) for player in players]
+            return [await mongo_utils.prepare_from_mongo_async(player) for player in players]
         except Exception as e:
             print(f"❌ Lỗi khi lấy xếp hạng người chơi: {e}")
             return []
 
+    async def get_top_players(self, limit: int = 10) -> List[Dict]:
+        """Top người chơi theo exp (lấy từ bảng xếp hạng trong bộ nhớ nếu đã sẵn sàng)"""
+        if self.leaderboard.ready:
+            return self.leaderboard.top_exp(limit)
+        return await self.get_player_ranking(limit)
+
     async def get_sect_ranking(self, sect: str, limit: int = 10) -> List[Dict]:
         """Lấy xếp hạng người chơi trong môn phái"""
         if not self.is_connected:
@@ -265,34 +449,174 @@ class MongoDB:
         try:
             cursor = self.players.find({"sect": sect}).sort("exp", -1).limit(limit)
             players = await cursor.to_list(length=limit)
-            return [await mongo_utils.prepare_from_mongo(player) for player in players]
+            return [await mongo_utils.prepare_from_mongo_async(player) for player in players]
         except Exception as e:
             print(f"❌ Lỗi khi lấy xếp hạng môn phái {sect}: {e}")
             return []
 
-    async def add_combat_history(self, attacker_id: int, defender_id: int,
-                                 result: str, exp_gained: int = 0) -> bool:
-        """Thêm lịch sử đánh nhau giữa người chơi"""
+    async def get_sect_stats(self, sect: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Thống kê môn phái bằng $group phía server (một lần truy vấn cho tất cả môn phái)
+
+        Trả về dict {tên_môn_phái: {...}} gồm số thành viên, tổng/trung bình/cao nhất exp,
+        phân bố cảnh giới và tổng các chỉ số stats.*
+        """
         if not self.is_connected:
             await self.connect()
 
+        try:
+            pipeline = []
+            if sect:
+                pipeline.append({"$match": {"sect": sect}})
+            else:
+                pipeline.append({"$match": {"sect": {"$ne": None}}})
+
+            pipeline += [
+                # Gom theo (môn phái, cảnh giới) để có phân bố cảnh giới
+                {"$group": {
+                    "_id": {"sect": "$sect", "level": {"$ifNull": ["$level", "Phàm Nhân"]}},
+                    "count": {"$sum": 1},
+                    "total_exp": {"$sum": {"$ifNull": ["$exp", 0]}},
+                    "highest_exp": {"$max": {"$ifNull": ["$exp", 0]}},
+                    "total_daily_streak": {"$sum": {"$ifNull": ["$daily_streak", 0]}},
+                    "monsters_killed": {"$sum": {"$ifNull": ["$stats.monsters_killed", 0]}},
+                    "bosses_killed": {"$sum": {"$ifNull": ["$stats.bosses_killed", 0]}},
+                    "pvp_wins": {"$sum": {"$ifNull": ["$stats.pvp_wins", 0]}},
+                    "pvp_losses": {"$sum": {"$ifNull": ["$stats.pvp_losses", 0]}},
+                    "total_exp_gained": {"$sum": {"$ifNull": ["$stats.total_exp_gained", 0]}}
+                }},
+                # Gom tiếp theo môn phái
+                {"$group": {
+                    "_id": "$_id.sect",
+                    "members": {"$sum": "$count"},
+                    "total_exp": {"$sum": "$total_exp"},
+                    "highest_exp": {"$max": "$highest_exp"},
+                    "total_daily_streak": {"$sum": "$total_daily_streak"},
+                    "monsters_killed": {"$sum": "$monsters_killed"},
+                    "bosses_killed": {"$sum": "$bosses_killed"},
+                    "pvp_wins": {"$sum": "$pvp_wins"},
+                    "pvp_losses": {"$sum": "$pvp_losses"},
+                    "total_exp_gained": {"$sum": "$total_exp_gained"},
+                    "levels": {"$push": {"level": "$_id.level", "count": "$count"}}
+                }}
+            ]
+
+            result = {}
+            async for doc in self.players.aggregate(pipeline):
+                members = doc.get("members", 0)
+                result[doc["_id"]] = {
+                    "members": members,
+                    "total_exp": doc.get("total_exp", 0),
+                    "avg_exp": doc.get("total_exp", 0) // members if members else 0,
+                    "highest_exp": doc.get("highest_exp", 0),
+                    "total_daily_streak": doc.get("total_daily_streak", 0),
+                    "level_distribution": {item["level"]: item["count"] for item in doc.get("levels", [])},
+                    "stats": {
+                        "monsters_killed": doc.get("monsters_killed", 0),
+                        "bosses_killed": doc.get("bosses_killed", 0),
+                        "pvp_wins": doc.get("pvp_wins", 0),
+                        "pvp_losses": doc.get("pvp_losses", 0),
+                        "total_exp_gained": doc.get("total_exp_gained", 0)
+                    }
+                }
+            return result
+        except Exception as e:
+            print(f"❌ Lỗi khi thống kê môn phái: {e}")
+            return {}
+
+    async def add_combat_history(self, attacker_id: int, defender_id: int, result: str,
+                                 exp_gained: int = 0, friendly: bool = False,
+                                 rounds: Optional[List[Dict]] = None) -> bool:
+        """Thêm lịch sử đánh nhau giữa người chơi (ghi ngay một bản ghi)"""
         try:
             combat_data = {
                 "attacker_id": attacker_id,
                 "defender_id": defender_id,
                 "result": result,
                 "exp_gained": exp_gained,
+                "friendly": friendly,
+                "rounds": rounds or [],
                 "timestamp": datetime.now()
             }
-
-            await self.combat_history.insert_one(
-                await mongo_utils.prepare_for_mongo(combat_data)
-            )
-            return True
+            return await self.insert_combat_history([combat_data]) > 0
         except Exception as e:
             print(f"❌ Lỗi khi thêm lịch sử đánh nhau: {e}")
             return False
 
+    async def insert_combat_history(self, records: List[Dict[str, Any]]) -> int:
+        """Ghi nhiều trận đấu bằng một lần insert_many(ordered=False)
+
+        Trả về số bản ghi đã ghi. Lỗi kết nối được ném ra ngoài để bên gọi ghi lại sau;
+        lỗi từng bản ghi (BulkWriteError) chỉ bỏ qua các bản ghi hỏng.
+        """
+        if not records:
+            return 0
+        if not self.is_connected:
+            await self.connect()
+
+        documents = []
+        for record in records:
+            document = mongo_utils.prepare_for_mongo(record)
+            document.setdefault("timestamp", datetime.now())
+            document["schema_version"] = mongo_utils.SCHEMA_VERSION
+            documents.append(document)
+
+        try:
+            result = await self.combat_history.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            print(f"❌ Lỗi khi ghi {len(documents) - inserted} lịch sử đánh nhau: {e}")
+            return inserted
+        finally:
+            # Có trận mới: bỏ kết quả đối thủ thường gặp đã ghi nhớ
+            for document in documents:
+                self.opponent_cache.invalidate(document.get("attacker_id"))
+                self.opponent_cache.invalidate(document.get("defender_id"))
+
+    async def get_recent_opponents(self, user_id: int, limit: int = 3) -> List[Tuple[int, int]]:
+        """Các đối thủ gặp nhiều nhất trong RECENT_OPPONENT_WINDOW trận gần đây
+
+        Trả về danh sách (opponent_id, số_trận). Kết quả được ghi nhớ theo người chơi
+        và bị xóa khi có trận đấu mới của người đó.
+        """
+        cached = self.opponent_cache.get(user_id)
+        if cached is not None and cached["limit"] >= limit:
+            return cached["opponents"][:limit]
+
+        if not self.is_connected:
+            await self.connect()
+
+        try:
+            pipeline = [
+                {"$match": {"$or": [{"attacker_id": user_id}, {"defender_id": user_id}]}},
+                {"$sort": {"timestamp": -1}},
+                {"$limit": RECENT_OPPONENT_WINDOW},
+                {"$project": {
+                    "_id": 0,
+                    "opponent_id": {
+                        "$cond": [{"$eq": ["$attacker_id", user_id]}, "$defender_id", "$attacker_id"]
+                    },
+                    "timestamp": 1
+                }},
+                {"$group": {
+                    "_id": "$opponent_id",
+                    "count": {"$sum": 1},
+                    "last_match": {"$max": "$timestamp"}
+                }},
+                {"$sort": {"count": -1, "last_match": -1}},
+                {"$limit": limit}
+            ]
+
+            opponents = [
+                (item["_id"], item["count"])
+                async for item in self.combat_history.aggregate(pipeline)
+            ]
+            self.opponent_cache.set(user_id, {"limit": limit, "opponents": opponents})
+            return opponents
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy đối thủ thường gặp của người chơi {user_id}: {e}")
+            return []
+
     async def get_combat_history(self, user_id: int, limit: int = 10) -> List[Dict]:
         """Lấy lịch sử đánh nhau của người chơi"""
         if not self.is_connected:
@@ -307,7 +631,7 @@ class MongoDB:
 
             cursor = self.combat_history.find(query).sort("timestamp", -1).limit(limit)
             history = await cursor.to_list(length=limit)
-            return [await mongo_utils.prepare_from_mongo(item) for item in history]
+            return [await mongo_utils.prepare_from_mongo_async(item) for item in history]
         except Exception as e:
             print(f"❌ Lỗi khi lấy lịch sử đánh nhau của người chơi {user_id}: {e}")
             return []
@@ -371,6 +695,7 @@ class MongoDB:
 
     async def close(self):
         """Đóng kết nối database an toàn"""
+        await self.leaderboard.stop()
         if self._client:
             self._client.close()
             self.is_connected = False
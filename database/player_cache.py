@@ -0,0 +1,80 @@
+# database/player_cache.py
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+
+class PlayerCache:
+    """Cache người chơi dùng chung, giới hạn kích thước (LRU) và có thời hạn (TTL)"""
+
+    def __init__(self, max_size: int = 5000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (player, expires_at)
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _copy(player: Dict[str, Any]) -> Dict[str, Any]:
+        """Sao chép để bên gọi sửa dữ liệu không làm hỏng cache"""
+        copied = dict(player)
+        if isinstance(copied.get('stats'), dict):
+            copied['stats'] = dict(copied['stats'])
+        return copied
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Lấy người chơi từ cache, trả về None nếu không có hoặc đã hết hạn"""
+        entry = self._data.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        player, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[user_id]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return self._copy(player)
+
+    def set(self, user_id: int, player: Dict[str, Any]):
+        """Lưu người chơi vào cache, loại bỏ mục ít dùng nhất nếu đầy"""
+        self._data[user_id] = (self._copy(player), time.monotonic() + self.ttl)
+        self._data.move_to_end(user_id)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        """Xóa người chơi khỏi cache"""
+        self._data.pop(user_id, None)
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của cache"""
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 4)
+        }
@@ -0,0 +1,116 @@
+# database/query_plans.py
+import logging
+from typing import Dict, Any, List, Iterator
+from config import RECENT_OPPONENT_WINDOW
+
+# Index cho từng collection, thiết kế theo các dạng truy vấn bên dưới
+INDEX_SPECS: Dict[str, List[Dict[str, Any]]] = {
+    "players": [
+        {"keys": [("user_id", 1)], "unique": True},
+        {"keys": [("exp", -1)]},  # Top người chơi
+        {"keys": [("sect", 1), ("exp", -1)]},  # Xếp hạng trong môn phái
+    ],
+    "combat_history": [
+        # Lịch sử/đối thủ của một người chơi: mỗi nhánh $or dùng một index, sắp xếp theo thời gian
+        {"keys": [("attacker_id", 1), ("timestamp", -1)]},
+        {"keys": [("defender_id", 1), ("timestamp", -1)]},
+        # TTL: tự động xóa sau 30 ngày
+        {"keys": [("timestamp", 1)], "expireAfterSeconds": 30 * 24 * 60 * 60},
+    ],
+}
+
+# Index cũ được thay thế bởi thiết kế trên (prefix của index mới hoặc không dùng được)
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    "combat_history": [
+        "timestamp_-1_attacker_id_1_defender_id_1",
+        "attacker_id_1",
+        "defender_id_1",
+    ],
+}
+
+# Các dạng truy vấn mà MongoDB handler phát ra, dùng để kiểm tra explain khi khởi động.
+# "pipeline": dạng aggregate (chỉ cần các stage đầu quyết định việc dùng index).
+# "allow_collscan": lý do COLLSCAN được chấp nhận có chủ ý (chỉ ghi log, không cảnh báo).
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"name": "get_player", "collection": "players", "filter": {"user_id": 0}},
+    {"name": "bulk_increment_exp (đọc lại)", "collection": "players", "filter": {"user_id": {"$in": [0, 1]}}},
+    {"name": "get_player_ranking", "collection": "players", "filter": {}, "sort": [("exp", -1)], "limit": 10},
+    {"name": "get_sect_ranking", "collection": "players", "filter": {"sect": ""}, "sort": [("exp", -1)],
+     "limit": 10},
+    {"name": "get_combat_history", "collection": "combat_history",
+     "filter": {"$or": [{"attacker_id": 0}, {"defender_id": 0}]}, "sort": [("timestamp", -1)], "limit": 10},
+    {"name": "get_recent_opponents", "collection": "combat_history", "pipeline": [
+        {"$match": {"$or": [{"attacker_id": 0}, {"defender_id": 0}]}},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": RECENT_OPPONENT_WINDOW},
+    ]},
+    {"name": "get_sect_stats (một môn phái)", "collection": "players",
+     "pipeline": [{"$match": {"sect": ""}}]},
+    {"name": "get_sect_stats (tất cả)", "collection": "players",
+     "pipeline": [{"$match": {"sect": {"$ne": None}}}]},
+    {"name": "bảng xếp hạng PvP (dự phòng)", "collection": "players",
+     "filter": {"$or": [{"stats.pvp_wins": {"$gt": 0}}, {"stats.pvp_losses": {"$gt": 0}}]},
+     "allow_collscan": "chỉ chạy khi bảng xếp hạng trong bộ nhớ chưa sẵn sàng; "
+                       "không đáng thêm hai index phải cập nhật sau mỗi trận PvP"},
+]
+
+
+def iter_plan_stages(plan: Dict[str, Any]) -> Iterator[str]:
+    """Duyệt đệ quy tên các stage trong một query plan"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from iter_plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from iter_plan_stages(child)
+
+
+def winning_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """Lấy winning plan từ kết quả explain của find hoặc aggregate"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # Aggregate trên các bản MongoDB cũ: plan nằm trong stage $cursor đầu tiên
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    return (planner or {}).get("winningPlan", {})
+
+
+async def explain_query_shapes(database) -> List[str]:
+    """Chạy explain cho các dạng truy vấn đã đăng ký, ghi log những truy vấn bị COLLSCAN
+
+    Trả về tên các truy vấn bị quét toàn bộ collection (trừ các truy vấn allow_collscan).
+    """
+    collscans = []
+    for shape in QUERY_SHAPES:
+        try:
+            if shape.get("pipeline"):
+                explain = await database.command(
+                    "aggregate", shape["collection"], pipeline=shape["pipeline"], explain=True)
+            else:
+                cursor = database[shape["collection"]].find(shape["filter"])
+                if shape.get("sort"):
+                    cursor = cursor.sort(shape["sort"])
+                if shape.get("limit"):
+                    cursor = cursor.limit(shape["limit"])
+                explain = await cursor.explain()
+
+            stages = list(iter_plan_stages(winning_plan(explain)))
+            if "COLLSCAN" in stages:
+                if shape.get("allow_collscan"):
+                    logging.info(f"Truy vấn '{shape['name']}' COLLSCAN có chủ ý: {shape['allow_collscan']}")
+                    continue
+                collscans.append(shape["name"])
+                message = f"Truy vấn '{shape['name']}' đang COLLSCAN: {' <- '.join(stages)}"
+                logging.warning(message)
+                print(f"⚠️ {message}")
+        except Exception as e:
+            print(f"❌ Lỗi khi explain truy vấn '{shape['name']}': {e}")
+
+    if not collscans:
+        print(f"✓ {len(QUERY_SHAPES)} dạng truy vấn đều dùng index (hoặc COLLSCAN có chủ ý)")
+    return collscans
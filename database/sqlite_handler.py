@@ -0,0 +1,643 @@
+# database/sqlite_handler.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from database.locks import LockRegistry
+from database.player_cache import PlayerCache
+from database.leaderboard import Leaderboard
+from database.storage import new_player_document
+from database.documents import apply_update, matches, project, sort_documents
+from database.query_plans import INDEX_SPECS
+from config import (
+    PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL,
+    OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL, RECENT_OPPONENT_WINDOW,
+    SQLITE_PATH
+)
+from modules.utils import mongo_utils
+
+# Người chơi và lịch sử đấu lưu dạng JSON, các trường dùng để lọc/sắp xếp được tách thành cột có index
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    user_id INTEGER PRIMARY KEY,
+    exp INTEGER NOT NULL DEFAULT 0,
+    level TEXT,
+    sect TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_players_exp ON players (exp DESC);
+CREATE INDEX IF NOT EXISTS idx_players_sect_exp ON players (sect, exp DESC);
+
+CREATE TABLE IF NOT EXISTS combat_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    attacker_id INTEGER,
+    defender_id INTEGER,
+    timestamp TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_attacker ON combat_history (attacker_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_history_defender ON combat_history (defender_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON combat_history (timestamp);
+"""
+
+SELECT_PLAYER = "SELECT doc FROM players WHERE user_id = ?"
+INSERT_PLAYER = "INSERT INTO players (user_id, exp, level, sect, doc) VALUES (?, ?, ?, ?, ?)"
+UPDATE_PLAYER = "UPDATE players SET exp = ?, level = ?, sect = ?, doc = ? WHERE user_id = ?"
+SELECT_TOP = "SELECT doc FROM players ORDER BY exp DESC LIMIT ?"
+SELECT_SECT_TOP = "SELECT doc FROM players WHERE sect = ? ORDER BY exp DESC LIMIT ?"
+SELECT_PAGE = "SELECT user_id, doc FROM players WHERE user_id > ? ORDER BY user_id LIMIT ?"
+INSERT_HISTORY = "INSERT INTO combat_history (attacker_id, defender_id, timestamp, doc) VALUES (?, ?, ?, ?)"
+PURGE_HISTORY = "DELETE FROM combat_history WHERE timestamp < ?"
+# Mỗi nhánh dùng một index (giống $or với hai index bên MongoDB)
+SELECT_HISTORY = """
+SELECT id, attacker_id, defender_id, timestamp, doc FROM (
+    SELECT id, attacker_id, defender_id, timestamp, doc FROM combat_history WHERE attacker_id = ?
+    UNION ALL
+    SELECT id, attacker_id, defender_id, timestamp, doc FROM combat_history
+    WHERE defender_id = ? AND attacker_id != ?
+) ORDER BY timestamp DESC LIMIT ?
+"""
+SELECT_SECT_STATS = """
+SELECT sect, COALESCE(level, 'Phàm Nhân'), COUNT(*), SUM(exp), MAX(exp),
+       SUM(COALESCE(json_extract(doc, '$.daily_streak'), 0)),
+       SUM(COALESCE(json_extract(doc, '$.stats.monsters_killed'), 0)),
+       SUM(COALESCE(json_extract(doc, '$.stats.bosses_killed'), 0)),
+       SUM(COALESCE(json_extract(doc, '$.stats.pvp_wins'), 0)),
+       SUM(COALESCE(json_extract(doc, '$.stats.pvp_losses'), 0)),
+       SUM(COALESCE(json_extract(doc, '$.stats.total_exp_gained'), 0))
+FROM players WHERE sect IS NOT NULL {sect_filter}
+GROUP BY sect, COALESCE(level, 'Phàm Nhân')
+"""
+
+# Các truy vấn kiểm tra bằng EXPLAIN QUERY PLAN khi khởi động (tương ứng QUERY_SHAPES bên MongoDB)
+QUERY_SHAPES: List[Tuple[str, str, tuple]] = [
+    ("get_player", SELECT_PLAYER, (0,)),
+    ("get_player_ranking", SELECT_TOP, (10,)),
+    ("get_sect_ranking", SELECT_SECT_TOP, ("", 10)),
+    ("get_combat_history", SELECT_HISTORY, (0, 0, 0, 10)),
+]
+
+# Thời hạn lưu lịch sử đấu, lấy theo TTL index bên MongoDB
+HISTORY_TTL = next(spec["expireAfterSeconds"] for spec in INDEX_SPECS["combat_history"]
+                   if "expireAfterSeconds" in spec)
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Không thể lưu kiểu {type(value).__name__}")
+
+
+def _decode(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def dumps(doc: Dict[str, Any]) -> str:
+    """Mã hóa document thành JSON (datetime giữ được kiểu khi đọc lại)"""
+    return json.dumps(doc, default=_encode, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(text: str) -> Dict[str, Any]:
+    """Giải mã document đã lưu"""
+    return json.loads(text, object_hook=_decode)
+
+
+def _timestamp(value: datetime) -> str:
+    # Độ dài cố định để so sánh chuỗi đúng thứ tự thời gian
+    return value.isoformat(timespec="microseconds")
+
+
+class SQLiteDB:
+    """Backend SQLite cục bộ với cùng giao diện như MongoDB
+
+    Một kết nối duy nhất (WAL) chạy trên một thread riêng, mọi truy vấn được
+    đẩy ra khỏi event loop bằng run_in_executor. Vì chỉ có một thread ghi, mỗi
+    thao tác đọc-sửa-ghi trên một document là nguyên tử.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.db_name = os.path.basename(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.is_connected = False
+        self.locks = LockRegistry("db")  # Lock theo user_id, tự thu hồi khi không dùng
+        self.cache = PlayerCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)  # Cache người chơi dùng chung cho mọi cog
+        self.leaderboard = Leaderboard(self)  # Bảng xếp hạng trong bộ nhớ, cập nhật theo mỗi lần ghi
+        self.opponent_cache = PlayerCache(OPPONENT_CACHE_SIZE, OPPONENT_CACHE_TTL)  # Đối thủ thường gặp theo user_id
+
+    async def _run(self, fn, *args):
+        """Chạy hàm đồng bộ trên thread của kết nối"""
+        if not self.is_connected:
+            await self.connect()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, cached_statements=128)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def connect(self) -> bool:
+        """Mở kết nối SQLite và tạo bảng nếu chưa có"""
+        if self.is_connected:
+            return True
+
+        try:
+            print("\n=== Kết Nối SQLite ===")
+            print(f"Database: {self.path}")
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+            self.is_connected = True
+            print("✓ Kết nối SQLite thành công!")
+            return True
+        except Exception as e:
+            print(f"❌ Lỗi kết nối SQLite: {e}")
+            logging.error(f"Không thể mở database SQLite {self.path}: {e}")
+            raise ConnectionError(f"Không thể mở database SQLite: {e}")
+
+    def get_lock(self, user_id: int):
+        """Lấy lock cho người chơi để tránh race condition"""
+        return self.locks.hold(user_id)
+
+    async def setup(self):
+        """Khởi tạo kết nối và setup database"""
+        await self.setup_indexes()
+
+    async def setup_indexes(self):
+        """Tạo bảng/index và dọn lịch sử đấu đã hết hạn"""
+        try:
+            removed = await self._run(self._purge_history_sync)
+            if removed:
+                print(f"✓ Đã xóa {removed} lịch sử đấu quá hạn")
+            print("✓ Đã tạo indexes thành công!")
+        except Exception as e:
+            print(f"❌ Lỗi khi tạo indexes: {e}")
+            raise
+
+    async def check_query_plans(self) -> List[str]:
+        """Kiểm tra EXPLAIN QUERY PLAN cho các truy vấn đã đăng ký, trả về các truy vấn quét toàn bảng"""
+        scans = []
+        for name, sql, params in QUERY_SHAPES:
+            try:
+                rows = await self._run(self._explain_sync, sql, params)
+                details = [row[-1] for row in rows]
+                if any(detail.startswith("SCAN") and "USING" not in detail for detail in details):
+                    scans.append(name)
+                    message = f"Truy vấn '{name}' đang quét toàn bảng: {' | '.join(details)}"
+                    logging.warning(message)
+                    print(f"⚠️ {message}")
+            except Exception as e:
+                print(f"❌ Lỗi khi explain truy vấn '{name}': {e}")
+
+        if not scans:
+            print("✓ Các truy vấn chính đều dùng index")
+        return scans
+
+    # ===== Thao tác đồng bộ (chỉ chạy trên thread của kết nối) =====
+
+    def _explain_sync(self, sql: str, params: tuple) -> List[tuple]:
+        return self._conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+
+    def _purge_history_sync(self) -> int:
+        cutoff = _timestamp(datetime.now() - timedelta(seconds=HISTORY_TTL))
+        with self._conn:
+            return self._conn.execute(PURGE_HISTORY, (cutoff,)).rowcount
+
+    def _fetch_player_sync(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(SELECT_PLAYER, (user_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def _insert_player_sync(self, player: Dict[str, Any]):
+        with self._conn:
+            self._conn.execute(INSERT_PLAYER, (player["user_id"], player.get("exp") or 0, player.get("level"),
+                                               player.get("sect"), dumps(player)))
+
+    def _store_player(self, player: Dict[str, Any]):
+        self._conn.execute(UPDATE_PLAYER, (player.get("exp") or 0, player.get("level"), player.get("sect"),
+                                           dumps(player), player["user_id"]))
+
+    def _update_players_sync(self, updates: Dict[int, Tuple[Dict[str, Any], Dict[str, Any]]],
+                             floor_exp: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Áp dụng ($set, $inc) cho nhiều người chơi trong một transaction, trả về bản sau cập nhật"""
+        updated = {}
+        with self._conn:
+            for user_id, (set_fields, inc_fields) in updates.items():
+                player = self._fetch_player_sync(user_id)
+                if player is None:
+                    continue
+                apply_update(player, set_fields, inc_fields)
+                if floor_exp and player.get("exp", 0) < 0:
+                    player["exp"] = 0
+                self._store_player(player)
+                updated[user_id] = player
+        return updated
+
+    def _query_docs_sync(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        return [loads(row[0]) for row in self._conn.execute(sql, params)]
+
+    def _scan_players_sync(self, query: Optional[Dict], projection: Optional[List[str]],
+                           after: int, batch_size: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Một trang người chơi theo user_id tăng dần; trả về (kết quả đã lọc, user_id cuối hoặc None nếu hết)"""
+        rows = self._conn.execute(SELECT_PAGE, (after, batch_size)).fetchall()
+        players = []
+        for _, doc in rows:
+            player = loads(doc)
+            if matches(player, query):
+                players.append(project(player, projection))
+        last = rows[-1][0] if len(rows) == batch_size else None
+        return players, last
+
+    def _select_players_sync(self, query: Optional[Dict], projection: Optional[List[str]],
+                             sort: List, limit: int) -> List[Dict[str, Any]]:
+        players = [player for player in (loads(row[0]) for row in self._conn.execute("SELECT doc FROM players"))
+                   if matches(player, query)]
+        sort_documents(players, sort)
+        if limit:
+            players = players[:limit]
+        return [project(player, projection) for player in players]
+
+    def _sect_stats_sync(self, sect: Optional[str]) -> List[tuple]:
+        if sect:
+            return self._conn.execute(SELECT_SECT_STATS.format(sect_filter="AND sect = ?"), (sect,)).fetchall()
+        return self._conn.execute(SELECT_SECT_STATS.format(sect_filter="")).fetchall()
+
+    def _insert_history_sync(self, documents: List[Dict[str, Any]]) -> int:
+        cutoff = _timestamp(datetime.now() - timedelta(seconds=HISTORY_TTL))
+        with self._conn:
+            self._conn.executemany(INSERT_HISTORY, [
+                (doc.get("attacker_id"), doc.get("defender_id"), _timestamp(doc["timestamp"]), dumps(doc))
+                for doc in documents
+            ])
+            # TTL: bỏ các trận quá hạn (dùng index timestamp)
+            self._conn.execute(PURGE_HISTORY, (cutoff,))
+        return len(documents)
+
+    def _history_sync(self, user_id: int, limit: int) -> List[tuple]:
+        return self._conn.execute(SELECT_HISTORY, (user_id, user_id, user_id, limit)).fetchall()
+
+    # ===== Giao diện giống MongoDB =====
+
+    async def get_player(self, user_id: int, use_cache: bool = True) -> Optional[Dict]:
+        """Lấy thông tin người chơi (ưu tiên cache dùng chung)"""
+        if use_cache:
+            player = self.cache.get(user_id)
+            if player is not None:
+                return player
+
+        try:
+            player = await self._run(self._fetch_player_sync, user_id)
+            if player:
+                self.cache.set(user_id, player)
+                return player
+            return None
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy thông tin người chơi {user_id}: {e}")
+            return None
+
+    async def create_player(self, user_id: int, sect: str) -> bool:
+        """Tạo người chơi mới với dữ liệu ban đầu"""
+        try:
+            player_data = new_player_document(user_id, sect)
+
+            await self._run(self._insert_player_sync, player_data)
+            self.cache.invalidate(user_id)
+            self.leaderboard.apply_player(player_data)
+            return True
+        except Exception as e:
+            print(f"❌ Lỗi khi tạo người chơi {user_id}: {e}")
+            return False
+
+    async def update_player(self, user_id: int, **kwargs) -> bool:
+        """Cập nhật thông tin người chơi với khóa để tránh xung đột"""
+        try:
+            async with self.get_lock(user_id):
+                # Hỗ trợ ký hiệu stats__pvp_wins -> stats.pvp_wins
+                update_data = {key.replace('__', '.'): value for key, value in kwargs.items()}
+                update_data['updated_at'] = datetime.now()
+
+                updated = await self._run(self._update_players_sync, {user_id: (update_data, None)})
+                self.cache.invalidate(user_id)
+                self.leaderboard.apply_player({"user_id": user_id, **kwargs})
+                return user_id in updated
+        except Exception as e:
+            print(f"❌ Lỗi khi cập nhật người chơi {user_id}: {e}")
+            return False
+
+    async def increment_exp(self, user_id: int, amount: int, stats: Optional[Dict[str, int]] = None,
+                            **fields) -> Optional[Dict]:
+        """Cộng/trừ exp nguyên tử và trả về dữ liệu người chơi sau cập nhật
+
+        stats: các chỉ số stats.* cần tăng cùng lúc; fields: các trường cần $set cùng lúc.
+        Khi trừ exp, exp không xuống dưới 0.
+        """
+        try:
+            set_data = dict(fields)
+            set_data['updated_at'] = datetime.now()
+            inc_data = {"exp": amount}
+            inc_data.update({f"stats.{k}": v for k, v in (stats or {}).items()})
+
+            updated = await self._run(self._update_players_sync, {user_id: (set_data, inc_data)}, amount < 0)
+            player = updated.get(user_id)
+            if player:
+                self.cache.set(user_id, player)
+                self.leaderboard.apply_player(player)
+                return player
+            self.cache.invalidate(user_id)
+            return None
+        except Exception as e:
+            print(f"❌ Lỗi khi cộng exp cho người chơi {user_id}: {e}")
+            return None
+
+    async def increment_player_stats(self, user_id: int, **stats) -> bool:
+        """Tăng các chỉ số thống kê của người chơi"""
+        try:
+            async with self.get_lock(user_id):
+                inc_data = {f"stats.{k}": v for k, v in stats.items()}
+                updated = await self._run(self._update_players_sync, {user_id: (None, inc_data)})
+                self.cache.invalidate(user_id)
+                if user_id in updated:
+                    self.leaderboard.apply_player(updated[user_id])
+                return user_id in updated
+        except Exception as e:
+            print(f"❌ Lỗi khi tăng chỉ số người chơi {user_id}: {e}")
+            return False
+
+    async def bulk_increment_exp(self, deltas: Dict[int, int]) -> List[Dict]:
+        """Cộng exp cho nhiều người chơi trong một transaction
+
+        Trả về user_id, exp và level sau khi cập nhật.
+        Ném lỗi ra ngoài để bên gọi có thể giữ lại exp chưa ghi được.
+        """
+        if not deltas:
+            return []
+
+        current_time = datetime.now()
+        updates = {
+            user_id: ({"updated_at": current_time}, {"exp": amount, "stats.total_exp_gained": amount})
+            for user_id, amount in deltas.items()
+        }
+        try:
+            updated = await self._run(self._update_players_sync, updates)
+        finally:
+            for user_id in deltas:
+                self.cache.invalidate(user_id)
+
+        players = [
+            {"user_id": user_id, "exp": player.get("exp", 0), "level": player.get("level")}
+            for user_id, player in updated.items()
+        ]
+        for player in players:
+            self.leaderboard.apply_player(player)
+        return players
+
+    async def bulk_increment_rewards(self, exp: Dict[int, int], stats: Optional[Dict[str, int]] = None,
+                                     **fields) -> Dict[int, Dict]:
+        """Phát thưởng cho nhiều người chơi trong một transaction
+
+        exp: user_id -> exp được cộng (không âm); stats và fields áp dụng chung cho
+        mọi người giống increment_exp. Trả về dữ liệu sau cập nhật theo user_id.
+        """
+        if not exp:
+            return {}
+
+        try:
+            set_data = dict(fields)
+            set_data['updated_at'] = datetime.now()
+            stat_data = {f"stats.{k}": v for k, v in (stats or {}).items()}
+            updates = {user_id: (set_data, {"exp": amount, **stat_data}) for user_id, amount in exp.items()}
+
+            try:
+                players = await self._run(self._update_players_sync, updates)
+            finally:
+                for user_id in exp:
+                    self.cache.invalidate(user_id)
+
+            for user_id, player in players.items():
+                self.cache.set(user_id, player)
+                self.leaderboard.apply_player(player)
+            return players
+        except Exception as e:
+            print(f"❌ Lỗi khi phát thưởng cho {len(exp)} người chơi: {e}")
+            return {}
+
+    async def iter_players(self, query: Optional[Dict] = None, projection: Optional[List[str]] = None,
+                           batch_size: int = 500, sort: Optional[List] = None,
+                           limit: int = 0, raise_errors: bool = False) -> AsyncIterator[Dict]:
+        """Duyệt người chơi theo từng trang, chỉ trả về các trường cần thiết
+
+        Không sắp xếp: đọc từng trang batch_size theo user_id. Có sort: lọc và
+        sắp xếp toàn bộ trên thread của kết nối rồi trả về.
+        raise_errors: ném lỗi ra ngoài thay vì dừng im lặng (khi bên gọi cần dữ liệu đầy đủ).
+        """
+        try:
+            if sort:
+                for player in await self._run(self._select_players_sync, query, projection, sort, limit):
+                    yield player
+                return
+
+            after, returned = -(1 << 63), 0
+            while after is not None:
+                players, after = await self._run(self._scan_players_sync, query, projection, after, batch_size)
+                for player in players:
+                    yield player
+                    returned += 1
+                    if limit and returned >= limit:
+                        return
+        except Exception as e:
+            print(f"❌ Lỗi khi duyệt danh sách người chơi: {e}")
+            if raise_errors:
+                raise
+
+    async def get_player_ranking(self, limit: int = 10) -> List[Dict]:
+        """Lấy xếp hạng người chơi dựa trên exp"""
+        try:
+            return await self._run(self._query_docs_sync, SELECT_TOP, (limit,))
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy xếp hạng người chơi: {e}")
+            return []
+
+    async def get_top_players(self, limit: int = 10) -> List[Dict]:
+        """Top người chơi theo exp (lấy từ bảng xếp hạng trong bộ nhớ nếu đã sẵn sàng)"""
+        if self.leaderboard.ready:
+            return self.leaderboard.top_exp(limit)
+        return await self.get_player_ranking(limit)
+
+    async def get_sect_ranking(self, sect: str, limit: int = 10) -> List[Dict]:
+        """Lấy xếp hạng người chơi trong môn phái"""
+        try:
+            return await self._run(self._query_docs_sync, SELECT_SECT_TOP, (sect, limit))
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy xếp hạng môn phái {sect}: {e}")
+            return []
+
+    async def get_sect_stats(self, sect: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Thống kê môn phái bằng GROUP BY (một lần truy vấn cho tất cả môn phái)
+
+        Trả về cùng cấu trúc với MongoDB.get_sect_stats.
+        """
+        try:
+            rows = await self._run(self._sect_stats_sync, sect)
+
+            result = {}
+            for (sect_name, level, count, total_exp, highest_exp, daily_streak,
+                 monsters, bosses, wins, losses, exp_gained) in rows:
+                entry = result.setdefault(sect_name, {
+                    "members": 0,
+                    "total_exp": 0,
+                    "avg_exp": 0,
+                    "highest_exp": 0,
+                    "total_daily_streak": 0,
+                    "level_distribution": {},
+                    "stats": {
+                        "monsters_killed": 0,
+                        "bosses_killed": 0,
+                        "pvp_wins": 0,
+                        "pvp_losses": 0,
+                        "total_exp_gained": 0
+                    }
+                })
+                entry["members"] += count
+                entry["total_exp"] += total_exp or 0
+                entry["highest_exp"] = max(entry["highest_exp"], highest_exp or 0)
+                entry["total_daily_streak"] += daily_streak
+                entry["level_distribution"][level] = count
+                entry["stats"]["monsters_killed"] += monsters
+                entry["stats"]["bosses_killed"] += bosses
+                entry["stats"]["pvp_wins"] += wins
+                entry["stats"]["pvp_losses"] += losses
+                entry["stats"]["total_exp_gained"] += exp_gained
+
+            for entry in result.values():
+                entry["avg_exp"] = entry["total_exp"] // entry["members"] if entry["members"] else 0
+            return result
+        except Exception as e:
+            print(f"❌ Lỗi khi thống kê môn phái: {e}")
+            return {}
+
+    async def add_combat_history(self, attacker_id: int, defender_id: int, result: str,
+                                 exp_gained: int = 0, friendly: bool = False,
+                                 rounds: Optional[List[Dict]] = None) -> bool:
+        """Thêm lịch sử đánh nhau giữa người chơi (ghi ngay một bản ghi)"""
+        try:
+            combat_data = {
+                "attacker_id": attacker_id,
+                "defender_id": defender_id,
+                "result": result,
+                "exp_gained": exp_gained,
+                "friendly": friendly,
+                "rounds": rounds or [],
+                "timestamp": datetime.now()
+            }
+            return await self.insert_combat_history([combat_data]) > 0
+        except Exception as e:
+            print(f"❌ Lỗi khi thêm lịch sử đánh nhau: {e}")
+            return False
+
+    async def insert_combat_history(self, records: List[Dict[str, Any]]) -> int:
+        """Ghi nhiều trận đấu bằng một lần executemany trong một transaction
+
+        Trả về số bản ghi đã ghi. Lỗi được ném ra ngoài để bên gọi ghi lại sau.
+        """
+        if not records:
+            return 0
+
+        documents = []
+        for record in records:
+            document = dict(record)
+            document.setdefault("timestamp", datetime.now())
+            document["schema_version"] = mongo_utils.SCHEMA_VERSION
+            documents.append(document)
+
+        try:
+            return await self._run(self._insert_history_sync, documents)
+        finally:
+            # Có trận mới: bỏ kết quả đối thủ thường gặp đã ghi nhớ
+            for document in documents:
+                self.opponent_cache.invalidate(document.get("attacker_id"))
+                self.opponent_cache.invalidate(document.get("defender_id"))
+
+    async def get_recent_opponents(self, user_id: int, limit: int = 3) -> List[Tuple[int, int]]:
+        """Các đối thủ gặp nhiều nhất trong RECENT_OPPONENT_WINDOW trận gần đây
+
+        Trả về danh sách (opponent_id, số_trận). Kết quả được ghi nhớ theo người chơi
+        và bị xóa khi có trận đấu mới của người đó.
+        """
+        cached = self.opponent_cache.get(user_id)
+        if cached is not None and cached["limit"] >= limit:
+            return cached["opponents"][:limit]
+
+        try:
+            rows = await self._run(self._history_sync, user_id, RECENT_OPPONENT_WINDOW)
+
+            counts: Dict[int, List] = {}
+            for _, attacker_id, defender_id, timestamp, _ in rows:
+                opponent_id = defender_id if attacker_id == user_id else attacker_id
+                entry = counts.setdefault(opponent_id, [0, timestamp])
+                entry[0] += 1
+                entry[1] = max(entry[1], timestamp)
+
+            ranked = sorted(counts.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)
+            opponents = [(opponent_id, count) for opponent_id, (count, _) in ranked[:limit]]
+            self.opponent_cache.set(user_id, {"limit": limit, "opponents": opponents})
+            return opponents
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy đối thủ thường gặp của người chơi {user_id}: {e}")
+            return []
+
+    async def get_combat_history(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Lấy lịch sử đánh nhau của người chơi"""
+        try:
+            rows = await self._run(self._history_sync, user_id, limit)
+            return [{"_id": row_id, **loads(doc)} for row_id, _, _, _, doc in rows]
+        except Exception as e:
+            print(f"❌ Lỗi khi lấy lịch sử đánh nhau của người chơi {user_id}: {e}")
+            return []
+
+    async def test_connection(self) -> Dict[str, Any]:
+        """Kiểm tra kết nối và trả về thông tin chi tiết"""
+        try:
+            start_time = time.perf_counter()
+            await self._run(lambda: self._conn.execute("SELECT 1").fetchone())
+            ping_time = (time.perf_counter() - start_time) * 1000
+
+            return {
+                "success": True,
+                "database": self.path,
+                "ping_ms": round(ping_time, 2),
+                "server_version": f"SQLite {sqlite3.sqlite_version}",
+                "connection_count": 1
+            }
+        except Exception as e:
+            logging.error(f"Lỗi khi kiểm tra kết nối: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "details": "Không thể mở database SQLite"
+            }
+
+    async def close(self):
+        """Đóng kết nối database an toàn"""
+        await self.leaderboard.stop()
+        if self._conn:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.is_connected = False
+        logging.info("Đã đóng kết nối SQLite an toàn")
+        print("✓ Đã đóng kết nối SQLite an toàn")
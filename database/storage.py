@@ -0,0 +1,139 @@
+# database/storage.py
+from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple, Protocol, runtime_checkable
+from modules.utils import mongo_utils
+from config import DATABASE_BACKEND
+
+# Các backend có thể chọn bằng DATABASE_BACKEND trong .env
+BACKENDS = ("mongodb", "sqlite", "memory")
+
+
+class PartialWriteError(Exception):
+    """Lô ghi hàng loạt chỉ thành công một phần
+
+    failed chứa các mục chưa được ghi (bên gọi chỉ cần ghi lại các mục này),
+    players là dữ liệu sau cập nhật của các mục đã ghi thành công.
+    """
+
+    def __init__(self, failed: Dict[int, int], players: List[Dict[str, Any]], message: str = ""):
+        super().__init__(message or f"{len(failed)} thao tác ghi thất bại")
+        self.failed = failed
+        self.players = players
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """Giao diện lưu trữ mà các cog dùng qua bot.db
+
+    MongoDB, SQLiteDB và MemoryDB đều triển khai giao diện này; cog chỉ được
+    gọi các phương thức dưới đây để có thể đổi backend bằng cấu hình.
+    """
+
+    is_connected: bool
+    cache: Any  # PlayerCache dùng chung cho mọi cog
+    leaderboard: Any  # Leaderboard trong bộ nhớ
+    opponent_cache: Any
+    locks: Any
+
+    async def connect(self) -> bool: ...
+
+    async def close(self): ...
+
+    async def setup(self): ...
+
+    async def setup_indexes(self): ...
+
+    async def check_query_plans(self) -> List[str]: ...
+
+    async def test_connection(self) -> Dict[str, Any]: ...
+
+    def get_lock(self, user_id: int): ...
+
+    # Người chơi
+    async def get_player(self, user_id: int, use_cache: bool = True) -> Optional[Dict]: ...
+
+    async def create_player(self, user_id: int, sect: str) -> bool: ...
+
+    async def update_player(self, user_id: int, **kwargs) -> bool: ...
+
+    async def increment_exp(self, user_id: int, amount: int, stats: Optional[Dict[str, int]] = None,
+                            **fields) -> Optional[Dict]: ...
+
+    async def increment_player_stats(self, user_id: int, **stats) -> bool: ...
+
+    async def bulk_increment_exp(self, deltas: Dict[int, int]) -> List[Dict]: ...
+
+    async def bulk_increment_rewards(self, exp: Dict[int, int], stats: Optional[Dict[str, int]] = None,
+                                     **fields) -> Dict[int, Dict]: ...
+
+    def iter_players(self, query: Optional[Dict] = None, projection: Optional[List[str]] = None,
+                     batch_size: int = 500, sort: Optional[List] = None,
+                     limit: int = 0, raise_errors: bool = False) -> AsyncIterator[Dict]: ...
+
+    # Xếp hạng và thống kê
+    async def get_player_ranking(self, limit: int = 10) -> List[Dict]: ...
+
+    async def get_top_players(self, limit: int = 10) -> List[Dict]: ...
+
+    async def get_sect_ranking(self, sect: str, limit: int = 10) -> List[Dict]: ...
+
+    async def get_sect_stats(self, sect: Optional[str] = None) -> Dict[str, Dict[str, Any]]: ...
+
+    # Lịch sử đấu
+    async def add_combat_history(self, attacker_id: int, defender_id: int, result: str,
+                                 exp_gained: int = 0, friendly: bool = False,
+                                 rounds: Optional[List[Dict]] = None) -> bool: ...
+
+    async def insert_combat_history(self, records: List[Dict[str, Any]]) -> int: ...
+
+    async def get_recent_opponents(self, user_id: int, limit: int = 3) -> List[Tuple[int, int]]: ...
+
+    async def get_combat_history(self, user_id: int, limit: int = 10) -> List[Dict]: ...
+
+
+def new_player_document(user_id: int, sect: str) -> Dict[str, Any]:
+    """Dữ liệu ban đầu của người chơi mới (dùng chung cho mọi backend)"""
+    current_time = datetime.now()
+    return {
+        "user_id": user_id,
+        "schema_version": mongo_utils.SCHEMA_VERSION,
+        "level": "Phàm Nhân",
+        "exp": 0,
+        "sect": sect,
+        "hp": 100,
+        "attack": 10,
+        "defense": 5,
+        "last_train": current_time,
+        "last_monster": current_time,
+        "last_boss": current_time,
+        "last_daily": current_time,
+        "daily_streak": 0,
+        "created_at": current_time,
+        "updated_at": current_time,
+        "stats": {
+            "monsters_killed": 0,
+            "bosses_killed": 0,
+            "pvp_wins": 0,
+            "pvp_losses": 0,
+            "total_exp_gained": 0
+        }
+    }
+
+
+def create_storage(backend: str = DATABASE_BACKEND) -> Storage:
+    """Khởi tạo backend lưu trữ theo tên
+
+    Import trễ để backend không dùng tới (ví dụ motor khi chạy SQLite/bộ nhớ)
+    không cần được cài đặt.
+    """
+    backend = (backend or "mongodb").lower()
+    if backend == "sqlite":
+        from database.sqlite_handler import SQLiteDB
+        return SQLiteDB()
+    if backend == "memory":
+        from database.memory_handler import MemoryDB
+        return MemoryDB()
+    if backend == "mongodb":
+        from database.mongo_handler import MongoDB
+        return MongoDB()
+    raise ValueError(f"DATABASE_BACKEND không hợp lệ: {backend} (chọn một trong {', '.join(BACKENDS)})")
@@ -0,0 +1,591 @@
+# load_test.py
+"""Chạy thử tải offline cho các cog, không cần Discord hay MongoDB
+
+Các cog (Cultivation, Combat, Monster, Sect, Daily, Commands) được khởi tạo
+với bot/ctx/Member/Message giả và backend lưu trữ cục bộ (memory hoặc SQLite),
+sau đó phát lại lưu lượng tổng hợp theo phân phối Poisson và báo cáo độ trễ
+p50/p95/p99 cùng số lần gọi database cho từng lệnh.
+
+Ví dụ:
+    python load_test.py --players 2000 --rate 50 --duration 30
+    python load_test.py --backend sqlite --mix chat=80,danhquai=10,top=10
+"""
+import argparse
+import asyncio
+import contextvars
+import inspect
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+# config.py yêu cầu token và cấu hình MongoDB khi import: harness không kết nối Discord
+os.environ.setdefault('DISCORD_TOKEN', 'load-test')
+os.environ.setdefault('DATABASE_BACKEND', 'memory')
+
+import discord
+
+from config import SECTS
+from database.storage import create_storage
+from database.exp_buffer import ExpBuffer
+from database.combat_history_writer import CombatHistoryWriter
+from modules.edit_coalescer import EditCoalescer
+from modules.levels import level_table
+from modules import cultivation, combat, monster, sect, daily, commands
+
+# Các loại lưu lượng có thể phát lại
+SCENARIOS = ("chat", "voice", "danhquai", "combat", "top", "sect", "tuvi", "daily")
+
+# Tỷ lệ mặc định của các loại lưu lượng
+DEFAULT_MIX = "chat=60,voice=10,danhquai=10,combat=8,top=5,sect=5,tuvi=2"
+
+# Sleep dài hơn ngưỡng này là vòng lặp định kỳ (dọn dẹp boss, thống kê phái), không rút ngắn
+EFFECT_SLEEP_LIMIT = 10
+
+# Lệnh đang chạy trong task hiện tại (để gán số lần gọi database)
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar("current_command", default="background")
+# Tin nhắn bot đã gửi trong lần gọi hiện tại (để phát hiện phản hồi lỗi)
+current_replies: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("current_replies", default=None)
+
+_ids = itertools.count(1)
+
+
+class ScaledAsyncio:
+    """Thay module asyncio trong các cog để rút ngắn sleep hiệu ứng (đếm ngược, "đang tìm quái")"""
+
+    def __init__(self, scale: float):
+        self.scale = scale
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay, result=None):
+        if delay <= EFFECT_SLEEP_LIMIT:
+            delay *= self.scale
+        return await asyncio.sleep(delay, result)
+
+
+class FakeDiscordApi:
+    """Độ trễ giả lập của Discord REST API cho send/edit/delete"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    async def call(self, method: str):
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+
+class StubMessage:
+    """Tin nhắn giả: chỉ ghi lại nội dung và các lần sửa/xóa"""
+
+    def __init__(self, api: FakeDiscordApi, channel, author=None, content: Optional[str] = None, embed=None):
+        self.api = api
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.deleted = False
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        await self.api.call("edit")
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        return self
+
+    async def delete(self, **kwargs):
+        await self.api.call("delete")
+        self.deleted = True
+
+    async def add_reaction(self, emoji):
+        await self.api.call("add_reaction")
+
+
+class StubChannel(discord.TextChannel):
+    """Kênh text giả (kế thừa TextChannel để qua được kiểm tra isinstance của on_message)"""
+
+    def __init__(self, api: FakeDiscordApi, guild, name: str):
+        self.api = api
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+
+    def __repr__(self):
+        return f"<StubChannel name={self.name!r}>"
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        await self.api.call("send")
+        replies = current_replies.get()
+        if replies is not None:
+            replies.append(content or "")
+        return StubMessage(self.api, self, content=content, embed=embed)
+
+
+class StubMember(discord.Member):
+    """Thành viên giả (kế thừa Member để qua được các kiểm tra isinstance)"""
+
+    avatar = None
+    display_avatar = None
+    premium_since = None
+
+    def __init__(self, api: FakeDiscordApi, guild, user_id: int, name: str, bot: bool = False):
+        self.api = api
+        self.guild = guild
+        self._stub_id = user_id
+        self._stub_name = name
+        self._stub_bot = bot
+        self._stub_created_at = datetime.now()
+
+    id = property(lambda self: self._stub_id)
+    name = property(lambda self: self._stub_name)
+    display_name = name
+    global_name = name
+    bot = property(lambda self: self._stub_bot)
+    mention = property(lambda self: f"<@{self._stub_id}>")
+    created_at = property(lambda self: self._stub_created_at)
+    roles = property(lambda self: [])
+
+    def __str__(self):
+        return self._stub_name
+
+    def __repr__(self):
+        return f"<StubMember id={self._stub_id} name={self._stub_name!r}>"
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self._stub_id
+
+    def __hash__(self):
+        return hash(self._stub_id)
+
+    async def send(self, content=None, **kwargs):
+        await self.api.call("dm")
+
+
+class StubGuild:
+    """Server giả chứa các thành viên và kênh của bài chạy thử"""
+
+    def __init__(self, name: str = "Load Test"):
+        self.id = next(_ids)
+        self.name = name
+        self.icon = None
+        self.roles = []
+        self.default_role = None
+        self.created_at = datetime.now()
+        self.text_channels: List[StubChannel] = []
+        self.voice_channels = []
+        self.system_channel = None
+        self.me = None
+        self._members: Dict[int, StubMember] = {}
+
+    @property
+    def members(self) -> List[StubMember]:
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self._members)
+
+    def get_member(self, user_id: int) -> Optional[StubMember]:
+        return self._members.get(user_id)
+
+    def get_role(self, role_id: int):
+        return None
+
+
+class StubContext:
+    """Context giả cho callback của lệnh"""
+
+    def __init__(self, bot, author: StubMember, channel: StubChannel, command_name: str):
+        self.bot = bot
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.prefix = "!"
+        self.message = StubMessage(channel.api, channel, author=author, content=f"!{command_name}")
+        self.command = SimpleNamespace(name=command_name, reset_cooldown=lambda ctx: None)
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        return await self.channel.send(content, embed=embed, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.send(content, **kwargs)
+
+
+class StubBot:
+    """Bot giả cung cấp đúng những thuộc tính mà các cog dùng tới"""
+
+    def __init__(self, db, api: FakeDiscordApi, guild: StubGuild):
+        self.db = db
+        self.api = api
+        self.loop = asyncio.get_running_loop()
+        self.latency = 0.0
+        self.guilds = [guild]
+        self.user = StubMember(api, guild, next(_ids), "Tu Tiên Bot", bot=True)
+        self.commands = []
+        self.exp_buffer = None
+        self.combat_history_writer = None
+        self.edit_coalescer = None
+        self._cogs: Dict[str, Any] = {}
+        self._closed = False
+
+    @property
+    def cogs(self) -> Dict[str, Any]:
+        return dict(self._cogs)
+
+    def add_cog(self, cog):
+        self._cogs[cog.__cog_name__] = cog
+
+    def get_cog(self, name: str):
+        return self._cogs.get(name)
+
+    def get_command(self, name: str):
+        return None
+
+    def add_view(self, view, **kwargs):
+        pass
+
+    def get_user(self, user_id: int):
+        return self.guilds[0].get_member(user_id)
+
+    async def fetch_user(self, user_id: int):
+        return self.get_user(user_id)
+
+    def get_channel(self, channel_id: int):
+        for channel in self.guilds[0].text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    async def wait_until_ready(self):
+        pass
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+
+class CountingStorage:
+    """Bọc backend lưu trữ, đếm số lần gọi database theo lệnh đang chạy"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.ops: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def __getattr__(self, name):
+        attr = getattr(self.storage, name)
+        if inspect.iscoroutinefunction(attr):
+            async def counted(*args, **kwargs):
+                self.ops[current_command.get()][name] += 1
+                return await attr(*args, **kwargs)
+        elif inspect.isasyncgenfunction(attr):
+            def counted(*args, **kwargs):
+                self.ops[current_command.get()][name] += 1
+                return attr(*args, **kwargs)
+        else:
+            return attr
+
+        # Lưu lại để lần sau không phải bọc lại
+        self.__dict__[name] = counted
+        return counted
+
+    def count(self, command: str) -> int:
+        return sum(self.ops[command].values())
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Phân vị theo nearest-rank (samples đã sắp xếp)"""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Đọc tỷ lệ lưu lượng dạng "chat=60,danhquai=10" """
+    weights = {}
+    for part in mix.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Loại lưu lượng không hợp lệ: {name} (chọn trong {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("Tỷ lệ lưu lượng trống")
+    return weights
+
+
+class LoadTest:
+    """Dựng môi trường giả, nạp người chơi và phát lại lưu lượng"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.voice_channel = SimpleNamespace(id=next(_ids), name="Tu Luyện")
+
+    async def setup(self):
+        """Khởi tạo backend, bot giả, các thành phần nền và các cog"""
+        args = self.args
+        if args.backend == "sqlite":
+            from database.sqlite_handler import SQLiteDB
+            self.tmpdir = tempfile.TemporaryDirectory()
+            storage = SQLiteDB(os.path.join(self.tmpdir.name, "load_test.db"))
+        else:
+            storage = create_storage(args.backend)
+        await storage.setup_indexes()
+
+        self.db = CountingStorage(storage)
+        self.api = FakeDiscordApi(args.api_latency)
+        self.guild = StubGuild()
+        self.channels = [StubChannel(self.api, self.guild, f"tu-luyen-{i}") for i in range(args.channels)]
+        self.guild.text_channels = self.channels
+        self.bot = StubBot(self.db, self.api, self.guild)
+        self.guild.me = self.bot.user
+
+        await self.seed_players()
+
+        # Các thành phần nền giống on_ready trong main.py
+        self.bot.exp_buffer = ExpBuffer(self.db)
+        self.bot.exp_buffer.start()
+        self.bot.combat_history_writer = CombatHistoryWriter(self.db)
+        self.bot.combat_history_writer.start()
+        self.bot.edit_coalescer = EditCoalescer(frame_rate=args.frame_rate)
+        self.bot.edit_coalescer.start()
+        storage.leaderboard.start()
+
+        # Rút ngắn sleep hiệu ứng và bỏ cooldown lưu trong dữ liệu người chơi
+        scaled = ScaledAsyncio(args.sleep_scale)
+        for module in (cultivation, combat, monster, sect, daily, commands):
+            module.asyncio = scaled
+        if not args.cooldowns:
+            monster.MONSTER_COOLDOWN = 0
+            combat.COMBAT_COOLDOWN = 0
+
+        for cog_class in (cultivation.Cultivation, combat.Combat, monster.Monster,
+                          sect.Sect, daily.Daily, commands.Commands):
+            cog = cog_class(self.bot, self.db)
+            self.bot.add_cog(cog)
+            if hasattr(cog, 'cog_load'):
+                await cog.cog_load()
+
+    async def seed_players(self):
+        """Tạo người chơi với exp và cảnh giới ngẫu nhiên"""
+        sects = list(SECTS)
+        max_exp = level_table.exp_required(level_table.max_index // 2)
+        for i in range(self.args.players):
+            member = StubMember(self.api, self.guild, 10_000 + i, f"Tu sĩ {i}")
+            self.guild._members[member.id] = member
+            await self.db.create_player(member.id, self.rng.choice(sects))
+
+            exp = int(self.rng.random() ** 3 * max_exp)
+            if exp > 0:
+                index = level_table.index_for_exp(exp)
+                stats = level_table.get_stats(index)
+                await self.db.increment_exp(
+                    member.id, exp, level=level_table.name_at(index),
+                    hp=stats.get("hp", 100), attack=stats.get("attack", 10), defense=stats.get("defense", 5)
+                )
+
+        self.members = self.guild.members
+        self.db.ops.clear()
+
+    def context(self, member: StubMember, command_name: str) -> StubContext:
+        return StubContext(self.bot, member, self.rng.choice(self.channels), command_name)
+
+    # Các loại lưu lượng: mỗi hàm thực hiện một lần gọi lệnh/sự kiện
+    async def run_chat(self, member):
+        message = StubMessage(self.api, self.rng.choice(self.channels), author=member, content="tu luyện")
+        await self.bot.get_cog('Cultivation').on_message(message)
+
+    async def run_voice(self, member):
+        cog = self.bot.get_cog('Cultivation')
+        joined = SimpleNamespace(channel=self.voice_channel, afk=False, self_deaf=False)
+        left = SimpleNamespace(channel=None, afk=False, self_deaf=False)
+        if member.id in cog.voice_tracker.sessions:
+            await cog.on_voice_state_update(member, joined, left)
+        else:
+            await cog.on_voice_state_update(member, left, joined)
+
+    async def run_danhquai(self, member):
+        cog = self.bot.get_cog('Monster')
+        await cog.danhquai.callback(cog, self.context(member, "danhquai"))
+
+    async def run_combat(self, member):
+        cog = self.bot.get_cog('Combat')
+        target = self.rng.choice(self.members)
+        while target.id == member.id:
+            target = self.rng.choice(self.members)
+        await cog.combat.callback(cog, self.context(member, "combat"), target)
+
+    async def run_top(self, member):
+        cog = self.bot.get_cog('Commands')
+        type_str = self.rng.choice(["all", "all", "pvp", "sect"])
+        await cog.leaderboard.callback(cog, self.context(member, "top"), type_str, 10)
+
+    async def run_sect(self, member):
+        cog = self.bot.get_cog('Sect')
+        choice = self.rng.random()
+        if choice < 0.4:
+            await cog.sect_info.callback(cog, self.context(member, "sect_info"))
+        elif choice < 0.7:
+            await cog.my_sect.callback(cog, self.context(member, "mysect"))
+        else:
+            await cog.sect_ranking.callback(cog, self.context(member, "sectrank"))
+
+    async def run_tuvi(self, member):
+        cog = self.bot.get_cog('Cultivation')
+        await cog.tuvi.callback(cog, self.context(member, "tuvi"))
+
+    async def run_daily(self, member):
+        cog = self.bot.get_cog('Daily')
+        await cog.daily.callback(cog, self.context(member, "daily"))
+
+    async def invoke(self, name: str, handler: Callable[[StubMember], Awaitable[None]]):
+        """Chạy một lần gọi, đo độ trễ và gán số lần gọi database cho lệnh"""
+        current_command.set(name)
+        replies: List[str] = []
+        current_replies.set(replies)
+        member = self.rng.choice(self.members)
+        start = time.perf_counter()
+        try:
+            await handler(member)
+        except Exception as e:
+            self.errors[name] += 1
+            if self.errors[name] == 1:
+                print(f"❌ Lỗi khi chạy {name}: {e!r}")
+        finally:
+            self.latencies[name].append((time.perf_counter() - start) * 1000)
+
+        # Các cog tự bắt lỗi và trả lời "Có lỗi xảy ra...", tính đó là lỗi
+        if any(content.startswith("Có lỗi xảy ra") for content in replies):
+            self.errors[name] += 1
+
+    async def run(self):
+        """Phát lại lưu lượng open-loop: khoảng cách giữa các lần gọi theo phân phối mũ"""
+        weights = parse_mix(self.args.mix)
+        names = list(weights)
+        cumulative = list(itertools.accumulate(weights[name] for name in names))
+        handlers = {name: getattr(self, f"run_{name}") for name in names}
+
+        tasks = set()
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        next_at = started
+        while True:
+            next_at += self.rng.expovariate(self.args.rate)
+            if next_at >= deadline:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            pick = self.rng.random() * cumulative[-1]
+            name = names[next(i for i, bound in enumerate(cumulative) if pick < bound)]
+            task = asyncio.create_task(self.invoke(name, handlers[name]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        self.elapsed = time.perf_counter() - started
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.drain_timeout)
+        self.drain = time.perf_counter() - started - self.elapsed
+
+    async def teardown(self):
+        """Dừng các cog và thành phần nền (flush phần còn chờ ghi)"""
+        self.bot._closed = True
+        for cog in self.bot.cogs.values():
+            if hasattr(cog, 'cog_unload'):
+                await cog.cog_unload()
+        await self.bot.edit_coalescer.close()
+        await self.bot.exp_buffer.close()
+        await self.bot.combat_history_writer.close()
+        await self.db.leaderboard.stop()
+        await self.db.storage.close()
+
+    def report(self):
+        """In bảng độ trễ và số lần gọi database theo lệnh"""
+        total = sum(len(samples) for samples in self.latencies.values())
+        print(f"\n=== KẾT QUẢ ({self.args.backend}, {self.args.players} người chơi) ===")
+        print(f"Đã chạy {total} lần gọi trong {self.elapsed:.1f}s ({total / self.elapsed:.1f}/s), "
+              f"chờ lệnh còn dở thêm {self.drain:.1f}s")
+        print(f"{'Lệnh':<10} {'Số lần':>7} {'Lỗi':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'DB ops':>7}")
+        for name in sorted(self.latencies):
+            samples = sorted(self.latencies[name])
+            ops = self.db.count(name) / len(samples)
+            print(f"{name:<10} {len(samples):>7} {self.errors[name]:>5} "
+                  f"{percentile(samples, 50):>9.1f} {percentile(samples, 95):>9.1f} "
+                  f"{percentile(samples, 99):>9.1f} {ops:>7.2f}")
+            if self.args.verbose:
+                for method, count in sorted(self.db.ops[name].items(), key=lambda item: -item[1]):
+                    print(f"{'':<12}{method}: {count / len(samples):.2f}")
+
+        background = self.db.ops.get("background", {})
+        if background:
+            print("Ghi nền (flush exp, lịch sử đấu): " +
+                  ", ".join(f"{method}={count}" for method, count in sorted(background.items())))
+
+        cache = self.db.cache.get_stats()
+        coalescer = self.bot.edit_coalescer.get_stats()
+        print(f"Cache người chơi: hit rate {cache.get('hit_rate', 0):.1%} "
+              f"({cache.get('hits', 0)} hit / {cache.get('misses', 0)} miss)")
+        print("Discord API: " + ", ".join(f"{method}={count}" for method, count in sorted(self.api.calls.items())))
+        print(f"Gom sửa tin nhắn: {coalescer['sent']} gửi / {coalescer['dropped']} bỏ qua, "
+              f"trễ trung bình {coalescer['avg_lag_ms']:.0f}ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy thử tải offline cho Tu Tiên Bot")
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory",
+                        help="Backend lưu trữ cục bộ (SQLite dùng file tạm)")
+    parser.add_argument("--players", type=int, default=1000, help="Số người chơi được tạo sẵn")
+    parser.add_argument("--rate", type=float, default=20.0, help="Số lần gọi mỗi giây (trung bình)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Thời gian phát lưu lượng (giây)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Tỷ lệ lưu lượng, chọn trong: {', '.join(SCENARIOS)}")
+    parser.add_argument("--channels", type=int, default=5, help="Số kênh text lưu lượng được chia vào")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Độ trễ giả lập của Discord API (ms)")
+    parser.add_argument("--frame-rate", type=float, default=1.0, help="Số lần sửa tin nhắn mỗi giây trên một kênh")
+    parser.add_argument("--sleep-scale", type=float, default=0.0,
+                        help="Hệ số nhân sleep hiệu ứng trong cog (0 = bỏ qua, 1 = như thật)")
+    parser.add_argument("--cooldowns", action="store_true", help="Giữ cooldown đánh quái/PvP như thật")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Thời gian chờ các lệnh còn dở (giây)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed ngẫu nhiên để chạy lại được")
+    parser.add_argument("--verbose", action="store_true", help="In số lần gọi theo từng phương thức database")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    load_test = LoadTest(args)
+
+    print("=== CHẠY THỬ TẢI ===")
+    print(f"Backend: {args.backend} | Người chơi: {args.players} | "
+          f"Tốc độ: {args.rate}/s | Thời gian: {args.duration}s")
+    print(f"Lưu lượng: {args.mix}")
+
+    await load_test.setup()
+    try:
+        await load_test.run()
+    finally:
+        await load_test.teardown()
+    load_test.report()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
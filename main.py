@@ -1,13 +1,22 @@
 import discord
 import asyncio
 from discord.ext import commands
-from database.mongo_handler import MongoDB
+from database.storage import create_storage
+from database.exp_buffer import ExpBuffer
+from database.combat_history_writer import CombatHistoryWriter
+from modules.edit_coalescer import EditCoalescer
+from modules.metrics import Metrics
+from database.migrations import migrate_to_native_datetimes
 import platform
 import time
 import sys
 import logging
 import traceback
-from config import TOKEN, PREFIX, DEBUG_MODE, OWNER_ID
+import importlib
+import config
+from modules.levels import level_table
+from modules.combat_stats import combat_stats
+from config import TOKEN, PREFIX, DEBUG_MODE, OWNER_ID, CHECK_QUERY_PLANS, DATABASE_BACKEND, METRICS_ENABLED
 import os
 from dotenv import load_dotenv
 
@@ -38,6 +47,10 @@ bot = commands.Bot(command_prefix=PREFIX, intents=intents)
 
 # Lưu trữ database trong bot để các module có thể truy cập
 bot.db = None
+bot.exp_buffer = None
+bot.combat_history_writer = None
+bot.edit_coalescer = None
+bot.metrics = None
 
 
 # Hàm tiện ích để xóa lệnh nếu đã tồn tại
@@ -78,22 +91,63 @@ async def on_ready():
     print(f'Debug mode: {DEBUG_MODE}')
     print('═' * 40)
 
+    # on_ready chạy lại sau mỗi lần IDENTIFY mới. Database, các thành phần ghi nền và
+    # module chỉ khởi tạo ở lần đầu: cog giữ tham chiếu tới database đã tạo (load lại
+    # extension sẽ lỗi ExtensionAlreadyLoaded), tạo database mới sẽ tách đôi cache
+    first_ready = bot.db is None
+
     try:
-        # Khởi tạo MongoDB
-        print("\n[1/4] Đang kết nối MongoDB...")
-        bot.db = MongoDB()
-        await bot.db.setup_indexes()
-        print("✓ Đã kết nối MongoDB và tạo indexes thành công!")
-
-        # Xóa các lệnh có thể xung đột
-        print("\n[2/4] Đang chuẩn bị load modules...")
-        prepare_for_module_loading()
-        print("✓ Đã xóa các lệnh có thể xung đột!")
-
-        # Load modules
-        print("\n[3/4] Đang load các modules...")
-        await load_cogs()
-        print("✓ Tất cả modules đã được load thành công!")
+        if first_ready:
+            # Khởi tạo database theo DATABASE_BACKEND (mongodb, sqlite hoặc memory)
+            print(f"\n[1/4] Đang kết nối database ({DATABASE_BACKEND})...")
+            bot.db = create_storage(DATABASE_BACKEND)
+        else:
+            print("\n[1/4] Kết nối lại Discord: giữ nguyên database và các thành phần đang chạy")
+
+        # Đo thời gian lệnh/database (bọc database trước khi các thành phần khác dùng tới).
+        # Chỉ tạo một lần: các wrapper đã bọc database báo về đúng đối tượng Metrics này
+        if METRICS_ENABLED and bot.metrics is None:
+            bot.metrics = Metrics(bot)
+            await bot.metrics.start()
+        if bot.metrics:
+            bot.metrics.instrument(bot.db)
+
+        if first_ready:
+            await bot.db.setup_indexes()
+            if DATABASE_BACKEND == 'mongodb':
+                # Dữ liệu SQLite luôn được ghi theo schema mới, chỉ MongoDB cần migrate
+                await migrate_to_native_datetimes(bot.db)
+            if CHECK_QUERY_PLANS:
+                await bot.db.check_query_plans()
+
+            # Bộ đệm exp chat/voice (ghi hàng loạt)
+            bot.exp_buffer = ExpBuffer(bot.db)
+            bot.exp_buffer.start()
+
+            # Hàng đợi ghi lịch sử trận đấu theo lô
+            bot.combat_history_writer = CombatHistoryWriter(bot.db)
+            bot.combat_history_writer.start()
+
+            # Bộ gom sửa tin nhắn (hiệu ứng trận đấu, đếm ngược)
+            bot.edit_coalescer = EditCoalescer()
+            bot.edit_coalescer.start()
+
+            # Bảng xếp hạng trong bộ nhớ (nạp lần đầu và đồng bộ định kỳ) của database
+            # duy nhất: mọi lượt ghi exp/pvp đều cập nhật đúng bảng mà !top đọc.
+            # Task đồng bộ được dừng trong db.close() khi tắt bot
+            bot.db.leaderboard.start()
+            print("✓ Đã kết nối database và tạo indexes thành công!")
+
+        if first_ready:
+            # Xóa các lệnh có thể xung đột
+            print("\n[2/4] Đang chuẩn bị load modules...")
+            prepare_for_module_loading()
+            print("✓ Đã xóa các lệnh có thể xung đột!")
+
+            # Load modules
+            print("\n[3/4] Đang load các modules...")
+            await load_cogs()
+            print("✓ Tất cả modules đã được load thành công!")
 
         # Set activity
         print("\n[4/4] Đang cập nhật trạng thái...")
@@ -111,8 +165,8 @@ async def on_ready():
         print(f"\n✓ Bot đã sẵn sàng! (Khởi động trong {elapsed_time:.2f} giây)")
         print('═' * 40)
 
-        # Thông báo cho owner nếu có
-        if OWNER_ID:
+        # Thông báo cho owner nếu có (chỉ lần khởi động đầu)
+        if OWNER_ID and first_ready:
             try:
                 owner = await bot.fetch_user(OWNER_ID)
                 if owner:
@@ -194,10 +248,41 @@ async def cleanup():
     """Dọn dẹp trước khi tắt bot"""
     print("\nĐang tắt bot...")
     try:
+        # Gửi nốt khung hình cuối của các tin nhắn đang chờ sửa
+        if bot.edit_coalescer:
+            await bot.edit_coalescer.close()
+            bot.edit_coalescer = None
+            print("✓ Đã gửi các lần sửa tin nhắn còn tồn đọng")
+
+        # Đóng cổng metrics
+        if bot.metrics:
+            await bot.metrics.close()
+            bot.metrics = None
+            print("✓ Đã đóng cổng metrics")
+
+        # Cộng nốt exp voice của các phiên đang mở (phút lẻ chưa tới lượt tick)
+        cultivation = bot.get_cog('Cultivation')
+        if cultivation:
+            await cultivation.voice_tracker.close()
+            print("✓ Đã cộng exp voice còn tồn đọng")
+
+        # Ghi nốt exp đang chờ trong bộ đệm
+        if bot.exp_buffer:
+            await bot.exp_buffer.close()
+            bot.exp_buffer = None
+            print("✓ Đã ghi exp còn tồn đọng")
+
+        # Ghi nốt lịch sử trận đấu còn trong hàng đợi
+        if bot.combat_history_writer:
+            await bot.combat_history_writer.close()
+            bot.combat_history_writer = None
+            print("✓ Đã ghi lịch sử trận đấu còn tồn đọng")
+
         # Đóng kết nối database
         if bot.db:
             await bot.db.close()
-            print("✓ Đã đóng kết nối MongoDB")
+            bot.db = None
+            print("✓ Đã đóng kết nối database")
 
         # Các tác vụ dọn dẹp khác
         print("✓ Đã lưu trạng thái")
@@ -207,6 +292,18 @@ async def cleanup():
         logger.error(f"Lỗi khi tắt bot: {e}")
 
 
+# Dọn dẹp khi bot đóng, lúc event loop vẫn còn chạy (để flush được xuống database)
+_original_close = bot.close
+
+
+async def close_with_cleanup():
+    await cleanup()
+    await _original_close()
+
+
+bot.close = close_with_cleanup
+
+
 # Error handler cho các lỗi không mong muốn
 @bot.event
 async def on_error(event, *args, **kwargs):
@@ -216,12 +313,37 @@ async def on_error(event, *args, **kwargs):
     logger.error(traceback.format_exc())
 
 
+# Đo thời gian xử lý của mọi lệnh
+@bot.before_invoke
+async def before_command(ctx):
+    if bot.metrics:
+        bot.metrics.command_started(ctx)
+
+
+@bot.after_invoke
+async def after_command(ctx):
+    if bot.metrics:
+        bot.metrics.command_finished(ctx)
+
+
 # Lệnh reload module
 @bot.command(name="reload", hidden=True)
 @commands.is_owner()
 async def reload_module(ctx, module_name: str):
     """Reload một module cụ thể (chỉ dành cho chủ bot)"""
     try:
+        if module_name.lower() == "config":
+            # Tải lại cấu hình và dựng lại các bảng tính sẵn từ cấu hình
+            importlib.reload(config)
+            level_table.rebuild(config.CULTIVATION_LEVELS)
+            combat_stats.rebuild(config.CULTIVATION_LEVELS, config.SECTS)
+
+            combat_cog = bot.get_cog('Combat')
+            if combat_cog:
+                combat_cog.estimator.cache.clear()
+            await ctx.send("✅ Đã tải lại cấu hình và bảng chỉ số chiến đấu!")
+            return
+
         # Xóa module cũ
         module_path = f"modules.{module_name.lower()}"
         await bot.reload_extension(module_path)
@@ -231,6 +353,64 @@ async def reload_module(ctx, module_name: str):
         logger.error(f"Lỗi khi reload module {module_name}: {e}")
 
 
+# Lệnh xem hiệu năng
+@bot.command(name="perf", hidden=True)
+@commands.is_owner()
+async def perf(ctx, action: str = None):
+    """Xem thời gian xử lý lệnh, database, cache và lock (chỉ dành cho chủ bot)"""
+    if not bot.metrics:
+        await ctx.send("❌ Metrics đang tắt (METRICS_ENABLED=false)")
+        return
+
+    if action and action.lower() == "reset":
+        bot.metrics.reset()
+        await ctx.send("✅ Đã reset số liệu hiệu năng!")
+        return
+
+    stats = bot.metrics.get_stats()
+    minutes, seconds = divmod(int(stats["uptime"]), 60)
+    embed = discord.Embed(
+        title="📈 Hiệu Năng Bot",
+        description=f"Số liệu trong {minutes} phút {seconds} giây gần nhất",
+        color=0x3498db,
+        timestamp=discord.utils.utcnow()
+    )
+
+    command_lines = [
+        f"{item['name']}: {item['count']} lần, tb {item['avg_ms']:.0f}ms, p95 {item['p95_ms']:.0f}ms, "
+        f"{item['db_calls']:.1f} DB/lần" + (f", {item['errors']} lỗi" if item['errors'] else "")
+        for item in stats["commands"]
+    ]
+    embed.add_field(name="⏱️ Lệnh (theo tổng thời gian)",
+                    value="```\n" + "\n".join(command_lines) + "\n```" if command_lines else "Chưa có dữ liệu",
+                    inline=False)
+
+    db_lines = [
+        f"{item['name']}: {item['count']} lần, tb {item['avg_ms']:.1f}ms, p95 {item['p95_ms']:.1f}ms"
+        + (f", {item['errors']} lỗi" if item['errors'] else "")
+        for item in stats["db_methods"]
+    ]
+    embed.add_field(name="🗄️ Database (theo tổng thời gian)",
+                    value="```\n" + "\n".join(db_lines) + "\n```" if db_lines else "Chưa có dữ liệu",
+                    inline=False)
+
+    cache_lines = [
+        f"{name}: {cache['hit_rate']:.1%} ({cache['hits']}/{cache['hits'] + cache['misses']}), {cache['size']} mục"
+        for name, cache in stats["caches"].items()
+    ]
+    embed.add_field(name="💾 Cache", value="\n".join(cache_lines) or "Không có", inline=False)
+
+    lock_lines = [
+        f"{name}: chờ {lock['waits']}/{lock['acquisitions']} lần, "
+        f"tb {lock['wait_total'] / lock['waits'] * 1000 if lock['waits'] else 0:.1f}ms, "
+        f"lâu nhất {lock['wait_max'] * 1000:.1f}ms"
+        for name, lock in sorted(stats["locks"].items()) if lock['acquisitions']
+    ]
+    embed.add_field(name="🔒 Lock", value="\n".join(lock_lines) or "Chưa có dữ liệu", inline=False)
+
+    await ctx.send(embed=embed)
+
+
 # Run bot
 if __name__ == "__main__":
     try:
@@ -0,0 +1,202 @@
+# modules/battle_scheduler.py
+import asyncio
+import heapq
+import itertools
+import time
+from bisect import bisect_right
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Sequence
+from modules.edit_coalescer import submit_edit
+from config import BATTLE_EDITS_PER_SECOND
+
+
+class Playback:
+    """Một trận đấu đã tính sẵn đang được phát lại trên một tin nhắn
+
+    Khung hình thứ i đến hạn tại started_at + offsets[i] (giây, tăng dần) và chỉ
+    được dựng (render) khi thực sự được gửi đi.
+    """
+
+    __slots__ = ("message", "offsets", "frame_count", "render", "started_at", "next_index",
+                 "on_finish", "dropped", "sent", "done")
+
+    def __init__(self, message, offsets: Sequence[float], render: Callable[[int], Dict[str, Any]],
+                 started_at: float, on_finish: Optional[Callable[[], Awaitable[None]]] = None):
+        self.message = message
+        self.offsets = list(offsets)
+        self.frame_count = len(self.offsets)
+        self.render = render
+        self.started_at = started_at
+        self.next_index = 0
+        self.on_finish = on_finish
+        self.dropped = 0
+        self.sent = 0
+        self.done = asyncio.Event()
+
+    def due_at(self, index: int) -> float:
+        return self.started_at + self.offsets[index]
+
+    def latest_due(self, now: float) -> int:
+        """Khung hình mới nhất đã đến hạn tại thời điểm now"""
+        return max(0, bisect_right(self.offsets, now - self.started_at) - 1)
+
+
+class BattleScheduler:
+    """Phát lại các trận đấu đã tính sẵn bằng một task duy nhất
+
+    Thay vì mỗi trận giữ một coroutine ngủ giữa các vòng, mọi khung hình được
+    xếp vào một heap theo thời điểm đến hạn. Số khung hình đưa vào bộ gom
+    (EditCoalescer của bot) bị giới hạn theo edits_per_second; bộ gom giữ giới
+    hạn theo kênh và chỉ gửi khung hình mới nhất của mỗi tin nhắn, nên khi bị
+    chậm các khung hình trung gian bị bỏ qua.
+    """
+
+    def __init__(self, bot=None, edits_per_second: float = BATTLE_EDITS_PER_SECOND):
+        self.bot = bot
+        self.edits_per_second = edits_per_second
+        self._heap: List[tuple] = []  # (due_at, seq, playback)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._active: Dict[int, Playback] = {}
+        self._finishing: set = set()
+        self._next_edit_at = 0.0
+
+        # Thống kê
+        self.total_playbacks = 0
+        self.total_frames_sent = 0
+        self.total_frames_dropped = 0
+        self.total_edit_errors = 0
+
+    def start(self):
+        """Khởi động task phát lại"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Dừng task; các trận đang phát được chuyển thẳng tới khung hình cuối"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for playback in list(self._active.values()):
+            self._send(playback, playback.frame_count - 1)
+        self._heap.clear()
+        if self._finishing:
+            await asyncio.gather(*self._finishing, return_exceptions=True)
+
+    def schedule(self, message, offsets: Sequence[float], render: Callable[[int], Dict[str, Any]],
+                 on_finish: Optional[Callable[[], Awaitable[None]]] = None) -> Playback:
+        """Xếp lịch phát lại các khung hình lên message
+
+        offsets[i] là thời điểm (giây kể từ bây giờ) hiển thị khung hình i;
+        render(i) trả về tham số cho message.edit (ví dụ {"embed": ...});
+        on_finish được gọi sau khi khung hình cuối cùng đã được gửi.
+        """
+        playback = Playback(message, offsets, render, time.monotonic(), on_finish)
+        self.total_playbacks += 1
+        if playback.frame_count <= 0:
+            playback.done.set()
+            return playback
+
+        self._active[id(playback)] = playback
+        self._push(playback.due_at(0), playback)
+        return playback
+
+    def _push(self, due_at: float, playback: Playback):
+        heapq.heappush(self._heap, (due_at, next(self._seq), playback))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi khi phát lại trận đấu: {e}")
+
+    async def _tick(self):
+        if not self._heap:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+            return
+
+        now = time.monotonic()
+        due_at = max(self._heap[0][0], self._next_edit_at)
+        if due_at > now:
+            # Ngủ tới khung hình kế tiếp (hoặc tới khi có trận mới được xếp lịch)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=due_at - now)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        _, _, playback = heapq.heappop(self._heap)
+        index = playback.latest_due(now)
+        skipped = index - playback.next_index
+        if skipped > 0:
+            playback.dropped += skipped
+            self.total_frames_dropped += skipped
+
+        if self.edits_per_second > 0:
+            self._next_edit_at = now + 1 / self.edits_per_second
+        self._send(playback, index)
+
+        if index < playback.frame_count - 1:
+            self._push(playback.due_at(index + 1), playback)
+
+    def _send(self, playback: Playback, index: int):
+        """Đưa một khung hình vào bộ gom; khung hình cuối kết thúc trận và gọi on_finish"""
+        if playback.done.is_set() or index < playback.next_index:
+            return
+
+        playback.next_index = index + 1
+        future = submit_edit(self.bot, playback.message, lambda: playback.render(index))
+        future.add_done_callback(lambda f: self._on_frame_done(playback, f))
+
+        if index >= playback.frame_count - 1:
+            self._active.pop(id(playback), None)
+            task = asyncio.get_running_loop().create_task(self._finish(playback, future))
+            self._finishing.add(task)
+            task.add_done_callback(self._finishing.discard)
+
+    def _on_frame_done(self, playback: Playback, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            self.total_edit_errors += 1
+        elif future.result():
+            playback.sent += 1
+            self.total_frames_sent += 1
+        else:
+            # Bị khung hình mới hơn thay thế hoặc gửi lỗi trong bộ gom
+            playback.dropped += 1
+            self.total_frames_dropped += 1
+
+    async def _finish(self, playback: Playback, future: asyncio.Future):
+        """Chờ khung hình cuối được gửi rồi gọi on_finish"""
+        try:
+            await future
+        except Exception as e:
+            print(f"❌ Lỗi khi cập nhật tin nhắn trận đấu: {e}")
+
+        playback.done.set()
+        if playback.on_finish:
+            try:
+                await playback.on_finish()
+            except Exception as e:
+                print(f"❌ Lỗi khi kết thúc phát lại trận đấu: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của bộ phát lại"""
+        return {
+            "active": len(self._active),
+            "queued": len(self._heap),
+            "playbacks": self.total_playbacks,
+            "frames_sent": self.total_frames_sent,
+            "frames_dropped": self.total_frames_dropped,
+            "edit_errors": self.total_edit_errors
+        }
@@ -3,12 +3,20 @@ from discord.ext import commands
 from datetime import datetime, timedelta
 import random
 import asyncio
-from typing import Dict, Any, Optional, Tuple, List, Union
+from typing import Dict, Any, Optional, Tuple, List, Union, Sequence
 from modules.utils import format_time
+from modules.levels import level_table
+from modules.combat_stats import combat_stats
+from modules.matchmaking import WinEstimator, MAX_LEVEL_GAP
+from modules.edit_coalescer import submit_edit
+from modules.combat_engine import (
+    CombatEngine, CombatLog, FightResult, StrikeEvent, Striker, FIRST, SECOND, pick, pvp_base_damage
+)
 from config import (
     COMBAT_COOLDOWN, SECTS, EXP_STEAL_PERCENT, DAMAGE_VARIATION,
     SECT_EMOJIS, SECT_COLORS, MAX_EXP_STEAL
 )
+from database.locks import LockRegistry
 
 
 class Combat(commands.Cog):
@@ -17,8 +25,10 @@ class Combat(commands.Cog):
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.combat_locks = {}  # Khóa để tránh race condition
+        self.combat_locks = LockRegistry("combat")  # Khóa để tránh race condition
         self.active_duels = {}  # Lưu trữ các lời mời đấu tự do đang chờ
+        self.engine = CombatEngine()  # Bộ máy chiến đấu dùng chung
+        self.estimator = WinEstimator(bot)  # Ước tính tỷ lệ thắng (!dudoan, ghép đối thủ)
 
         # Giá trị mặc định
         self.default_exp_steal = 0.1  # 10%
@@ -58,11 +68,9 @@ class Combat(commands.Cog):
             "💪 {winner} đã chứng minh sức mạnh vượt trội so với {loser}, cướp được {exp} exp!"
         ]
 
-    async def get_lock(self, user_id: int) -> asyncio.Lock:
-        """Lấy hoặc tạo lock cho người chơi"""
-        if user_id not in self.combat_locks:
-            self.combat_locks[user_id] = asyncio.Lock()
-        return self.combat_locks[user_id]
+    def get_lock(self, user_id: int):
+        """Lấy lock cho người chơi (tự thu hồi khi không còn ai dùng)"""
+        return self.combat_locks.hold(user_id)
 
     @commands.command(name="combat", aliases=["pk", "pvp", "đấu"], usage="@người_chơi")
     @commands.guild_only()
@@ -84,7 +92,7 @@ class Combat(commands.Cog):
             return
 
         # Lấy khóa của người tấn công
-        async with await self.get_lock(ctx.author.id):
+        async with self.get_lock(ctx.author.id):
             try:
                 # Hiển thị thông báo đang tải
                 loading_msg = await ctx.send("⏳ Đang kiểm tra điều kiện chiến đấu...")
@@ -108,10 +116,7 @@ class Combat(commands.Cog):
                 now = datetime.now()
                 last_combat = attacker.get('last_combat', datetime.min)
                 if isinstance(last_combat, str):
-                    try:
-                        last_combat = datetime.strptime(last_combat, '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        last_combat = datetime.min
+                    last_combat = datetime.min
 
                 cooldown_time = timedelta(seconds=COMBAT_COOLDOWN)
                 if now - last_combat < cooldown_time:
@@ -141,7 +146,7 @@ class Combat(commands.Cog):
                 defender_level_index = self.get_level_index(defender.get('level', 'Phàm Nhân'))
 
                 level_diff = abs(attacker_level_index - defender_level_index)
-                if level_diff > 5:  # Chênh lệch quá 5 cảnh giới
+                if level_diff > MAX_LEVEL_GAP:  # Chênh lệch quá 5 cảnh giới
                     await loading_msg.delete()
                     if attacker_level_index > defender_level_index:
                         await ctx.send(
@@ -164,12 +169,14 @@ class Combat(commands.Cog):
                 # Hiệu ứng đếm ngược
                 for i in range(3, 0, -1):
                     await asyncio.sleep(1)
-                    await battle_msg.edit(
+                    submit_edit(
+                        self.bot, battle_msg,
                         content=f"⚔️ **{ctx.author.display_name}** đang khiêu chiến **{target.display_name}**!\n"
                                 f"Trận đấu sẽ bắt đầu sau {i} giây...")
 
-                # Bắt đầu xử lý combat
-                await battle_msg.edit(
+                # Bắt đầu xử lý combat (thay thế khung đếm ngược còn chờ)
+                await submit_edit(
+                    self.bot, battle_msg,
                     content=f"⚔️ **{ctx.author.display_name}** đang chiến đấu với **{target.display_name}**!")
 
                 # Tạo trận đấu turn-based
@@ -191,7 +198,8 @@ class Combat(commands.Cog):
                 )
 
                 # Log lại trận đấu
-                await self.log_combat(ctx.author.id, target.id, winner.id == ctx.author.id, exp_gained)
+                await self.log_combat(ctx.author.id, target.id, winner.id == ctx.author.id, exp_gained,
+                                      rounds=combat_log.to_records())
 
                 # Kiểm tra thăng cấp
                 if winner.id == ctx.author.id and exp_gained > 0:
@@ -333,12 +341,14 @@ class Combat(commands.Cog):
         # Hiệu ứng đếm ngược
         for i in range(3, 0, -1):
             await asyncio.sleep(1)
-            await battle_msg.edit(
+            submit_edit(
+                self.bot, battle_msg,
                 content=f"⚔️ **{ctx.author.display_name}** đang chiến đấu với **{target.display_name}**!\n"
                         f"Trận đấu sẽ bắt đầu sau {i} giây...")
 
-        # Bắt đầu xử lý combat
-        await battle_msg.edit(
+        # Bắt đầu xử lý combat (thay thế khung đếm ngược còn chờ)
+        await submit_edit(
+            self.bot, battle_msg,
             content=f"⚔️ **{ctx.author.display_name}** đang chiến đấu với **{target.display_name}**!")
 
         # Tạo trận đấu turn-based (không cướp exp)
@@ -353,190 +363,123 @@ class Combat(commands.Cog):
         await ctx.send(embed=embed)
 
         # Log lại trận đấu tự do
-        await self.log_combat(ctx.author.id, target.id, winner.id == ctx.author.id, 0, friendly=True)
+        await self.log_combat(ctx.author.id, target.id, winner.id == ctx.author.id, 0, friendly=True,
+                              rounds=combat_log.to_records())
 
-    async def process_combat(
+    def build_strikers(
             self,
-            attacker_user: discord.Member,
-            defender_user: discord.Member,
             attacker_data: Dict[str, Any],
-            defender_data: Dict[str, Any]
-    ) -> Tuple[discord.Member, discord.Member, int, List[str]]:
-        """Xử lý quá trình chiến đấu và trả về kết quả"""
-        # Khởi tạo thông số chiến đấu
-        attacker_hp = attacker_data.get('hp', 100)
-        defender_hp = defender_data.get('hp', 100)
-
+            defender_data: Dict[str, Any],
+            attacker_name: str = "",
+            defender_name: str = ""
+    ) -> Tuple[Striker, Striker]:
+        """Tạo thông số ra đòn của hai bên cho bộ máy chiến đấu"""
         # Tính toán sức mạnh có áp dụng bonus từ môn phái
         attacker_atk, attacker_def = self.calculate_combat_stats(attacker_data)
         defender_atk, defender_def = self.calculate_combat_stats(defender_data)
 
         # Lấy giá trị từ config hoặc mặc định
-        exp_steal_percent = EXP_STEAL_PERCENT if 'EXP_STEAL_PERCENT' in globals() else self.default_exp_steal
         damage_variation = DAMAGE_VARIATION if 'DAMAGE_VARIATION' in globals() else self.default_damage_variation
-        max_exp_steal = MAX_EXP_STEAL if 'MAX_EXP_STEAL' in globals() else self.default_max_exp_steal
-
-        # Ghi lại log chiến đấu
-        combat_log = []
-
-        # Lấy kỹ năng của người chơi dựa trên cảnh giới
-        attacker_skills = self.get_skills_by_level(attacker_data.get('level', 'Phàm Nhân'))
-        defender_skills = self.get_skills_by_level(defender_data.get('level', 'Phàm Nhân'))
-
-        # Vòng lặp chiến đấu
-        turn = 0
-        max_turns = 10  # Giới hạn số turn để tránh vòng lặp vô hạn
-
-        while attacker_hp > 0 and defender_hp > 0 and turn < max_turns:
-            turn += 1
-
-            # Người tấn công đánh trước
-            # Kiểm tra né tránh
-            if random.random() < 0.1:  # 10% cơ hội né tránh
-                dodge_msg = random.choice(self.dodge_messages)
-                combat_log.append(dodge_msg.format(
-                    attacker=attacker_user.display_name,
-                    defender=defender_user.display_name
-                ))
-            else:
-                # Kiểm tra đòn chí mạng
-                is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                # Chọn kỹ năng ngẫu nhiên
-                skill = random.choice(attacker_skills)
-
-                # Tính sát thương
-                damage_multiplier = 1.5 if is_crit else 1.0 + random.uniform(-damage_variation, damage_variation)
-                damage = int(self.calculate_damage(attacker_atk, defender_def) * damage_multiplier)
-                defender_hp -= damage
-
-                # Thêm log chiến đấu
-                if is_crit:
-                    msg = random.choice(self.critical_messages)
-                else:
-                    msg = random.choice(self.attack_messages)
-
-                combat_log.append(msg.format(
-                    attacker=attacker_user.display_name,
-                    defender=defender_user.display_name,
-                    damage=damage,
-                    skill=skill
-                ))
-
-            # Kiểm tra HP
-            if defender_hp <= 0:
-                # Tính exp cướp được
-                exp_gained = int(defender_data['exp'] * exp_steal_percent)
-                exp_gained = min(exp_gained, max_exp_steal)  # Giới hạn exp cướp được
-
-                # Thông báo chiến thắng
-                victory_msg = random.choice(self.victory_messages)
-                combat_log.append(victory_msg.format(
-                    winner=attacker_user.display_name,
-                    loser=defender_user.display_name,
-                    exp=exp_gained
-                ))
-
-                # Cập nhật exp cho người thắng và người thua
-                await self.db.update_player(
-                    attacker_user.id,
-                    exp=attacker_data['exp'] + exp_gained,
-                    stats__pvp_wins=(attacker_data.get('stats', {}).get('pvp_wins', 0) + 1)
-                )
-
-                await self.db.update_player(
-                    defender_user.id,
-                    exp=max(0, defender_data['exp'] - exp_gained),
-                    stats__pvp_losses=(defender_data.get('stats', {}).get('pvp_losses', 0) + 1)
-                )
-
-                return attacker_user, defender_user, exp_gained, combat_log
-
-            # Người phòng thủ đánh lại
-            # Kiểm tra né tránh
-            if random.random() < 0.1:  # 10% cơ hội né tránh
-                dodge_msg = random.choice(self.dodge_messages)
-                combat_log.append(dodge_msg.format(
-                    attacker=defender_user.display_name,
-                    defender=attacker_user.display_name
-                ))
-            else:
-                # Kiểm tra đòn chí mạng
-                is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                # Chọn kỹ năng ngẫu nhiên
-                skill = random.choice(defender_skills)
-
-                # Tính sát thương
-                damage_multiplier = 1.5 if is_crit else 1.0 + random.uniform(-damage_variation, damage_variation)
-                damage = int(self.calculate_damage(defender_atk, attacker_def) * damage_multiplier)
-                attacker_hp -= damage
-
-                # Thêm log chiến đấu
-                if is_crit:
-                    msg = random.choice(self.critical_messages)
-                else:
-                    msg = random.choice(self.attack_messages)
 
-                combat_log.append(msg.format(
-                    attacker=defender_user.display_name,
-                    defender=attacker_user.display_name,
-                    damage=damage,
-                    skill=skill
-                ))
+        # Đòn thường dao động hai lần (sát thương gốc ±20%, rồi ±damage_variation), đòn chí mạng x1.5
+        attacker = Striker(
+            attacker_name, pvp_base_damage(attacker_atk, defender_def),
+            self.get_skills_by_level(attacker_data.get('level', 'Phàm Nhân')),
+            variation=damage_variation, base_variation=0.2
+        )
+        defender = Striker(
+            defender_name, pvp_base_damage(defender_atk, attacker_def),
+            self.get_skills_by_level(defender_data.get('level', 'Phàm Nhân')),
+            variation=damage_variation, base_variation=0.2
+        )
+        return attacker, defender
 
-            # Kiểm tra HP
-            if attacker_hp <= 0:
-                # Người phòng thủ thắng - không cướp exp
-                combat_log.append(f"🛡️ {defender_user.display_name} đã thành công phòng thủ!")
+    def run_duel(
+            self,
+            attacker_user: discord.Member,
+            defender_user: discord.Member,
+            attacker_data: Dict[str, Any],
+            defender_data: Dict[str, Any],
+            max_turns: int
+    ) -> Tuple[FightResult, CombatLog]:
+        """Tính trước toàn bộ trận đấu bằng bộ máy chiến đấu dùng chung"""
+        attacker, defender = self.build_strikers(
+            attacker_data, defender_data, attacker_user.display_name, defender_user.display_name)
+
+        result = self.engine.fight(
+            attacker, attacker_data.get('hp', 100),
+            defender, defender_data.get('hp', 100),
+            max_turns=max_turns
+        )
+        names = (attacker_user.display_name, defender_user.display_name)
+        return result, CombatLog(result.events, lambda event: self.render_strike(event, names))
+
+    def render_strike(self, event: StrikeEvent, names: Tuple[str, str]) -> str:
+        """Tạo dòng log cho một đòn đánh (chỉ gọi khi dòng đó được hiển thị)"""
+        attacker, defender = names[event.side], names[1 - event.side]
+        if event.dodged:
+            return pick(self.dodge_messages, event.roll).format(attacker=attacker, defender=defender)
+
+        messages = self.critical_messages if event.crit else self.attack_messages
+        return pick(messages, event.roll).format(
+            attacker=attacker,
+            defender=defender,
+            damage=event.damage,
+            skill=event.skill
+        )
 
-                # Cập nhật thống kê
-                await self.db.update_player(
-                    attacker_user.id,
-                    stats__pvp_losses=(attacker_data.get('stats', {}).get('pvp_losses', 0) + 1)
-                )
+    async def process_combat(
+            self,
+            attacker_user: discord.Member,
+            defender_user: discord.Member,
+            attacker_data: Dict[str, Any],
+            defender_data: Dict[str, Any]
+    ) -> Tuple[discord.Member, discord.Member, int, CombatLog]:
+        """Xử lý quá trình chiến đấu và trả về kết quả"""
+        # Lấy giá trị từ config hoặc mặc định
+        exp_steal_percent = EXP_STEAL_PERCENT if 'EXP_STEAL_PERCENT' in globals() else self.default_exp_steal
+        max_exp_steal = MAX_EXP_STEAL if 'MAX_EXP_STEAL' in globals() else self.default_max_exp_steal
 
-                await self.db.update_player(
-                    defender_user.id,
-                    stats__pvp_wins=(defender_data.get('stats', {}).get('pvp_wins', 0) + 1)
-                )
+        # Giới hạn 10 turn để tránh trận đấu kéo dài
+        result, combat_log = self.run_duel(attacker_user, defender_user, attacker_data, defender_data, max_turns=10)
 
-                return defender_user, attacker_user, 0, combat_log
+        if result.winner == FIRST:
+            # Tính exp cướp được
+            exp_gained = int(defender_data['exp'] * exp_steal_percent)
+            exp_gained = min(exp_gained, max_exp_steal)  # Giới hạn exp cướp được
 
-        # Nếu đạt max turn mà chưa có kết quả, người có HP cao hơn thắng
-        if attacker_hp > defender_hp:
-            exp_gained = int(defender_data[
-                                 'exp'] * exp_steal_percent * 0.5)  # Chỉ cướp 50% bình thường vì không chiến thắng hoàn toàn
+            # Thông báo chiến thắng
+            victory_msg = self.engine.rng.choice(self.victory_messages)
+            combat_log.append(victory_msg.format(
+                winner=attacker_user.display_name,
+                loser=defender_user.display_name,
+                exp=exp_gained
+            ))
+        elif result.winner == SECOND:
+            # Người phòng thủ thắng - không cướp exp
+            combat_log.append(f"🛡️ {defender_user.display_name} đã thành công phòng thủ!")
+            exp_gained = 0
+        elif result.first_hp > result.second_hp:
+            # Đạt max turn mà chưa có kết quả, người có HP cao hơn thắng
+            # Chỉ cướp 50% bình thường vì không chiến thắng hoàn toàn
+            exp_gained = int(defender_data['exp'] * exp_steal_percent * 0.5)
             exp_gained = min(exp_gained, max_exp_steal)  # Giới hạn exp cướp được
             combat_log.append(f"🏆 {attacker_user.display_name} thắng với HP cao hơn!")
-
-            await self.db.update_player(
-                attacker_user.id,
-                exp=attacker_data['exp'] + exp_gained,
-                stats__pvp_wins=(attacker_data.get('stats', {}).get('pvp_wins', 0) + 1)
-            )
-
-            await self.db.update_player(
-                defender_user.id,
-                exp=max(0, defender_data['exp'] - exp_gained),
-                stats__pvp_losses=(defender_data.get('stats', {}).get('pvp_losses', 0) + 1)
-            )
-
-            return attacker_user, defender_user, exp_gained, combat_log
         else:
             combat_log.append(f"🛡️ {defender_user.display_name} thắng với HP cao hơn!")
+            exp_gained = 0
 
-            await self.db.update_player(
-                attacker_user.id,
-                stats__pvp_losses=(attacker_data.get('stats', {}).get('pvp_losses', 0) + 1)
-            )
-
-            await self.db.update_player(
-                defender_user.id,
-                stats__pvp_wins=(defender_data.get('stats', {}).get('pvp_wins', 0) + 1)
-            )
+        attacker_won = result.winner == FIRST or (result.winner is None and result.first_hp > result.second_hp)
+        if attacker_won:
+            # Cập nhật exp cho người thắng và người thua
+            await self.db.increment_exp(attacker_user.id, exp_gained, stats={'pvp_wins': 1})
+            await self.db.increment_exp(defender_user.id, -exp_gained, stats={'pvp_losses': 1})
+            return attacker_user, defender_user, exp_gained, combat_log
 
-            return defender_user, attacker_user, 0, combat_log
+        # Cập nhật thống kê
+        await self.db.increment_player_stats(attacker_user.id, pvp_losses=1)
+        await self.db.increment_player_stats(defender_user.id, pvp_wins=1)
+        return defender_user, attacker_user, 0, combat_log
 
     async def process_friendly_combat(
             self,
@@ -544,181 +487,34 @@ class Combat(commands.Cog):
             defender_user: discord.Member,
             attacker_data: Dict[str, Any],
             defender_data: Dict[str, Any]
-    ) -> Tuple[discord.Member, discord.Member, int, List[str]]:
+    ) -> Tuple[discord.Member, discord.Member, int, CombatLog]:
         """Xử lý quá trình chiến đấu tự do (không cướp exp)"""
-        # Khởi tạo thông số chiến đấu
-        attacker_hp = attacker_data.get('hp', 100)
-        defender_hp = defender_data.get('hp', 100)
-
-        # Tính toán sức mạnh có áp dụng bonus từ môn phái
-        attacker_atk, attacker_def = self.calculate_combat_stats(attacker_data)
-        defender_atk, defender_def = self.calculate_combat_stats(defender_data)
-
-        # Lấy giá trị từ config hoặc mặc định
-        damage_variation = DAMAGE_VARIATION if 'DAMAGE_VARIATION' in globals() else self.default_damage_variation
-
-        # Ghi lại log chiến đấu
-        combat_log = []
-
-        # Lấy kỹ năng của người chơi dựa trên cảnh giới
-        attacker_skills = self.get_skills_by_level(attacker_data.get('level', 'Phàm Nhân'))
-        defender_skills = self.get_skills_by_level(defender_data.get('level', 'Phàm Nhân'))
-
-        # Vòng lặp chiến đấu
-        turn = 0
-        max_turns = 15  # Tăng số turn cho trận đấu tự do
-
-        while attacker_hp > 0 and defender_hp > 0 and turn < max_turns:
-            turn += 1
-
-            # Người tấn công đánh trước
-            # Kiểm tra né tránh
-            if random.random() < 0.1:  # 10% cơ hội né tránh
-                dodge_msg = random.choice(self.dodge_messages)
-                combat_log.append(dodge_msg.format(
-                    attacker=attacker_user.display_name,
-                    defender=defender_user.display_name
-                ))
-            else:
-                # Kiểm tra đòn chí mạng
-                is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                # Chọn kỹ năng ngẫu nhiên
-                skill = random.choice(attacker_skills)
-
-                # Tính sát thương
-                damage_multiplier = 1.5 if is_crit else 1.0 + random.uniform(-damage_variation, damage_variation)
-                damage = int(self.calculate_damage(attacker_atk, defender_def) * damage_multiplier)
-                defender_hp -= damage
-
-                # Thêm log chiến đấu
-                if is_crit:
-                    msg = random.choice(self.critical_messages)
-                else:
-                    msg = random.choice(self.attack_messages)
+        # Tăng số turn cho trận đấu tự do
+        result, combat_log = self.run_duel(attacker_user, defender_user, attacker_data, defender_data, max_turns=15)
 
-                combat_log.append(msg.format(
-                    attacker=attacker_user.display_name,
-                    defender=defender_user.display_name,
-                    damage=damage,
-                    skill=skill
-                ))
-
-            # Kiểm tra HP
-            if defender_hp <= 0:
-                combat_log.append(f"🏆 {attacker_user.display_name} đã chiến thắng trong trận đấu tự do!")
-
-                # Không cập nhật exp, chỉ cập nhật thống kê
-                await self.db.update_player(
-                    attacker_user.id,
-                    stats__friendly_wins=(attacker_data.get('stats', {}).get('friendly_wins', 0) + 1)
-                )
-
-                await self.db.update_player(
-                    defender_user.id,
-                    stats__friendly_losses=(defender_data.get('stats', {}).get('friendly_losses', 0) + 1)
-                )
-
-                return attacker_user, defender_user, 0, combat_log
-
-            # Người phòng thủ đánh lại
-            # Kiểm tra né tránh
-            if random.random() < 0.1:  # 10% cơ hội né tránh
-                dodge_msg = random.choice(self.dodge_messages)
-                combat_log.append(dodge_msg.format(
-                    attacker=defender_user.display_name,
-                    defender=attacker_user.display_name
-                ))
-            else:
-                # Kiểm tra đòn chí mạng
-                is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                # Chọn kỹ năng ngẫu nhiên
-                skill = random.choice(defender_skills)
-
-                # Tính sát thương
-                damage_multiplier = 1.5 if is_crit else 1.0 + random.uniform(-damage_variation, damage_variation)
-                damage = int(self.calculate_damage(defender_atk, attacker_def) * damage_multiplier)
-                attacker_hp -= damage
-
-                # Thêm log chiến đấu
-                if is_crit:
-                    msg = random.choice(self.critical_messages)
-                else:
-                    msg = random.choice(self.attack_messages)
-
-                combat_log.append(msg.format(
-                    attacker=defender_user.display_name,
-                    defender=attacker_user.display_name,
-                    damage=damage,
-                    skill=skill
-                ))
-
-            # Kiểm tra HP
-            if attacker_hp <= 0:
-                combat_log.append(f"🏆 {defender_user.display_name} đã chiến thắng trong trận đấu tự do!")
-
-                # Không cập nhật exp, chỉ cập nhật thống kê
-                await self.db.update_player(
-                    attacker_user.id,
-                    stats__friendly_losses=(attacker_data.get('stats', {}).get('friendly_losses', 0) + 1)
-                )
-
-                await self.db.update_player(
-                    defender_user.id,
-                    stats__friendly_wins=(defender_data.get('stats', {}).get('friendly_wins', 0) + 1)
-                )
-
-                return defender_user, attacker_user, 0, combat_log
-
-        # Nếu đạt max turn mà chưa có kết quả, người có HP cao hơn thắng
-        if attacker_hp > defender_hp:
-            combat_log.append(f"🏆 {attacker_user.display_name} thắng với HP cao hơn trong trận đấu tự do!")
-
-            # Không cập nhật exp, chỉ cập nhật thống kê
-            await self.db.update_player(
-                attacker_user.id,
-                stats__friendly_wins=(attacker_data.get('stats', {}).get('friendly_wins', 0) + 1)
-            )
-
-            await self.db.update_player(
-                defender_user.id,
-                stats__friendly_losses=(defender_data.get('stats', {}).get('friendly_losses', 0) + 1)
-            )
-
-            return attacker_user, defender_user, 0, combat_log
+        if result.winner is not None:
+            attacker_won = result.winner == FIRST
+            winner_user = attacker_user if attacker_won else defender_user
+            combat_log.append(f"🏆 {winner_user.display_name} đã chiến thắng trong trận đấu tự do!")
         else:
-            combat_log.append(f"🏆 {defender_user.display_name} thắng với HP cao hơn trong trận đấu tự do!")
-
-            # Không cập nhật exp, chỉ cập nhật thống kê
-            await self.db.update_player(
-                attacker_user.id,
-                stats__friendly_losses=(attacker_data.get('stats', {}).get('friendly_losses', 0) + 1)
-            )
-
-            await self.db.update_player(
-                defender_user.id,
-                stats__friendly_wins=(defender_data.get('stats', {}).get('friendly_wins', 0) + 1)
-            )
+            # Nếu đạt max turn mà chưa có kết quả, người có HP cao hơn thắng
+            attacker_won = result.first_hp > result.second_hp
+            winner_user = attacker_user if attacker_won else defender_user
+            combat_log.append(f"🏆 {winner_user.display_name} thắng với HP cao hơn trong trận đấu tự do!")
+
+        # Không cập nhật exp, chỉ cập nhật thống kê
+        if attacker_won:
+            await self.db.increment_player_stats(attacker_user.id, friendly_wins=1)
+            await self.db.increment_player_stats(defender_user.id, friendly_losses=1)
+            return attacker_user, defender_user, 0, combat_log
 
-            return defender_user, attacker_user, 0, combat_log
+        await self.db.increment_player_stats(attacker_user.id, friendly_losses=1)
+        await self.db.increment_player_stats(defender_user.id, friendly_wins=1)
+        return defender_user, attacker_user, 0, combat_log
 
     def calculate_combat_stats(self, player_data: Dict[str, Any]) -> Tuple[int, int]:
-        """Tính toán sức công kích và phòng thủ có áp dụng bonus từ môn phái"""
-        # Lấy chỉ số cơ bản
-        attack = player_data.get('attack', 10)
-        defense = player_data.get('defense', 5)
-
-        # Lấy tông môn và áp dụng bonus
-        sect = player_data.get('sect')
-        if sect and sect in SECTS:
-            attack_bonus = SECTS[sect].get('attack_bonus', 1.0)
-            defense_bonus = SECTS[sect].get('defense_bonus', 1.0)
-
-            attack = int(attack * attack_bonus)
-            defense = int(defense * defense_bonus)
-
-        return attack, defense
+        """Tính toán sức công kích và phòng thủ có áp dụng bonus từ môn phái (tra bảng tính sẵn)"""
+        return combat_stats.effective_stats(player_data)
 
     def calculate_damage(self, attack: int, defense: int, variation: float = 0.2) -> int:
         """Tính toán sát thương với yếu tố ngẫu nhiên"""
@@ -731,52 +527,13 @@ class Combat(commands.Cog):
 
         return damage
 
-    def get_skills_by_level(self, level: str) -> List[str]:
+    def get_skills_by_level(self, level: str) -> Tuple[str, ...]:
         """Lấy danh sách kỹ năng dựa trên cảnh giới"""
-        # Kỹ năng cơ bản
-        basic_skills = ["Quyền Cước", "Kiếm Pháp Cơ Bản", "Chưởng Pháp"]
-
-        # Kỹ năng theo cảnh giới
-        if "Luyện Khí" in level:
-            return basic_skills + ["Linh Khí Quyền", "Ngưng Khí Thuật"]
-        elif "Trúc Cơ" in level:
-            return basic_skills + ["Linh Khí Quyền", "Ngưng Khí Thuật", "Trúc Cơ Kiếm Pháp", "Linh Khí Phá"]
-        elif "Nguyên Anh" in level:
-            return basic_skills + ["Trúc Cơ Kiếm Pháp", "Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất"]
-        elif "Kim Đan" in level or self.higher_level(level):
-            return ["Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất", "Kiếm Khí Trảm", "Đại Đạo Vô Hình",
-                    "Tiên Thiên Công"]
-        else:
-            return basic_skills
-
-    def higher_level(self, level: str) -> bool:
-        """Kiểm tra xem cảnh giới có cao hơn Kim Đan không"""
-        high_levels = ["Hóa Thần", "Luyện Hư", "Đại Thừa", "Diễn Chủ"]
-        return any(high in level for high in high_levels)
+        return combat_stats.skills(level)
 
     def get_level_index(self, level: str) -> int:
-        """Lấy chỉ số của cảnh giới trong danh sách cảnh giới"""
-        cultivation_cog = self.bot.get_cog('Cultivation')
-        if cultivation_cog and hasattr(cultivation_cog, 'CULTIVATION_RANKS'):
-            try:
-                return cultivation_cog.CULTIVATION_RANKS.index(level)
-            except ValueError:
-                return 0
-
-        # Fallback nếu không tìm thấy Cultivation cog
-        levels = [
-            "Phàm Nhân",
-            "Luyện Khí Tầng 1", "Luyện Khí Tầng 2", "Luyện Khí Tầng 3",
-            "Luyện Khí Tầng 4", "Luyện Khí Tầng 5", "Luyện Khí Tầng 6",
-            "Luyện Khí Tầng 7", "Luyện Khí Tầng 8", "Luyện Khí Tầng 9",
-            "Trúc Cơ Sơ Kỳ", "Trúc Cơ Trung Kỳ", "Trúc Cơ Đại Viên Mãn",
-            "Nguyên Anh Sơ Kỳ", "Nguyên Anh Trung Kỳ", "Nguyên Anh Đại Viên Mãn",
-            "Kim Đan Sơ Kỳ", "Kim Đan Trung Kỳ", "Kim Đan Đại Viên Mãn"
-        ]
-        try:
-            return levels.index(level)
-        except ValueError:
-            return 0
+        """Lấy chỉ số của cảnh giới trong bảng cảnh giới"""
+        return level_table.index(level)
 
     async def create_combat_result_embed(
             self,
@@ -787,7 +544,7 @@ class Combat(commands.Cog):
             winner: discord.Member,
             loser: discord.Member,
             exp_gained: int,
-            combat_log: list
+            combat_log: Sequence[str]
     ) -> discord.Embed:
         """Tạo embed hiển thị kết quả trận đấu"""
         # Màu sắc dựa trên kết quả
@@ -883,7 +640,7 @@ class Combat(commands.Cog):
             defender_data: Dict[str, Any],
             winner: discord.Member,
             loser: discord.Member,
-            combat_log: list
+            combat_log: Sequence[str]
     ) -> discord.Embed:
         """Tạo embed hiển thị kết quả trận đấu tự do"""
         # Màu sắc dựa trên kết quả
@@ -971,8 +728,8 @@ class Combat(commands.Cog):
         return embed
 
     async def log_combat(self, attacker_id: int, defender_id: int, attacker_won: bool, exp_gained: int,
-                         friendly: bool = False):
-        """Ghi lại lịch sử trận đấu vào database"""
+                         friendly: bool = False, rounds: Optional[List[Dict[str, Any]]] = None):
+        """Ghi lại lịch sử trận đấu (qua hàng đợi ghi theo lô nếu có)"""
         try:
             # Tạo dữ liệu trận đấu
             combat_data = {
@@ -981,21 +738,133 @@ class Combat(commands.Cog):
                 "result": "win" if attacker_won else "lose",
                 "exp_gained": exp_gained,
                 "friendly": friendly,
+                "rounds": rounds or [],
                 "timestamp": datetime.now()
             }
 
             # Lưu vào database
-            await self.db.add_combat_history(
-                attacker_id=attacker_id,
-                defender_id=defender_id,
-                result="win" if attacker_won else "lose",
-                exp_gained=exp_gained,
-                friendly=friendly
-            )
+            writer = getattr(self.bot, 'combat_history_writer', None)
+            if writer:
+                await writer.put(combat_data)
+            else:
+                await self.db.insert_combat_history([combat_data])
 
         except Exception as e:
             print(f"Lỗi khi log trận đấu: {e}")
 
+    @commands.command(name="dudoan", aliases=["predict", "tile"], usage="[@người_chơi]")
+    @commands.guild_only()
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def predict(self, ctx, target: discord.Member = None):
+        """Dự đoán tỷ lệ thắng khi khiêu chiến (mô phỏng, không ảnh hưởng dữ liệu)"""
+        attacker = await self.db.get_player(ctx.author.id)
+        if not attacker:
+            await ctx.send(
+                f"{ctx.author.mention}, bạn chưa bắt đầu tu luyện! Hãy sử dụng lệnh `!tongmon` để chọn môn phái.")
+            return
+
+        if target and (target.id == ctx.author.id or target.bot):
+            await ctx.send("Hãy chọn một người chơi khác để dự đoán!")
+            return
+
+        embed = discord.Embed(
+            title="🔮 Dự Đoán Chiến Đấu",
+            color=0x9b59b6,
+            timestamp=datetime.now()
+        )
+
+        if target:
+            defender = await self.db.get_player(target.id)
+            if not defender:
+                await ctx.send(f"{target.mention} chưa bắt đầu tu luyện!")
+                return
+
+            # Không dự đoán trận mà !combat sẽ từ chối
+            if attacker.get('hp', 100) <= 0:
+                await ctx.send(
+                    f"{ctx.author.mention}, bạn đang bị thương nặng, không thể chiến đấu! Hãy hồi phục trước.")
+                return
+            if defender.get('hp', 100) <= 0:
+                await ctx.send(f"{target.mention} đang bị thương nặng, không thể chiến đấu!")
+                return
+            level_gap = self.estimator.level_gap(attacker, defender)
+            if abs(level_gap) > MAX_LEVEL_GAP:
+                if level_gap > 0:
+                    await ctx.send(
+                        f"❌ Cảnh giới của bạn quá cao so với {target.display_name}. Không thể khiêu chiến!")
+                else:
+                    await ctx.send(
+                        f"❌ Cảnh giới của bạn quá thấp so với {target.display_name}. Không thể khiêu chiến!")
+                return
+
+            estimate = await self.estimator.estimate_pvp(
+                attacker.get('level', 'Phàm Nhân'), attacker.get('sect'),
+                defender.get('level', 'Phàm Nhân'), defender.get('sect')
+            )
+            expected_exp = self.estimator.expected_exp_steal(estimate, defender.get('exp', 0))
+
+            embed.description = f"{ctx.author.mention} khiêu chiến {target.mention}"
+            embed.add_field(
+                name="📊 Kết Quả Dự Kiến",
+                value=(
+                    f"🏆 Tỷ lệ thắng: {estimate['win_rate'] * 100:.1f}%\n"
+                    f"⚔️ Hạ gục đối thủ: {estimate['knockout_rate'] * 100:.1f}%\n"
+                    f"💔 Tỷ lệ thua: {estimate['loss_rate'] * 100:.1f}%\n"
+                    f"🔄 Số lượt trung bình: {estimate['expected_turns']:.1f}\n"
+                    f"💰 EXP cướp được dự kiến: {expected_exp:,.0f}"
+                ),
+                inline=False
+            )
+        else:
+            # Gợi ý đối thủ cân sức từ bảng xếp hạng
+            candidates = [candidate for candidate in await self.db.get_top_players(50)
+                          if abs(self.estimator.level_gap(attacker, candidate)) <= MAX_LEVEL_GAP]
+
+            # Bảng xếp hạng không giữ máu: đọc máu của các ứng viên còn lại trong một truy vấn
+            if candidates:
+                hp = {}
+                async for player in self.db.iter_players(
+                        query={"user_id": {"$in": [candidate['user_id'] for candidate in candidates]}},
+                        projection=["user_id", "hp"]):
+                    hp[player.get('user_id')] = player.get('hp', 100)
+                candidates = [dict(candidate, hp=hp.get(candidate['user_id'], 100)) for candidate in candidates]
+
+            matches = await self.estimator.find_matches(attacker, candidates, limit=3)
+
+            embed.description = f"Các đối thủ cân sức với {ctx.author.mention}"
+            lines = []
+            for candidate, estimate in matches:
+                member = ctx.guild.get_member(candidate['user_id']) or self.bot.get_user(candidate['user_id'])
+                name = member.display_name if member else f"ID: {candidate['user_id']}"
+                expected_exp = self.estimator.expected_exp_steal(estimate, candidate.get('exp', 0))
+                lines.append(
+                    f"• **{name}** ({candidate.get('level', 'Phàm Nhân')}): "
+                    f"thắng {estimate['win_rate'] * 100:.1f}%, ~{expected_exp:,.0f} exp"
+                )
+
+            embed.add_field(
+                name="👥 Đối Thủ Gợi Ý",
+                value="\n".join(lines) if lines else "Chưa có đối thủ phù hợp",
+                inline=False
+            )
+
+            monster = await self.estimator.estimate_monster(attacker.get('level', 'Phàm Nhân'))
+            elite = await self.estimator.estimate_monster(attacker.get('level', 'Phàm Nhân'), is_elite=True)
+            if monster and elite:
+                embed.add_field(
+                    name="🗡️ Đánh Quái",
+                    value=(
+                        f"Quái thường: thắng {monster['win_rate'] * 100:.1f}%, "
+                        f"~{self.estimator.expected_monster_exp(monster):.0f} exp\n"
+                        f"Quái tinh anh: thắng {elite['win_rate'] * 100:.1f}%, "
+                        f"~{self.estimator.expected_monster_exp(elite, is_elite=True):.0f} exp"
+                    ),
+                    inline=False
+                )
+
+        embed.set_footer(text=f"Dựa trên {self.estimator.samples:,} trận mô phỏng • Chỉ mang tính tham khảo")
+        await ctx.send(embed=embed)
+
     @commands.command(name="combatinfo", aliases=["pvpinfo", "chiendau"], usage="")
     async def combat_info(self, ctx):
         """Xem thông tin hệ thống chiến đấu PvP"""
@@ -1210,10 +1079,7 @@ class Combat(commands.Cog):
             # Định dạng thời gian
             match_time = match.get('timestamp', datetime.now())
             if isinstance(match_time, str):
-                try:
-                    match_time = datetime.strptime(match_time, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    match_time = datetime.now()
+                match_time = datetime.now()
 
             time_ago = self.format_time_ago(match_time)
 
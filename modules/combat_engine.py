@@ -0,0 +1,392 @@
+# modules/combat_engine.py
+import random
+from bisect import bisect_left
+from collections.abc import Sequence
+from itertools import accumulate
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence as SequenceType, Tuple, Union
+
+# Phe trong một trận đấu: bên ra đòn trước / bên ra đòn sau
+FIRST = 0
+SECOND = 1
+
+# Số lần rút ngẫu nhiên cho mỗi đòn: né, chí mạng, dao động gốc, dao động đòn, kỹ năng, thông báo
+ROLLS_PER_STRIKE = 6
+# Mô phỏng hàng loạt chỉ cần bốn số đầu (không chọn kỹ năng/thông báo)
+STRIKE_ROLLS_DAMAGE_ONLY = 4
+
+
+class Striker:
+    """Thông số ra đòn của một bên
+
+    - base_damage: sát thương gốc trước khi áp dụng dao động
+    - dodge_chance: xác suất đối thủ né được đòn của bên này
+    - variation: dao động ±variation cho đòn thường (đòn chí mạng nhân crit_multiplier)
+    - base_variation: dao động áp dụng lên sát thương gốc trước (0 = không dùng)
+    """
+
+    __slots__ = ("name", "base_damage", "skills", "dodge_chance", "crit_chance",
+                 "variation", "base_variation", "crit_multiplier")
+
+    def __init__(self, name: str, base_damage: int, skills: SequenceType[str],
+                 dodge_chance: float = 0.1, crit_chance: float = 0.15, variation: float = 0.2,
+                 base_variation: float = 0.0, crit_multiplier: float = 1.5):
+        self.name = name
+        self.base_damage = base_damage
+        self.skills = tuple(skills) or ("Tấn Công Thường",)
+        self.dodge_chance = dodge_chance
+        self.crit_chance = crit_chance
+        self.variation = variation
+        self.base_variation = base_variation
+        self.crit_multiplier = crit_multiplier
+
+
+class StrikeEvent(NamedTuple):
+    """Một đòn đánh đã được tính sẵn (chưa tạo văn bản)"""
+    side: int
+    turn: int
+    dodged: bool
+    crit: bool
+    damage: int
+    skill: str
+    roll: float  # Dùng để chọn câu thông báo khi hiển thị
+    member: int = 0  # Thành viên đội liên quan (người ra đòn hoặc bị đánh) trong trận đánh boss
+
+
+class StrikeRolls:
+    """Kết quả rút ngẫu nhiên trước cho toàn bộ các lượt của một bên"""
+
+    __slots__ = ("dodged", "crit", "damage", "skills", "message_rolls", "cumulative")
+
+    def __init__(self, dodged: List[bool], crit: List[bool], damage: List[int],
+                 skills: List[str], message_rolls: List[float]):
+        self.dodged = dodged
+        self.crit = crit
+        self.damage = damage
+        self.skills = skills
+        self.message_rolls = message_rolls
+        # Tổng sát thương tích lũy sau mỗi lượt (không giảm, nên tra được bằng bisect)
+        self.cumulative = list(accumulate(damage))
+
+    def event(self, side: int, index: int) -> StrikeEvent:
+        return StrikeEvent(side, index + 1, self.dodged[index], self.crit[index], self.damage[index],
+                           self.skills[index], self.message_rolls[index])
+
+
+class FightResult:
+    """Kết quả một trận đấu: máu còn lại, bên thắng và chuỗi đòn đánh"""
+
+    __slots__ = ("first_hp", "second_hp", "winner", "turns", "events")
+
+    def __init__(self, first_hp: int, second_hp: int, winner: Optional[int], turns: int,
+                 events: List[StrikeEvent]):
+        self.first_hp = first_hp
+        self.second_hp = second_hp
+        self.winner = winner  # FIRST / SECOND, None nếu hết lượt mà chưa ai gục
+        self.turns = turns
+        self.events = events
+
+
+class BatchOutcome:
+    """Thống kê kết quả của một lô trận đấu mô phỏng"""
+
+    __slots__ = ("samples", "first_max_hp", "first_knockouts", "second_knockouts",
+                 "first_timeout_wins", "timeouts", "first_healthy_wins", "total_turns")
+
+    # Ngưỡng máu còn lại (tỷ lệ) được coi là thắng "an toàn" (thưởng thêm exp khi đánh quái)
+    HEALTHY_RATIO = 0.8
+
+    def __init__(self, samples: int, first_max_hp: int):
+        self.samples = samples
+        self.first_max_hp = first_max_hp
+        self.first_knockouts = 0  # Bên thứ nhất hạ gục đối thủ
+        self.second_knockouts = 0  # Bên thứ hai hạ gục đối thủ
+        self.first_timeout_wins = 0  # Hết lượt và bên thứ nhất còn nhiều máu hơn
+        self.timeouts = 0
+        self.first_healthy_wins = 0  # Bên thứ nhất hạ gục đối thủ khi còn trên 80% máu
+        self.total_turns = 0
+
+    def add(self, winner: Optional[int], first_left: int, second_left: int, turns: int):
+        self.total_turns += turns
+        if winner == FIRST:
+            self.first_knockouts += 1
+            if self.first_max_hp and first_left / self.first_max_hp > self.HEALTHY_RATIO:
+                self.first_healthy_wins += 1
+        elif winner == SECOND:
+            self.second_knockouts += 1
+        else:
+            self.timeouts += 1
+            if first_left > second_left:
+                self.first_timeout_wins += 1
+
+    def scale(self, samples: int):
+        """Nhân kết quả của một trận tất định lên cho cả lô"""
+        for field in ("first_knockouts", "second_knockouts", "first_timeout_wins", "timeouts",
+                      "first_healthy_wins", "total_turns"):
+            setattr(self, field, getattr(self, field) * samples)
+
+    def rate(self, count: int) -> float:
+        return count / self.samples if self.samples else 0.0
+
+    @property
+    def first_win_rate(self) -> float:
+        """Tỷ lệ bên thứ nhất thắng (hạ gục hoặc hơn máu khi hết lượt)"""
+        return self.rate(self.first_knockouts + self.first_timeout_wins)
+
+    @property
+    def expected_turns(self) -> float:
+        return self.rate(self.total_turns)
+
+
+class BossRound(NamedTuple):
+    """Một vòng đánh boss đã tính sẵn cùng máu của các bên sau vòng"""
+    number: int
+    events: List[StrikeEvent]
+    boss_hp: int
+    team_hp: Tuple[int, ...]
+
+
+class BossFightResult:
+    """Kết quả trận đánh boss theo đội"""
+
+    __slots__ = ("boss_hp", "team_hp", "rounds")
+
+    def __init__(self, boss_hp: int, team_hp: List[int], rounds: List[BossRound]):
+        self.boss_hp = boss_hp
+        self.team_hp = team_hp
+        self.rounds = rounds
+
+    @property
+    def is_victory(self) -> bool:
+        return self.boss_hp <= 0
+
+    @property
+    def events(self) -> List[StrikeEvent]:
+        return [event for round_ in self.rounds for event in round_.events]
+
+    def events_until(self, round_count: int) -> List[StrikeEvent]:
+        """Các đòn đánh từ đầu đến hết vòng round_count"""
+        return [event for round_ in self.rounds[:round_count] for event in round_.events]
+
+
+class CombatLog(Sequence):
+    """Nhật ký chiến đấu chỉ tạo văn bản cho những dòng thực sự được đọc
+
+    Hành xử như một list chuỗi (len, chỉ số, slice, duyệt), nhưng mỗi đòn chỉ
+    được định dạng khi được truy cập lần đầu. Có thể thêm dòng văn bản có sẵn.
+    """
+
+    def __init__(self, events: List[StrikeEvent], render: Callable[[StrikeEvent], str]):
+        self._entries: List[Union[StrikeEvent, str]] = list(events)
+        self._render = render
+        self._rendered: Dict[int, str] = {}
+
+    def append(self, line: str):
+        """Thêm một dòng văn bản (ví dụ thông báo chiến thắng)"""
+        self._entries.append(line)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._line(i) for i in range(*index.indices(len(self._entries)))]
+        if index < 0:
+            index += len(self._entries)
+        if not 0 <= index < len(self._entries):
+            raise IndexError("combat log index out of range")
+        return self._line(index)
+
+    def _line(self, index: int) -> str:
+        entry = self._entries[index]
+        if isinstance(entry, str):
+            return entry
+        line = self._rendered.get(index)
+        if line is None:
+            line = self._rendered[index] = self._render(entry)
+        return line
+
+    def to_records(self) -> List[Dict]:
+        """Dữ liệu gọn của các đòn đánh để lưu lịch sử (không cần tạo văn bản)"""
+        return [
+            {"side": entry.side, "turn": entry.turn, "dodged": entry.dodged, "crit": entry.crit,
+             "damage": entry.damage, "skill": entry.skill}
+            for entry in self._entries if isinstance(entry, StrikeEvent)
+        ]
+
+
+def pick(messages: SequenceType[str], roll: float) -> str:
+    """Chọn một câu thông báo theo giá trị ngẫu nhiên đã rút sẵn"""
+    return messages[min(int(roll * len(messages)), len(messages) - 1)]
+
+
+class CombatEngine:
+    """Bộ máy chiến đấu dùng chung cho PvP và đánh quái
+
+    Toàn bộ các lần rút ngẫu nhiên (né, chí mạng, dao động, kỹ năng) của tối đa
+    max_turns lượt được rút một lần, sát thương tích lũy được tính bằng tổng
+    dồn và thời điểm hạ gục được tìm bằng bisect thay cho vòng lặp từng lượt.
+    Truyền seed để tái lập kết quả.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+
+    def roll_strikes(self, striker: Striker, turns: int) -> StrikeRolls:
+        """Rút trước mọi yếu tố ngẫu nhiên cho `turns` đòn của một bên"""
+        draws = [self.rng.random() for _ in range(turns * ROLLS_PER_STRIKE)]
+        dodged, crit, damage = strike_damage(striker, draws, ROLLS_PER_STRIKE)
+
+        skills = striker.skills
+        skill_count = len(skills)
+        skill_names = [skills[min(int(roll * skill_count), skill_count - 1)]
+                       for roll in draws[4::ROLLS_PER_STRIKE]]
+
+        return StrikeRolls(dodged, crit, damage, skill_names, draws[5::ROLLS_PER_STRIKE])
+
+    def fight(self, first: Striker, first_hp: int, second: Striker, second_hp: int,
+              max_turns: int = 10) -> FightResult:
+        """Mô phỏng trận đấu luân phiên: mỗi lượt bên thứ nhất đánh trước, bên thứ hai đánh trả
+
+        Trận dừng ngay khi một bên hết máu hoặc sau max_turns lượt.
+        """
+        if first_hp <= 0 or second_hp <= 0 or max_turns <= 0:
+            return FightResult(first_hp, second_hp, None, 0, [])
+
+        first_rolls = self.roll_strikes(first, max_turns)
+        second_rolls = self.roll_strikes(second, max_turns)
+
+        winner, first_strikes, second_strikes = resolve_knockout(
+            first_rolls.cumulative, first_hp, second_rolls.cumulative, second_hp, max_turns)
+
+        events = []
+        for index in range(first_strikes):
+            events.append(first_rolls.event(FIRST, index))
+            if index < second_strikes:
+                events.append(second_rolls.event(SECOND, index))
+
+        first_taken = second_rolls.cumulative[second_strikes - 1] if second_strikes else 0
+        second_taken = first_rolls.cumulative[first_strikes - 1] if first_strikes else 0
+        return FightResult(first_hp - first_taken, second_hp - second_taken, winner, first_strikes, events)
+
+    def strike(self, striker: Striker, side: int, turn: int, member: int = 0) -> StrikeEvent:
+        """Tính một đòn đánh đơn lẻ (dùng cho trận nhiều người, thứ tự đòn phụ thuộc diễn biến)"""
+        draws = [self.rng.random() for _ in range(ROLLS_PER_STRIKE)]
+        dodged, crit, damage = strike_damage(striker, draws, ROLLS_PER_STRIKE)
+        skills = striker.skills
+        skill = skills[min(int(draws[4] * len(skills)), len(skills) - 1)]
+        return StrikeEvent(side, turn, dodged[0], crit[0], damage[0], skill, draws[5], member)
+
+    def boss_fight(self, team: List[Tuple[Striker, int]], boss: Striker, boss_hp: int,
+                   max_rounds: int = 20) -> BossFightResult:
+        """Tính trước toàn bộ trận đánh boss theo đội
+
+        Mỗi vòng, từng thành viên còn sống lần lượt đánh boss (dừng ngay khi boss
+        gục), sau đó boss đánh một thành viên còn sống ngẫu nhiên.
+        """
+        team_hp = [hp for _, hp in team]
+        rounds: List[BossRound] = []
+
+        while boss_hp > 0 and any(hp > 0 for hp in team_hp) and len(rounds) < max_rounds:
+            number = len(rounds) + 1
+            events = []
+
+            for index, (striker, _) in enumerate(team):
+                if team_hp[index] <= 0:
+                    continue
+                event = self.strike(striker, FIRST, number, index)
+                boss_hp -= event.damage
+                events.append(event)
+                if boss_hp <= 0:
+                    break
+
+            if boss_hp > 0:
+                alive = [index for index, hp in enumerate(team_hp) if hp > 0]
+                target = alive[min(int(self.rng.random() * len(alive)), len(alive) - 1)]
+                event = self.strike(boss, SECOND, number, target)
+                team_hp[target] -= event.damage
+                events.append(event)
+
+            rounds.append(BossRound(number, events, boss_hp, tuple(team_hp)))
+
+        return BossFightResult(boss_hp, team_hp, rounds)
+
+    def simulate_many(self, first: Striker, first_hp: int, second: Striker, second_hp: int,
+                      max_turns: int = 10, samples: int = 1000) -> BatchOutcome:
+        """Mô phỏng nhiều trận giống nhau trong một lô (không tạo sự kiện hay văn bản)
+
+        Các số ngẫu nhiên của cả lô được rút một lần; mỗi trận chỉ cần tổng dồn
+        sát thương và hai lần bisect.
+        """
+        outcome = BatchOutcome(samples, first_hp)
+        if first_hp <= 0 or second_hp <= 0 or max_turns <= 0 or samples <= 0:
+            outcome.add(None, first_hp, second_hp, 0)
+            outcome.scale(samples)
+            return outcome
+
+        stride = STRIKE_ROLLS_DAMAGE_ONLY
+        block = max_turns * stride
+        first_draws = [self.rng.random() for _ in range(samples * block)]
+        second_draws = [self.rng.random() for _ in range(samples * block)]
+        _, _, first_damage = strike_damage(first, first_draws, stride)
+        _, _, second_damage = strike_damage(second, second_draws, stride)
+
+        for sample in range(samples):
+            window = slice(sample * max_turns, (sample + 1) * max_turns)
+            first_cumulative = list(accumulate(first_damage[window]))
+            second_cumulative = list(accumulate(second_damage[window]))
+            winner, first_strikes, second_strikes = resolve_knockout(
+                first_cumulative, first_hp, second_cumulative, second_hp, max_turns)
+
+            first_left = first_hp - (second_cumulative[second_strikes - 1] if second_strikes else 0)
+            second_left = second_hp - first_cumulative[first_strikes - 1]
+            outcome.add(winner, first_left, second_left, first_strikes)
+
+        return outcome
+
+
+def strike_damage(striker: Striker, draws: List[float], stride: int) -> Tuple[List[bool], List[bool], List[int]]:
+    """Tính né/chí mạng/sát thương của từng đòn từ dãy số ngẫu nhiên đã rút
+
+    Mỗi đòn dùng `stride` số liên tiếp; bốn số đầu lần lượt là né, chí mạng,
+    dao động gốc và dao động đòn.
+    """
+    dodged = [roll < striker.dodge_chance for roll in draws[0::stride]]
+    crit = [roll < striker.crit_chance for roll in draws[1::stride]]
+
+    base = striker.base_damage
+    base_variation = striker.base_variation
+    if base_variation:
+        bases = [max(1, int(base * (1.0 - base_variation + 2 * base_variation * roll)))
+                 for roll in draws[2::stride]]
+    else:
+        bases = [base] * len(dodged)
+
+    variation = striker.variation
+    crit_multiplier = striker.crit_multiplier
+    damage = [
+        0 if is_dodged else int(value * (crit_multiplier if is_crit else 1.0 - variation + 2 * variation * roll))
+        for is_dodged, is_crit, value, roll in zip(dodged, crit, bases, draws[3::stride])
+    ]
+    return dodged, crit, damage
+
+
+def resolve_knockout(first_cumulative: List[int], first_hp: int, second_cumulative: List[int], second_hp: int,
+                     max_turns: int) -> Tuple[Optional[int], int, int]:
+    """Xác định bên thắng và số đòn mỗi bên đã ra từ sát thương tích lũy
+
+    Trả về (bên thắng hoặc None nếu hết lượt, số đòn bên thứ nhất, số đòn bên thứ hai).
+    """
+    # Lượt (tính từ 0) mà mỗi bên hạ gục đối thủ, max_turns nếu không hạ được
+    first_kill = bisect_left(first_cumulative, second_hp)
+    second_kill = bisect_left(second_cumulative, first_hp)
+
+    if first_kill < max_turns and first_kill <= second_kill:
+        return FIRST, first_kill + 1, first_kill
+    if second_kill < max_turns:
+        return SECOND, second_kill + 1, second_kill + 1
+    return None, max_turns, max_turns
+
+
+def pvp_base_damage(attack: int, defense: int) -> int:
+    """Sát thương gốc PvP: công kích trừ nửa phòng thủ, tối thiểu 1"""
+    return max(1, attack - defense // 2)
@@ -0,0 +1,110 @@
+# modules/combat_stats.py
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Tuple, NamedTuple, Mapping
+from config import CULTIVATION_LEVELS, SECTS
+
+# Kỹ năng cơ bản
+BASIC_SKILLS = ("Quyền Cước", "Kiếm Pháp Cơ Bản", "Chưởng Pháp")
+
+# Các cảnh giới cao hơn Kim Đan
+HIGH_LEVELS = ("Hóa Thần", "Luyện Hư", "Đại Thừa", "Diễn Chủ")
+
+
+def skills_for_level(level: str) -> Tuple[str, ...]:
+    """Danh sách kỹ năng dựa trên cảnh giới"""
+    if "Luyện Khí" in level:
+        return BASIC_SKILLS + ("Linh Khí Quyền", "Ngưng Khí Thuật")
+    if "Trúc Cơ" in level:
+        return BASIC_SKILLS + ("Linh Khí Quyền", "Ngưng Khí Thuật", "Trúc Cơ Kiếm Pháp", "Linh Khí Phá")
+    if "Nguyên Anh" in level:
+        return BASIC_SKILLS + ("Trúc Cơ Kiếm Pháp", "Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất")
+    if "Kim Đan" in level or any(high in level for high in HIGH_LEVELS):
+        return ("Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất", "Kiếm Khí Trảm", "Đại Đạo Vô Hình",
+                "Tiên Thiên Công")
+    return BASIC_SKILLS
+
+
+def apply_sect_bonus(attack: int, defense: int, sect: Optional[str],
+                     sects: Mapping[str, Dict[str, Any]] = SECTS) -> Tuple[int, int]:
+    """Áp dụng bonus công/thủ của môn phái"""
+    if sect and sect in sects:
+        attack = int(attack * sects[sect].get('attack_bonus', 1.0))
+        defense = int(defense * sects[sect].get('defense_bonus', 1.0))
+    return attack, defense
+
+
+class CombatProfile(NamedTuple):
+    """Chỉ số chiến đấu của một cặp (cảnh giới, môn phái)"""
+    level: str
+    sect: Optional[str]
+    hp: int
+    base_attack: int
+    base_defense: int
+    attack: int  # Đã áp dụng bonus môn phái
+    defense: int
+    skills: Tuple[str, ...]
+
+
+class CombatStatTable:
+    """Bảng chỉ số chiến đấu tính sẵn theo (chỉ số cảnh giới, môn phái)
+
+    Chỉ số hoàn toàn được quyết định bởi CULTIVATION_LEVELS và bonus trong SECTS,
+    nên bảng được dựng một lần khi khởi động và chỉ dựng lại khi tải lại config.
+    """
+
+    def __init__(self, levels: Dict[str, Dict[str, Any]] = CULTIVATION_LEVELS,
+                 sects: Dict[str, Dict[str, Any]] = SECTS):
+        self.rebuild(levels, sects)
+
+    def rebuild(self, levels: Dict[str, Dict[str, Any]], sects: Dict[str, Dict[str, Any]]):
+        """Dựng lại toàn bộ bảng từ cấu hình"""
+        ordered = sorted(levels.items(), key=lambda item: item[1].get("exp_req", 0))
+        sect_names = [None] + list(sects)
+
+        entries = {}
+        for index, (level, stats) in enumerate(ordered):
+            hp = stats.get('hp', 100)
+            attack = stats.get('attack', 10)
+            defense = stats.get('defense', 5)
+            skills = skills_for_level(level)
+            for sect in sect_names:
+                effective_attack, effective_defense = apply_sect_bonus(attack, defense, sect, sects)
+                entries[(index, sect)] = CombatProfile(
+                    level, sect, hp, attack, defense, effective_attack, effective_defense, skills)
+
+        self._sects = MappingProxyType(dict(sects))
+        self._index = MappingProxyType({level: index for index, (level, _) in enumerate(ordered)})
+        self._entries = MappingProxyType(entries)
+        self._skills = MappingProxyType({level: skills_for_level(level) for level in self._index})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, level: str, sect: Optional[str] = None) -> Optional[CombatProfile]:
+        """Chỉ số của một cảnh giới và môn phái, None nếu cảnh giới không có trong bảng"""
+        index = self._index.get(level)
+        if index is None:
+            return None
+        return self._entries.get((index, sect if sect in self._sects else None))
+
+    def skills(self, level: str) -> Tuple[str, ...]:
+        """Kỹ năng của cảnh giới"""
+        skills = self._skills.get(level)
+        return skills if skills is not None else skills_for_level(level)
+
+    def effective_stats(self, player: Dict[str, Any]) -> Tuple[int, int]:
+        """Công kích và phòng thủ sau bonus môn phái của một người chơi
+
+        Tra bảng khi chỉ số gốc của người chơi khớp với cảnh giới, nếu không
+        (dữ liệu cũ, chỉ số được chỉnh tay) thì tính trực tiếp.
+        """
+        attack = player.get('attack', 10)
+        defense = player.get('defense', 5)
+        profile = self.lookup(player.get('level', 'Phàm Nhân'), player.get('sect'))
+        if profile and profile.base_attack == attack and profile.base_defense == defense:
+            return profile.attack, profile.defense
+        return apply_sect_bonus(attack, defense, player.get('sect'), self._sects)
+
+
+# Bảng dùng chung cho toàn bộ bot
+combat_stats = CombatStatTable()
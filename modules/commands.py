@@ -6,6 +6,8 @@ import random
 import asyncio
 from typing import Dict, Any, List, Optional
 from modules.shared_commands import handle_daily_command
+from modules.levels import level_table
+from modules.edit_coalescer import submit_edit
 from config import SECTS, SECT_EMOJIS, SECT_COLORS
 
 
@@ -43,11 +45,10 @@ class Commands(commands.Cog):
             active_players = 0
             total_exp = 0
 
-            # Lấy danh sách người chơi từ database
-            all_players = await self.db.get_all_players()
-            for player in all_players:
-                if player.get('sect'):
-                    sect_name = player.get('sect')
+            # Duyệt người chơi từ database (chỉ lấy môn phái và exp)
+            async for player in self.db.iter_players({"sect": {"$ne": None}}, projection=["sect", "exp"]):
+                sect_name = player.get('sect')
+                if sect_name:
                     sect_counts[sect_name] = sect_counts.get(sect_name, 0) + 1
                     total_exp += player.get('exp', 0)
                     active_players += 1
@@ -169,27 +170,28 @@ class Commands(commands.Cog):
 
     async def create_sect_leaderboard(self, limit: int) -> discord.Embed:
         """Tạo bảng xếp hạng môn phái"""
-        all_players = await self.db.get_all_players()
-        sect_stats = {}
-
-        # Tính tổng exp và số lượng thành viên theo môn phái
-        for player in all_players:
-            sect = player.get('sect')
-            if sect:
-                if sect not in sect_stats:
-                    sect_stats[sect] = {
-                        "exp": 0,
-                        "members": 0,
-                        "avg_exp": 0
-                    }
-
-                sect_stats[sect]["exp"] += player.get('exp', 0)
-                sect_stats[sect]["members"] += 1
-
-        # Tính trung bình exp
-        for sect in sect_stats:
-            if sect_stats[sect]["members"] > 0:
-                sect_stats[sect]["avg_exp"] = sect_stats[sect]["exp"] // sect_stats[sect]["members"]
+        leaderboard = self.db.leaderboard
+        if leaderboard.ready:
+            # Tổng exp và số thành viên đã được duy trì sẵn trong bộ nhớ
+            sect_stats = {
+                sect: {
+                    "exp": totals["exp"],
+                    "members": totals["members"],
+                    "avg_exp": totals["exp"] // totals["members"] if totals["members"] else 0
+                }
+                for sect, totals in leaderboard.top_sects(limit)
+            }
+        else:
+            # Bảng xếp hạng chưa nạp xong: tính bằng aggregation
+            aggregated = await self.db.get_sect_stats()
+            sect_stats = {
+                sect: {
+                    "exp": stats["total_exp"],
+                    "members": stats["members"],
+                    "avg_exp": stats["avg_exp"]
+                }
+                for sect, stats in aggregated.items()
+            }
 
         # Sắp xếp các môn phái theo tổng exp
         sorted_sects = sorted(sect_stats.items(), key=lambda x: x[1]["exp"], reverse=True)
@@ -224,11 +226,23 @@ class Commands(commands.Cog):
 
     async def create_pvp_leaderboard(self, ctx, limit: int) -> discord.Embed:
         """Tạo bảng xếp hạng dựa trên thành tích PvP"""
-        all_players = await self.db.get_all_players()
+        leaderboard = self.db.leaderboard
+        if leaderboard.ready:
+            # Top PvP đã được sắp xếp sẵn trong bộ nhớ
+            source = leaderboard.top_pvp(limit)
+        else:
+            # Lọc người chơi có thông tin PvP ngay trên database
+            pvp_query = {"$or": [
+                {"stats.pvp_wins": {"$gt": 0}},
+                {"stats.pvp_losses": {"$gt": 0}}
+            ]}
+            source = [
+                player async for player in self.db.iter_players(
+                    pvp_query, projection=["user_id", "level", "sect", "stats.pvp_wins", "stats.pvp_losses"])
+            ]
 
-        # Lọc người chơi có thông tin PvP
         pvp_players = []
-        for player in all_players:
+        for player in source:
             stats = player.get('stats', {})
             wins = stats.get('pvp_wins', 0)
             losses = stats.get('pvp_losses', 0)
@@ -331,14 +345,11 @@ class Commands(commands.Cog):
             # Hiển thị thông báo đang tải
             loading_msg = await ctx.send("⏳ Đang tải thống kê...")
 
-            # Lấy tất cả người chơi
-            all_players = await self.db.get_all_players()
-
             # Khởi tạo biến thống kê
             level_stats = {}
             sect_stats = {}
             total_exp = 0
-            active_players = len(all_players)
+            active_players = 0
             highest_level = {"player": None, "level": "Phàm Nhân"}
             highest_exp = {"player": None, "exp": 0}
 
@@ -347,8 +358,11 @@ class Commands(commands.Cog):
             total_monsters_killed = 0
             total_bosses_killed = 0
 
-            # Phân tích dữ liệu
-            for player in all_players:
+            # Phân tích dữ liệu (duyệt theo luồng, chỉ lấy các trường cần thiết)
+            player_fields = ["user_id", "level", "sect", "exp", "stats"]
+            async for player in self.db.iter_players(projection=player_fields):
+                active_players += 1
+
                 # Thống kê cảnh giới
                 level = player.get('level', 'Phàm Nhân')
                 level_stats[level] = level_stats.get(level, 0) + 1
@@ -485,26 +499,12 @@ class Commands(commands.Cog):
 
     def get_level_index(self, level):
         """Lấy thứ tự của cảnh giới để sắp xếp"""
-        try:
-            cultivation_cog = self.bot.get_cog('Cultivation')
-            if cultivation_cog and hasattr(cultivation_cog, 'CULTIVATION_RANKS'):
-                return cultivation_cog.CULTIVATION_RANKS.index(level)
-
-            # Dự phòng: thử lấy từ config nếu không có cog
-            if hasattr(self.bot, 'config') and hasattr(self.bot.config, 'CULTIVATION_LEVELS'):
-                levels = list(self.bot.config.CULTIVATION_LEVELS.keys())
-                return levels.index(level) if level in levels else -1
-
-            return -1
-        except (ValueError, AttributeError, IndexError):
-            return -1
+        return level_table.index(level, -1)
 
     def compare_levels(self, level1, level2):
         """So sánh hai cảnh giới
         Returns: 1 nếu level1 > level2, -1 nếu level1 < level2, 0 nếu bằng nhau"""
-        idx1 = self.get_level_index(level1)
-        idx2 = self.get_level_index(level2)
-        return (idx1 > idx2) - (idx1 < idx2)
+        return level_table.compare(level1, level2)
 
     @commands.command(name="roll", aliases=["random", "r", "xúc xắc", "xucxac"], usage="[số_lớn_nhất]")
     async def roll(self, ctx, max_num: int = 100):
@@ -517,10 +517,13 @@ class Commands(commands.Cog):
             # Tạo hiệu ứng xúc xắc
             message = await ctx.send("🎲 Đang tung xúc xắc...")
 
-            # Hiệu ứng ngẫu nhiên
+            # Hiệu ứng ngẫu nhiên (các khung chưa kịp gửi sẽ bị gộp)
+            frame = None
             for i in range(3):
                 await asyncio.sleep(0.7)
-                await message.edit(content=f"🎲 Đang tung xúc xắc... {random.randint(1, max_num)}")
+                frame = submit_edit(self.bot, message,
+                                    content=f"🎲 Đang tung xúc xắc... {random.randint(1, max_num)}")
+            await frame
 
             # Hiển thị kết quả
             embed = discord.Embed(
@@ -698,10 +701,7 @@ class Commands(commands.Cog):
             now = datetime.now()
             last_daily = player.get('last_daily')
             if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    last_daily = datetime.min
+                last_daily = datetime.min
 
             # Tính thời gian trôi qua từ lần điểm danh trước
             time_since_last = now - last_daily if last_daily else timedelta(days=2)
@@ -728,13 +728,13 @@ class Commands(commands.Cog):
                 special_reward_text = f"🎁 **Phần thưởng đặc biệt 7 ngày**: +{bonus_exp} EXP"
 
             # Cập nhật người chơi
-            new_exp = player.get('exp', 0) + reward
-            await self.db.update_player(
+            updated = await self.db.increment_exp(
                 user_id,
-                exp=new_exp,
+                reward,
                 last_daily=now,
                 daily_streak=new_streak
             )
+            new_exp = updated['exp'] if updated else player.get('exp', 0) + reward
 
             # Tạo embed thông báo
             embed = discord.Embed(
@@ -1017,10 +1017,7 @@ class Commands(commands.Cog):
             joined_at = player.get('created_at')
             if joined_at:
                 if isinstance(joined_at, str):
-                    try:
-                        joined_at = datetime.strptime(joined_at, '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        joined_at = None
+                    joined_at = None
 
                 if joined_at:
                     time_diff = datetime.now() - joined_at
@@ -1080,10 +1077,7 @@ class Commands(commands.Cog):
             daily_streak = player.get('daily_streak', 0)
             last_daily = player.get('last_daily')
             if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    last_daily = datetime.min
+                last_daily = datetime.min
 
             embed.add_field(
                 name="🔥 Điểm Danh",
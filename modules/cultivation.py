@@ -6,8 +6,12 @@ import asyncio
 from typing import Dict, Any, List, Tuple, Optional, Union
 from config import (
     CULTIVATION_LEVELS, CHAT_EXP, VOICE_EXP,
-    SECTS, SECT_EMOJIS, SECT_COLORS
+    SECT_EMOJIS, SECT_COLORS
 )
+from database.locks import LockRegistry
+from modules.voice_tracker import VoiceTracker
+from modules.levels import level_table
+from modules.combat_stats import combat_stats
 
 
 class Cultivation(commands.Cog):
@@ -16,28 +20,30 @@ class Cultivation(commands.Cog):
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.voice_states = {}  # Để lưu trạng thái voice chat
-        self.exp_lock = asyncio.Lock()  # Lock để tránh race condition khi update exp
-        self.breakthrough_locks = {}  # Lock cho từng người chơi khi thăng cấp
-
-        # Cache để tránh truy vấn database quá nhiều
-        self.player_cache = {}
-        self.cache_timeout = 60  # seconds
-
-    # Danh sách các cảnh giới
-    CULTIVATION_RANKS = [
-        "Phàm Nhân",
-        "Luyện Khí Tầng 1", "Luyện Khí Tầng 2", "Luyện Khí Tầng 3",
-        "Luyện Khí Tầng 4", "Luyện Khí Tầng 5", "Luyện Khí Tầng 6",
-        "Luyện Khí Tầng 7", "Luyện Khí Tầng 8", "Luyện Khí Tầng 9",
-        "Trúc Cơ Sơ Kỳ", "Trúc Cơ Trung Kỳ", "Trúc Cơ Đại Viên Mãn",
-        "Nguyên Anh Sơ Kỳ", "Nguyên Anh Trung Kỳ", "Nguyên Anh Đại Viên Mãn",
-        "Kim Đan Sơ Kỳ", "Kim Đan Trung Kỳ", "Kim Đan Đại Viên Mãn",
-        "Hóa Thần Sơ Kỳ", "Hóa Thần Trung Kỳ", "Hóa Thần Đại Viên Mãn",
-        "Luyện Hư Sơ Kỳ", "Luyện Hư Trung Kỳ", "Luyện Hư Đại Viên Mãn",
-        "Đại Thừa Sơ Kỳ", "Đại Thừa Trung Kỳ", "Đại Thừa Đại Viên Mãn",
-        "Diễn Chủ Vạn Giới"
-    ]
+        self.voice_tracker = VoiceTracker(bot, db)  # Theo dõi phiên voice theo sự kiện
+        self.voice_tracker.on_flush = self.handle_flushed_exp
+        self.breakthrough_locks = LockRegistry("breakthrough")  # Lock cho từng người chơi khi thăng cấp
+
+    @property
+    def exp_buffer(self):
+        """Bộ đệm exp hiện tại của bot (on_ready tạo lại bộ đệm mỗi lần kết nối lại)"""
+        return getattr(self.bot, 'exp_buffer', None)
+
+    async def cog_load(self):
+        """Khởi động tick exp voice khi load module"""
+        self.voice_tracker.start()
+
+    async def cog_unload(self):
+        """Cộng nốt exp voice, dừng tick và gỡ callback khỏi bộ đệm exp khi unload module"""
+        await self.voice_tracker.close()
+        exp_buffer = self.exp_buffer
+        if exp_buffer and exp_buffer.on_flush == self.handle_flushed_exp:
+            exp_buffer.on_flush = None
+
+    @property
+    def CULTIVATION_RANKS(self):
+        """Danh sách các cảnh giới (đọc từ bảng cảnh giới dùng chung, cập nhật theo !reload config)"""
+        return level_table.names
 
     # Thông báo đột phá cho từng cảnh giới
     BREAKTHROUGH_MESSAGES = {
@@ -104,44 +110,6 @@ class Cultivation(commands.Cog):
         """Khởi tạo khi bot khởi động"""
         print("✓ Module Cultivation đã sẵn sàng!")
 
-        # Khởi tạo nhiệm vụ kiểm tra voice chat định kỳ
-        self.bot.loop.create_task(self.voice_exp_task())
-
-    async def voice_exp_task(self):
-        """Nhiệm vụ định kỳ cấp exp cho voice chat"""
-        await self.bot.wait_until_ready()
-
-        while not self.bot.is_closed():
-            try:
-                # Kiểm tra và cấp exp cho người trong voice
-                current_time = datetime.now()
-                for guild in self.bot.guilds:
-                    for voice_channel in guild.voice_channels:
-                        for member in voice_channel.members:
-                            if not member.bot and not member.voice.afk and not member.voice.self_deaf:
-                                # Kiểm tra xem đã có trong voice_states chưa
-                                if member.id not in self.voice_states:
-                                    self.voice_states[member.id] = current_time
-                                    continue
-
-                                # Tính thời gian và cấp exp
-                                last_time = self.voice_states[member.id]
-                                time_diff = (current_time - last_time).total_seconds() / 60
-
-                                if time_diff >= 1:  # Mỗi phút cấp exp một lần
-                                    exp_gained = int(time_diff * VOICE_EXP)
-                                    self.voice_states[member.id] = current_time
-
-                                    if exp_gained > 0:
-                                        # Cập nhật exp
-                                        await self.update_exp(member.id, exp_gained, source="voice")
-
-            except Exception as e:
-                print(f"Lỗi trong voice_exp_task: {e}")
-
-            # Chờ 1 phút trước khi kiểm tra lại
-            await asyncio.sleep(60)
-
     @commands.command(name="tuvi", aliases=["tu", "info", "profile"], usage="[@người_chơi]")
     async def tuvi(self, ctx, member: discord.Member = None):
         """Xem thông tin tu vi của bản thân hoặc người khác"""
@@ -214,10 +182,7 @@ class Cultivation(commands.Cog):
         joined_at = player.get('created_at')
         if joined_at:
             if isinstance(joined_at, str):
-                try:
-                    joined_at = datetime.strptime(joined_at, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    joined_at = None
+                joined_at = None
 
             if joined_at:
                 time_diff = datetime.now() - joined_at
@@ -314,21 +279,8 @@ class Cultivation(commands.Cog):
         return embed
 
     def calculate_combat_stats(self, player: Dict[str, Any]) -> Tuple[int, int]:
-        """Tính toán sức công kích và phòng thủ có áp dụng bonus từ môn phái"""
-        # Lấy chỉ số cơ bản
-        attack = player.get('attack', 10)
-        defense = player.get('defense', 5)
-
-        # Lấy tông môn và áp dụng bonus
-        sect = player.get('sect')
-        if sect and sect in SECTS:
-            attack_bonus = SECTS[sect].get('attack_bonus', 1.0)
-            defense_bonus = SECTS[sect].get('defense_bonus', 1.0)
-
-            attack = int(attack * attack_bonus)
-            defense = int(defense * defense_bonus)
-
-        return attack, defense
+        """Tính toán sức công kích và phòng thủ có áp dụng bonus từ môn phái (tra bảng tính sẵn)"""
+        return combat_stats.effective_stats(player)
 
     def create_progress_bar(self, percent, length=20):
         """Tạo thanh tiến trình trực quan"""
@@ -342,66 +294,58 @@ class Cultivation(commands.Cog):
         Lấy thông tin về cấp độ tiếp theo
         Returns: tuple (next_level, exp_needed) hoặc None nếu đã max level
         """
-        try:
-            current_index = self.CULTIVATION_RANKS.index(current_level)
-            if current_index < len(self.CULTIVATION_RANKS) - 1:
-                next_level = self.CULTIVATION_RANKS[current_index + 1]
-                exp_needed = CULTIVATION_LEVELS[next_level]["exp_req"]
-                return (next_level, exp_needed)
-            return None
-        except (ValueError, KeyError, IndexError) as e:
-            print(f"Lỗi khi lấy thông tin cấp độ tiếp theo: {e}")
-            return None
+        return level_table.next_level(current_level)
 
     async def get_player(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Lấy thông tin người chơi (với cache)"""
-        # Kiểm tra cache
-        if user_id in self.player_cache:
-            player, timestamp = self.player_cache[user_id]
-            if (datetime.now() - timestamp).seconds < self.cache_timeout:
-                return player
-
-        # Lấy từ database
-        player = await self.db.get_player(user_id)
-        if player:
-            self.player_cache[user_id] = (player, datetime.now())
-        return player
+        """Lấy thông tin người chơi (cache dùng chung nằm trong database handler)"""
+        return await self.db.get_player(user_id)
 
     async def update_exp(self, user_id: int, exp_gained: int, source: str = "unknown") -> Tuple[
         Optional[int], Optional[str]]:
-        """Cập nhật exp và kiểm tra thăng cấp an toàn với lock"""
+        """Cập nhật exp bằng $inc nguyên tử (không cần lock toàn cục)"""
         if exp_gained <= 0:
             return None, None
 
-        async with self.exp_lock:
-            try:
-                player = await self.get_player(user_id)
-                if player:
-                    # Cập nhật exp
-                    new_exp = player.get('exp', 0) + exp_gained
-
-                    # Cập nhật tổng exp đã nhận
-                    stats = player.get('stats', {})
-                    total_exp = stats.get('total_exp_gained', 0) + exp_gained
-
-                    # Cập nhật vào database
-                    update_data = {
-                        'exp': new_exp,
-                        'stats__total_exp_gained': total_exp
-                    }
-
-                    await self.db.update_player(user_id, **update_data)
-
-                    # Xóa cache
-                    if user_id in self.player_cache:
-                        del self.player_cache[user_id]
-
-                    # Trả về exp mới và level hiện tại
-                    return new_exp, player.get('level', 'Phàm Nhân')
-                return None, None
-            except Exception as e:
-                print(f"Lỗi khi cập nhật exp: {e}")
-                return None, None
+        try:
+            # Cộng exp và tổng exp đã nhận trong một lần ghi, nhận lại dữ liệu sau cập nhật
+            player = await self.db.increment_exp(user_id, exp_gained, stats={'total_exp_gained': exp_gained})
+
+            if player:
+                # Trả về exp mới và level hiện tại
+                return player.get('exp', 0), player.get('level', 'Phàm Nhân')
+            return None, None
+        except Exception as e:
+            print(f"Lỗi khi cập nhật exp: {e}")
+            return None, None
+
+    async def grant_exp(self, member: discord.Member, exp_gained: int, source: str = "unknown"):
+        """Cộng exp chat/voice qua bộ đệm ghi sau (hoặc ghi trực tiếp nếu không có bộ đệm)"""
+        if exp_gained <= 0:
+            return
+
+        # Exp chat/voice được gom vào bộ đệm ghi sau, thăng cấp kiểm tra khi flush
+        exp_buffer = self.exp_buffer
+        if exp_buffer:
+            if exp_buffer.on_flush != self.handle_flushed_exp:
+                exp_buffer.on_flush = self.handle_flushed_exp
+            exp_buffer.add(member.id, exp_gained, member=member)
+            return
+
+        new_exp, current_level = await self.update_exp(member.id, exp_gained, source=source)
+        if new_exp is not None and current_level is not None:
+            await self.check_level_up(member, current_level, new_exp)
+
+    async def handle_flushed_exp(self, players: List[Dict[str, Any]], members: Dict[int, Any]):
+        """Kiểm tra thăng cấp dựa trên tổng exp vừa được ghi xuống database"""
+        tasks = []
+        for player in players:
+            user_id = player.get('user_id')
+            member = members.get(user_id)
+            if isinstance(member, discord.Member):
+                tasks.append(self.check_level_up(member, player.get('level', 'Phàm Nhân'), player.get('exp', 0)))
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def create_breakthrough_embed(self, user: discord.Member, old_level: str, new_level: str,
                                         new_stats: Dict[str, Any]) -> discord.Embed:
@@ -471,33 +415,15 @@ class Cultivation(commands.Cog):
         else:
             user = ctx.author
 
-        # Lấy hoặc tạo lock cho người chơi
-        if user.id not in self.breakthrough_locks:
-            self.breakthrough_locks[user.id] = asyncio.Lock()
-
-        async with self.breakthrough_locks[user.id]:
+        # Giữ lock của người chơi
+        async with self.breakthrough_locks.hold(user.id):
             try:
-                current_index = self.CULTIVATION_RANKS.index(current_level)
-
-                # Kiểm tra các cấp độ tiếp theo
-                level_ups = []
-                final_level = current_level
-
-                for next_index in range(current_index + 1, len(self.CULTIVATION_RANKS)):
-                    next_level = self.CULTIVATION_RANKS[next_index]
-                    exp_required = CULTIVATION_LEVELS[next_level]["exp_req"]
-
-                    # Nếu đủ exp để lên cấp
-                    if new_exp >= exp_required:
-                        level_ups.append((next_level, CULTIVATION_LEVELS[next_level]))
-                        final_level = next_level
-                    else:
-                        break
+                # Tra cảnh giới ứng với exp mới bằng bisect trên ngưỡng exp
+                resolved = level_table.resolve(current_level, new_exp)
 
                 # Nếu có thăng cấp
-                if level_ups:
-                    # Lấy thông số cuối cùng
-                    final_stats = level_ups[-1][1]
+                if resolved:
+                    final_level, final_stats = resolved
 
                     # Cập nhật người chơi
                     await self.db.update_player(
@@ -508,10 +434,6 @@ class Cultivation(commands.Cog):
                         defense=final_stats.get("defense", 5)
                     )
 
-                    # Xóa cache
-                    if user.id in self.player_cache:
-                        del self.player_cache[user.id]
-
                     # Tạo và gửi thông báo đột phá
                     embed = await self.create_breakthrough_embed(
                         user,
@@ -564,11 +486,11 @@ class Cultivation(commands.Cog):
             if not player:
                 return
 
-            # Cập nhật exp với xác suất thông báo thấp (10%)
-            new_exp, current_level = await self.update_exp(message.author.id, CHAT_EXP, source="chat")
+            # Cộng exp vào bộ đệm (thăng cấp được kiểm tra khi flush)
+            await self.grant_exp(message.author, CHAT_EXP, source="chat")
 
             # Thông báo ngẫu nhiên với xác suất 10% để không spam
-            if new_exp is not None and random.random() < 0.1:
+            if random.random() < 0.1:
                 # Gửi thông báo riêng tư về việc nhận exp
                 try:
                     msg = random.choice(self.CHAT_EXP_MESSAGES)
@@ -577,28 +499,26 @@ class Cultivation(commands.Cog):
                     # Không thể gửi DM, bỏ qua
                     pass
 
-            # Kiểm tra thăng cấp
-            if new_exp is not None and current_level is not None:
-                await self.check_level_up(message, current_level, new_exp)
-
         except Exception as e:
             print(f"Lỗi khi xử lý exp chat: {e}")
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        """Xử lý nhận exp khi voice chat"""
+        """Mở/đóng phiên tu luyện voice khi người chơi đổi trạng thái"""
         if member.bot:
             return
 
         try:
-            # Kiểm tra người chơi có trong hệ thống không
-            player = await self.get_player(member.id)
-            if not player:
-                return
+            was_eligible = member.id in self.voice_tracker.sessions
+            is_eligible = self.voice_tracker.is_eligible(member, after)
+
+            # Bắt đầu tu luyện (vào voice, rời AFK hoặc bật lại loa)
+            if is_eligible and not was_eligible:
+                # Kiểm tra người chơi có trong hệ thống không
+                player = await self.get_player(member.id)
+                if not player or not self.voice_tracker.begin(member):
+                    return
 
-            # Vào voice chat
-            if before.channel is None and after.channel is not None and not after.afk and not after.self_deaf:
-                self.voice_states[member.id] = datetime.now()
                 # Gửi thông báo bắt đầu tu luyện
                 try:
                     await member.send(
@@ -607,33 +527,33 @@ class Cultivation(commands.Cog):
                     # Không thể gửi DM, bỏ qua
                     pass
 
-            # Rời voice chat
-            elif before.channel is not None and (after.channel is None or after.afk or after.self_deaf):
-                join_time = self.voice_states.pop(member.id, None)
-                if join_time:
-                    # Tính thời gian và exp
-                    time_in_voice = (datetime.now() - join_time).total_seconds() / 60
-                    exp_gained = int(time_in_voice * VOICE_EXP)
-                    if exp_gained > 0:
-                        # Cập nhật exp
-                        new_exp, current_level = await self.update_exp(member.id, exp_gained, source="voice")
-                        # Gửi thông báo kết thúc tu luyện
-                        try:
-                            minutes = int(time_in_voice)
-                            seconds = int((time_in_voice - minutes) * 60)
-                            time_str = f"{minutes} phút" if seconds == 0 else f"{minutes} phút {seconds} giây"
-                            msg = random.choice(self.VOICE_EXP_MESSAGES)
-                            await member.send(
-                                f"🎙️ **Voice Tu Luyện**: Kết thúc sau {time_str}.\n"
-                                f"Nhận được: +{exp_gained} EXP! {msg}"
-                            )
-                        except discord.Forbidden:
-                            # Không thể gửi DM, bỏ qua
-                            pass
-
-                        # Kiểm tra thăng cấp
-                        if new_exp is not None and current_level is not None:
-                            await self.check_level_up(member, current_level, new_exp)
+            # Kết thúc tu luyện (rời voice, vào AFK hoặc tắt loa)
+            elif was_eligible and not is_eligible:
+                session = self.voice_tracker.end(member.id)
+                if not session:
+                    return
+
+                # Cộng phần exp chưa được tick vào bộ đệm (thăng cấp được kiểm tra khi flush)
+                if session["exp"] > 0:
+                    await self.grant_exp(member, session["exp"], source="voice")
+
+                if session["total_exp"] > 0:
+                    # Gửi thông báo kết thúc tu luyện
+                    try:
+                        minutes, seconds = divmod(int(session["duration"]), 60)
+                        time_str = f"{minutes} phút" if seconds == 0 else f"{minutes} phút {seconds} giây"
+                        msg = random.choice(self.VOICE_EXP_MESSAGES)
+                        await member.send(
+                            f"🎙️ **Voice Tu Luyện**: Kết thúc sau {time_str}.\n"
+                            f"Nhận được: +{session['total_exp']} EXP! {msg}"
+                        )
+                    except discord.Forbidden:
+                        # Không thể gửi DM, bỏ qua
+                        pass
+
+            # Đổi kênh nhưng vẫn đủ điều kiện: giữ nguyên phiên, cập nhật member
+            elif is_eligible:
+                self.voice_tracker.begin(member)
 
         except Exception as e:
             print(f"Lỗi khi xử lý exp voice: {e}")
@@ -845,7 +765,7 @@ class Cultivation(commands.Cog):
             # Lấy thông tin cảnh giới hiện tại
             current_level = player.get('level', 'Phàm Nhân')
             current_exp = player.get('exp', 0)
-            current_index = self.CULTIVATION_RANKS.index(current_level)
+            current_index = level_table.index(current_level)
 
             # Tạo embed thông tin cảnh giới
             sect = player.get('sect', 'Không có môn phái')
@@ -920,24 +840,37 @@ class Cultivation(commands.Cog):
                 )
 
             # Thêm thông tin ranking
-            all_players = await self.db.get_all_players()
-            if all_players:
-                sorted_players = sorted(all_players, key=lambda x: x.get('exp', 0), reverse=True)
-                player_rank = next((i + 1 for i, p in enumerate(sorted_players) if p.get('user_id') == target.id), None)
-
-                if player_rank:
-                    rank_emoji = "🥇" if player_rank == 1 else "🥈" if player_rank == 2 else "🥉" if player_rank == 3 else f"#{player_rank}"
-                    same_level_count = sum(1 for p in all_players if p.get('level', 'Phàm Nhân') == current_level)
+            leaderboard = self.db.leaderboard
+            if leaderboard.ready:
+                # Tra thứ hạng trên bảng xếp hạng trong bộ nhớ (bisect)
+                total_players = len(leaderboard)
+                player_rank = leaderboard.exp_rank_of(current_exp)
+                same_level_count = leaderboard.level_count(current_level)
+            else:
+                # Bảng xếp hạng chưa nạp xong: duyệt một lượt, chỉ lấy exp và cảnh giới
+                total_players = 0
+                higher_count = 0
+                same_level_count = 0
+                async for p in self.db.iter_players(projection=["exp", "level"]):
+                    total_players += 1
+                    if p.get('exp', 0) > current_exp:
+                        higher_count += 1
+                    if p.get('level', 'Phàm Nhân') == current_level:
+                        same_level_count += 1
+                player_rank = higher_count + 1
+
+            if total_players:
+                rank_emoji = "🥇" if player_rank == 1 else "🥈" if player_rank == 2 else "🥉" if player_rank == 3 else f"#{player_rank}"
 
-                    embed.add_field(
-                        name="🏆 Xếp Hạng",
-                        value=(
-                            f"Xếp hạng toàn server: {rank_emoji}\n"
-                            f"Người cùng cảnh giới: {same_level_count} tu sĩ\n"
-                            f"Tổng số tu sĩ: {len(all_players)}"
-                        ),
-                        inline=False
-                    )
+                embed.add_field(
+                    name="🏆 Xếp Hạng",
+                    value=(
+                        f"Xếp hạng toàn server: {rank_emoji}\n"
+                        f"Người cùng cảnh giới: {same_level_count} tu sĩ\n"
+                        f"Tổng số tu sĩ: {total_players}"
+                    ),
+                    inline=False
+                )
 
             # Thêm avatar người chơi
             if target.avatar:
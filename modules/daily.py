@@ -8,6 +8,7 @@ from typing import Dict, Any, List, Tuple, Optional
 from modules.shared_commands import handle_daily_command
 import calendar
 from config import SECT_EMOJIS, SECT_COLORS
+from database.locks import LockRegistry
 
 
 class Daily(commands.Cog):
@@ -16,9 +17,7 @@ class Daily(commands.Cog):
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.reward_lock = asyncio.Lock()  # Lock để tránh race condition
-        self.player_cache = {}  # Cache để giảm số lần truy vấn database
-        self.cache_timeout = 60  # seconds
+        self.reward_locks = LockRegistry("daily")  # Lock theo người chơi để tránh race condition
 
     @commands.command(name="daily", aliases=["diemdanh"], usage="")
     @commands.cooldown(1, 5, commands.BucketType.user)
@@ -71,18 +70,8 @@ class Daily(commands.Cog):
         print("✓ Module Daily đã sẵn sàng!")
 
     async def get_player(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Lấy thông tin người chơi (với cache)"""
-        # Kiểm tra cache
-        if user_id in self.player_cache:
-            player, timestamp = self.player_cache[user_id]
-            if (datetime.now() - timestamp).seconds < self.cache_timeout:
-                return player
-
-        # Lấy từ database
-        player = await self.db.get_player(user_id)
-        if player:
-            self.player_cache[user_id] = (player, datetime.now())
-        return player
+        """Lấy thông tin người chơi (cache dùng chung nằm trong database handler)"""
+        return await self.db.get_player(user_id)
 
     async def format_next_daily_time(self, last_daily: datetime) -> str:
         """Format thời gian điểm danh tiếp theo"""
@@ -111,7 +100,7 @@ class Daily(commands.Cog):
         # Hiển thị thông báo đang xử lý
         loading_msg = await ctx.send("⏳ Đang xử lý điểm danh...")
 
-        async with self.reward_lock:
+        async with self.reward_locks.hold(ctx.author.id):
             try:
                 # Kiểm tra người chơi
                 player = await self.get_player(ctx.author.id)
@@ -127,12 +116,9 @@ class Daily(commands.Cog):
                 last_daily = player.get('last_daily')
                 streak = player.get('daily_streak', 0)
 
-                # Chuyển đổi từ string sang datetime nếu cần
+                # Dữ liệu đã là datetime; chuỗi còn sót lại là dữ liệu cũ không hợp lệ
                 if isinstance(last_daily, str):
-                    try:
-                        last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                    except (ValueError, TypeError):
-                        last_daily = datetime.min
+                    last_daily = datetime.min
 
                 # Nếu chưa đến giờ điểm danh
                 if last_daily and current_time - last_daily < timedelta(days=1):
@@ -271,17 +257,13 @@ class Daily(commands.Cog):
                         break
 
                 # Cập nhật exp và thông tin điểm danh
-                new_exp = player.get('exp', 0) + total_exp
-                await self.db.update_player(
+                updated = await self.db.increment_exp(
                     ctx.author.id,
-                    exp=new_exp,
+                    total_exp,
                     last_daily=current_time,
                     daily_streak=streak
                 )
-
-                # Xóa cache
-                if ctx.author.id in self.player_cache:
-                    del self.player_cache[ctx.author.id]
+                new_exp = updated['exp'] if updated else player.get('exp', 0) + total_exp
 
                 # Thông tin tu vi
                 embed.add_field(
@@ -419,12 +401,9 @@ class Daily(commands.Cog):
             streak = player.get('daily_streak', 0)
             last_daily = player.get('last_daily')
 
-            # Chuyển đổi từ string sang datetime nếu cần
+            # Dữ liệu đã là datetime; chuỗi còn sót lại là dữ liệu cũ không hợp lệ
             if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                except (ValueError, TypeError):
-                    last_daily = datetime.min
+                last_daily = datetime.min
 
             # Kiểm tra xem streak có còn hiệu lực không
             current_time = datetime.now()
@@ -659,10 +638,7 @@ class Daily(commands.Cog):
                 # Kiểm tra thời gian điểm danh tiếp theo
                 last_daily = player.get('last_daily')
                 if isinstance(last_daily, str):
-                    try:
-                        last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                    except (ValueError, TypeError):
-                        last_daily = datetime.min
+                    last_daily = datetime.min
 
                 if last_daily:
                     if now - last_daily < timedelta(days=1):
@@ -760,10 +736,7 @@ class Daily(commands.Cog):
                 last_daily = player.get('last_daily')
 
                 if isinstance(last_daily, str):
-                    try:
-                        last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-                    except (ValueError, TypeError):
-                        last_daily = datetime.min
+                    last_daily = datetime.min
 
                 # Kiểm tra xem streak có còn hiệu lực không
                 current_time = datetime.now()
@@ -885,10 +858,7 @@ class Daily(commands.Cog):
         # Kiểm tra lần điểm danh cuối
         last_daily = player.get('last_daily')
         if isinstance(last_daily, str):
-            try:
-                last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-            except (ValueError, TypeError):
-                last_daily = datetime.min
+            last_daily = datetime.min
 
         # Nếu chưa điểm danh hôm nay và là sau 9 giờ sáng, nhắc nhở với xác suất 10%
         current_time = datetime.now()
@@ -945,10 +915,6 @@ class Daily(commands.Cog):
                 daily_streak=0
             )
 
-            # Xóa cache
-            if member.id in self.player_cache:
-                del self.player_cache[member.id]
-
             await ctx.send(f"✅ Đã reset chuỗi điểm danh của {member.display_name}!")
 
         except Exception as e:
@@ -975,10 +941,6 @@ class Daily(commands.Cog):
                 daily_streak=streak
             )
 
-            # Xóa cache
-            if member.id in self.player_cache:
-                del self.player_cache[member.id]
-
             await ctx.send(f"✅ Đã đặt chuỗi điểm danh của {member.display_name} thành {streak} ngày!")
 
         except Exception as e:
@@ -0,0 +1,69 @@
+# modules/drop_tables.py
+import random
+from bisect import bisect_right
+from itertools import accumulate
+from math import prod
+from typing import Dict, Any, List, Tuple, Optional
+
+# Số lượng rơi ra theo loại vật phẩm (min, max)
+QUANTITY_RANGES = {
+    "Nguyên Liệu": (1, 3),
+    "Tài Nguyên": (1, 2)
+}
+
+
+class DropTable:
+    """Bảng rơi đồ đã biên dịch thành mảng trọng số cộng dồn
+
+    Mỗi lượt quay rơi ra một vật phẩm với xác suất hit_rate (bằng xác suất ít
+    nhất một vật phẩm trúng theo "chance" của nó), và vật phẩm được chọn theo
+    tỷ lệ chance bằng bisect trên mảng cộng dồn, nên thứ tự trong bảng không
+    làm lệch kết quả.
+    """
+
+    __slots__ = ("items", "cumulative", "total", "hit_rate", "quantities")
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = tuple(items)
+        self.cumulative = list(accumulate(item["chance"] for item in self.items))
+        self.total = self.cumulative[-1] if self.cumulative else 0.0
+        self.hit_rate = 1.0 - prod(1.0 - min(item["chance"], 1.0) for item in self.items)
+        self.quantities = tuple(QUANTITY_RANGES.get(item["type"], (1, 1)) for item in self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def pick(self, roll: float) -> int:
+        """Chỉ số vật phẩm ứng với roll trong [0, 1)"""
+        return min(bisect_right(self.cumulative, roll * self.total), len(self.items) - 1)
+
+    def roll(self, draws: int, rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
+        """Quay draws lượt cùng lúc, trả về các vật phẩm rơi ra"""
+        if draws <= 0 or not self.items or self.total <= 0:
+            return []
+        rng = rng or random
+
+        hits = [rng.random() for _ in range(draws)]
+        picks = [self.pick(rng.random()) for hit in hits if hit < self.hit_rate]
+
+        dropped = []
+        for index in picks:
+            item = self.items[index]
+            low, high = self.quantities[index]
+            dropped.append({
+                "name": item["name"],
+                "type": item["type"],
+                "rarity": item["rarity"],
+                "value": item["value"],
+                "quantity": rng.randint(low, high) if high > low else low
+            })
+        return dropped
+
+
+def compile_drop_tables(item_drops: Dict[str, Dict[str, List[Dict[str, Any]]]]) -> Dict[Tuple[str, str], DropTable]:
+    """Biên dịch danh sách vật phẩm thành bảng theo (loại kẻ địch, độ hiếm)"""
+    return {
+        (category, rarity): DropTable(items)
+        for category, rarities in item_drops.items()
+        for rarity, items in rarities.items()
+    }
@@ -0,0 +1,224 @@
+# modules/edit_coalescer.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable
+from config import EDIT_FRAME_RATE
+
+RenderFn = Callable[[], Dict[str, Any]]
+
+
+class _PendingEdit:
+    """Khung hình mới nhất đang chờ gửi cho một tin nhắn"""
+
+    __slots__ = ("message", "render", "future", "submitted_at")
+
+    def __init__(self, message, render: RenderFn, future: asyncio.Future):
+        self.message = message
+        self.render = render
+        self.future = future
+        self.submitted_at = time.monotonic()
+
+
+class _ChannelState:
+    """Hàng đợi sửa tin nhắn của một kênh (mỗi tin nhắn giữ một khung hình mới nhất)"""
+
+    __slots__ = ("pending", "next_allowed", "in_flight")
+
+    def __init__(self):
+        self.pending: "OrderedDict[int, _PendingEdit]" = OrderedDict()  # message_id -> khung hình
+        self.next_allowed = 0.0
+        self.in_flight: set = set()  # message_id đang được gửi
+
+
+class EditCoalescer:
+    """Gom các lần sửa tin nhắn theo từng kênh
+
+    Mỗi tin nhắn chỉ giữ khung hình mới nhất đang chờ; khung hình cũ hơn bị
+    bỏ (dropped) thay vì xếp hàng thêm một lệnh HTTP. Mỗi kênh được gửi tối đa
+    frame_rate lần/giây để nằm dưới giới hạn tốc độ của route sửa tin nhắn, và
+    nội dung chỉ được dựng (render) ngay trước khi gửi.
+    """
+
+    def __init__(self, frame_rate: float = EDIT_FRAME_RATE):
+        self.frame_rate = frame_rate
+        self._channels: Dict[int, _ChannelState] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set = set()
+        self._closed = False
+
+        # Thống kê
+        self.total_submitted = 0
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.total_errors = 0
+        self.max_queue_depth = 0
+        self.total_lag = 0.0  # Tổng thời gian chờ (giây) của các khung hình đã gửi
+
+    def start(self):
+        """Khởi động task gửi"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.frame_rate if self.frame_rate > 0 else 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(state.pending) for state in self._channels.values())
+
+    def submit(self, message, render: Optional[RenderFn] = None, **fields) -> asyncio.Future:
+        """Đặt khung hình mới nhất cho message
+
+        Truyền các tham số của message.edit (content=, embed=...) hoặc một hàm
+        render() trả về chúng để chỉ dựng nội dung khi thực sự gửi. Future trả
+        về nhận True khi khung hình được gửi, False nếu bị khung hình mới hơn thay thế.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        render = render or (lambda: fields)
+        self.total_submitted += 1
+
+        if self._closed:
+            # Đã tắt: sửa trực tiếp
+            loop.create_task(self._send_direct(message, render, future))
+            return future
+
+        state = self._channels.setdefault(message.channel.id, _ChannelState())
+        # Thay thế giữ nguyên vị trí của tin nhắn trong hàng đợi để các tin nhắn khác không bị đói
+        previous = state.pending.get(message.id)
+        if previous is not None:
+            self.total_dropped += 1
+            if not previous.future.done():
+                previous.future.set_result(False)
+
+        state.pending[message.id] = _PendingEdit(message, render, future)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._wakeup.set()
+        return future
+
+    async def edit(self, message, **fields) -> bool:
+        """Sửa tin nhắn qua hàng đợi và chờ tới khi gửi xong (hoặc bị thay thế)"""
+        return await self.submit(message, **fields)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Lỗi khi gửi các lần sửa tin nhắn: {e}")
+
+    async def _tick(self):
+        now = time.monotonic()
+        next_wake = None
+
+        for channel_id, state in list(self._channels.items()):
+            if not state.pending:
+                if not state.in_flight and state.next_allowed <= now:
+                    del self._channels[channel_id]
+                continue
+
+            if state.next_allowed > now:
+                next_wake = state.next_allowed if next_wake is None else min(next_wake, state.next_allowed)
+                continue
+
+            # Gửi khung hình chờ lâu nhất của kênh (bỏ qua tin nhắn đang gửi dở)
+            for message_id, pending in state.pending.items():
+                if message_id not in state.in_flight:
+                    del state.pending[message_id]
+                    state.next_allowed = now + self.interval
+                    task = asyncio.get_running_loop().create_task(self._send(state, pending))
+                    self._sending.add(task)
+                    task.add_done_callback(self._sending.discard)
+                    break
+
+        self._wakeup.clear()
+        timeout = None if next_wake is None else max(0.0, next_wake - time.monotonic())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _send(self, state: _ChannelState, pending: _PendingEdit):
+        message_id = pending.message.id
+        state.in_flight.add(message_id)
+        try:
+            await pending.message.edit(**pending.render())
+            self.total_sent += 1
+            self.total_lag += time.monotonic() - pending.submitted_at
+            if not pending.future.done():
+                pending.future.set_result(True)
+        except Exception as e:
+            self.total_errors += 1
+            print(f"❌ Lỗi khi sửa tin nhắn: {e}")
+            if not pending.future.done():
+                pending.future.set_result(False)
+        finally:
+            state.in_flight.discard(message_id)
+            self._wakeup.set()
+
+    async def _send_direct(self, message, render: RenderFn, future: asyncio.Future):
+        sent = await edit_now(message, render)
+        if sent:
+            self.total_sent += 1
+        else:
+            self.total_errors += 1
+        future.set_result(sent)
+
+    async def close(self):
+        """Dừng task và gửi nốt khung hình mới nhất của mọi tin nhắn"""
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+        pending: List[tuple] = []
+        for state in self._channels.values():
+            pending.extend((state, edit) for edit in state.pending.values())
+            state.pending.clear()
+        for state, edit in pending:
+            await self._send(state, edit)
+        self._channels.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của bộ gom"""
+        return {
+            "frame_rate": self.frame_rate,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "channels": len(self._channels),
+            "submitted": self.total_submitted,
+            "sent": self.total_sent,
+            "dropped": self.total_dropped,
+            "errors": self.total_errors,
+            "avg_lag_ms": round(self.total_lag / self.total_sent * 1000, 2) if self.total_sent else 0.0
+        }
+
+
+async def edit_now(message, render: RenderFn) -> bool:
+    """Sửa tin nhắn ngay, không qua hàng đợi"""
+    try:
+        await message.edit(**render())
+        return True
+    except Exception as e:
+        print(f"❌ Lỗi khi sửa tin nhắn: {e}")
+        return False
+
+
+def submit_edit(bot, message, render: Optional[RenderFn] = None, **fields) -> asyncio.Future:
+    """Sửa tin nhắn qua bộ gom của bot, hoặc sửa trực tiếp nếu bot chưa có bộ gom"""
+    coalescer = getattr(bot, 'edit_coalescer', None)
+    if coalescer is not None:
+        return coalescer.submit(message, render, **fields)
+    return asyncio.ensure_future(edit_now(message, render or (lambda: fields)))
@@ -165,6 +165,7 @@ class Help(commands.Cog):
                 "`!danhboss` - Đánh boss (30 phút/lần)\n"
                 "`!combat @người_chơi` - PvP với người chơi khác (30 phút/lần)\n"
                 "`!tudo @người_chơi` - Thách đấu tự do (không ảnh hưởng EXP)\n"
+                "`!dudoan [@người_chơi]` - Dự đoán tỷ lệ thắng / gợi ý đối thủ\n"
                 "`!luyendan` - Luyện đan dược (1 giờ/lần)"
             ),
             inline=False
@@ -522,7 +523,8 @@ class Help(commands.Cog):
                 "• Người thua mất EXP và có thể bị thương\n"
                 "• Chỉ có thể PvP với người có cảnh giới chênh lệch ±2 cấp\n"
                 "• Có thể từ chối thách đấu\n"
-                "• Lệnh `!tudo @người_chơi` để thách đấu không ảnh hưởng EXP"
+                "• Lệnh `!tudo @người_chơi` để thách đấu không ảnh hưởng EXP\n"
+                "• Lệnh `!dudoan @người_chơi` để xem tỷ lệ thắng trước khi khiêu chiến"
             ),
             inline=False
         )
@@ -0,0 +1,92 @@
+# modules/levels.py
+from bisect import bisect_right
+from typing import Dict, Any, List, Optional, Tuple, Union
+from config import CULTIVATION_LEVELS
+
+
+class LevelTable:
+    """Bảng cảnh giới tính sẵn một lần từ CULTIVATION_LEVELS
+
+    Giữ thứ tự cảnh giới theo exp yêu cầu, ánh xạ tên -> chỉ số, chỉ số -> chỉ số
+    sức mạnh và mảng ngưỡng exp đã sắp xếp để tra cảnh giới theo exp bằng bisect
+    thay vì duyệt/tìm chuỗi trong danh sách.
+    """
+
+    def __init__(self, levels: Dict[str, Dict[str, Any]]):
+        self.rebuild(levels)
+
+    def rebuild(self, levels: Dict[str, Dict[str, Any]]):
+        """Dựng lại bảng từ cấu hình (khi tải lại config)"""
+        # Sắp xếp ổn định theo exp yêu cầu (giữ thứ tự khai báo khi bằng nhau)
+        ordered = sorted(levels.items(), key=lambda item: item[1].get("exp_req", 0))
+
+        self.names: List[str] = [name for name, _ in ordered]
+        self.stats: List[Dict[str, Any]] = [dict(data) for _, data in ordered]
+        self.thresholds: List[int] = [data.get("exp_req", 0) for _, data in ordered]
+        self._index: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    @property
+    def max_index(self) -> int:
+        return len(self.names) - 1
+
+    def index(self, name: str, default: int = 0) -> int:
+        """Chỉ số của cảnh giới, trả về default nếu không tồn tại"""
+        return self._index.get(name, default)
+
+    def name_at(self, index: int) -> str:
+        """Tên cảnh giới theo chỉ số (bị giới hạn trong bảng)"""
+        return self.names[max(0, min(index, self.max_index))]
+
+    def get_stats(self, level: Union[str, int]) -> Dict[str, Any]:
+        """Chỉ số sức mạnh của cảnh giới theo tên hoặc chỉ số"""
+        index = self.index(level) if isinstance(level, str) else max(0, min(level, self.max_index))
+        return self.stats[index]
+
+    def exp_required(self, level: Union[str, int]) -> int:
+        """Exp yêu cầu của cảnh giới"""
+        index = self.index(level) if isinstance(level, str) else max(0, min(level, self.max_index))
+        return self.thresholds[index]
+
+    def index_for_exp(self, exp: int) -> int:
+        """Chỉ số cảnh giới cao nhất mà lượng exp đạt tới"""
+        return max(0, bisect_right(self.thresholds, exp) - 1)
+
+    def level_for_exp(self, exp: int) -> str:
+        """Tên cảnh giới cao nhất mà lượng exp đạt tới"""
+        return self.names[self.index_for_exp(exp)]
+
+    def resolve(self, current_level: str, new_exp: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Cảnh giới mới và chỉ số sau khi đạt new_exp, None nếu không thăng cấp
+
+        Cảnh giới không có trong bảng cũng trả về None (không tự thăng cấp).
+        """
+        current_index = self._index.get(current_level)
+        if current_index is None:
+            return None
+        final_index = self.index_for_exp(new_exp)
+        if final_index <= current_index:
+            return None
+        return self.names[final_index], self.stats[final_index]
+
+    def next_level(self, name: str) -> Optional[Tuple[str, int]]:
+        """Cảnh giới tiếp theo và exp yêu cầu, None nếu đã ở cảnh giới cao nhất"""
+        index = self._index.get(name)
+        if index is None or index >= self.max_index:
+            return None
+        return self.names[index + 1], self.thresholds[index + 1]
+
+    def compare(self, level1: str, level2: str) -> int:
+        """So sánh hai cảnh giới: 1 nếu level1 cao hơn, -1 nếu thấp hơn, 0 nếu bằng nhau"""
+        idx1 = self._index.get(level1, -1)
+        idx2 = self._index.get(level2, -1)
+        return (idx1 > idx2) - (idx1 < idx2)
+
+
+# Bảng dùng chung cho toàn bộ bot
+level_table = LevelTable(CULTIVATION_LEVELS)
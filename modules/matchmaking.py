@@ -0,0 +1,164 @@
+# modules/matchmaking.py
+import asyncio
+import random
+from typing import Optional, Dict, Any, List, Tuple
+from modules.levels import level_table
+from modules.combat_engine import CombatEngine, BatchOutcome
+from modules.combat_stats import combat_stats
+from database.player_cache import PlayerCache
+from config import (
+    EXP_STEAL_PERCENT, MAX_EXP_STEAL, MONSTER_EXP,
+    WIN_ESTIMATE_SAMPLES, WIN_ESTIMATE_CACHE_SIZE, WIN_ESTIMATE_CACHE_TTL
+)
+
+# Số lượt tối đa giống trận thật
+PVP_MAX_TURNS = 10
+MONSTER_MAX_TURNS = 10
+
+# Chênh lệch cảnh giới tối đa được phép khiêu chiến (luật của !combat)
+MAX_LEVEL_GAP = 5
+
+
+class WinEstimator:
+    """Ước tính xác suất thắng bằng mô phỏng hàng loạt, không ghi database
+
+    Chỉ số chiến đấu chỉ phụ thuộc vào cảnh giới và môn phái, nên kết quả được
+    ghi nhớ theo cặp (cảnh giới, môn phái). Phần exp cướp được phụ thuộc exp
+    của đối thủ nên được tính lại mỗi lần từ tỷ lệ đã ghi nhớ.
+    """
+
+    def __init__(self, bot, samples: int = WIN_ESTIMATE_SAMPLES, seed: Optional[int] = None,
+                 cache_size: int = WIN_ESTIMATE_CACHE_SIZE, cache_ttl: float = WIN_ESTIMATE_CACHE_TTL):
+        self.bot = bot
+        self.samples = samples
+        self.cache = PlayerCache(cache_size, cache_ttl)
+        # Mỗi lô dùng một engine riêng (chạy trong thread), seed con lấy từ seed gốc để tái lập được
+        self._seeds = random.Random(seed)
+
+    @staticmethod
+    def profile(level: str, sect: Optional[str]) -> Dict[str, Any]:
+        """Chỉ số chiến đấu chuẩn của một cảnh giới và môn phái"""
+        entry = combat_stats.lookup(level, sect) or combat_stats.lookup(level_table.name_at(0), sect)
+        return {
+            'level': level,
+            'sect': sect,
+            'hp': entry.hp,
+            'attack': entry.base_attack,
+            'defense': entry.base_defense
+        }
+
+    async def _simulate(self, first, first_hp: int, second, second_hp: int, max_turns: int) -> Dict[str, Any]:
+        engine = CombatEngine(self._seeds.getrandbits(64))
+        outcome: BatchOutcome = await asyncio.to_thread(
+            engine.simulate_many, first, first_hp, second, second_hp, max_turns, self.samples)
+
+        return {
+            "samples": outcome.samples,
+            "win_rate": outcome.first_win_rate,
+            "knockout_rate": outcome.rate(outcome.first_knockouts),
+            "timeout_win_rate": outcome.rate(outcome.first_timeout_wins),
+            "healthy_win_rate": outcome.rate(outcome.first_healthy_wins),
+            "loss_rate": 1.0 - outcome.first_win_rate,
+            "expected_turns": outcome.expected_turns
+        }
+
+    async def estimate_pvp(self, attacker_level: str, attacker_sect: Optional[str],
+                           defender_level: str, defender_sect: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Tỷ lệ thắng khi bên tấn công khiêu chiến bên phòng thủ (!combat)"""
+        key = ("pvp", attacker_level, attacker_sect, defender_level, defender_sect)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        combat_cog = self.bot.get_cog('Combat')
+        if not combat_cog:
+            return None
+
+        attacker = self.profile(attacker_level, attacker_sect)
+        defender = self.profile(defender_level, defender_sect)
+        first, second = combat_cog.build_strikers(attacker, defender)
+
+        estimate = await self._simulate(first, attacker['hp'], second, defender['hp'], PVP_MAX_TURNS)
+        self.cache.set(key, estimate)
+        return estimate
+
+    async def estimate_monster(self, level: str, is_elite: bool = False) -> Optional[Dict[str, Any]]:
+        """Tỷ lệ thắng khi đánh quái thường/tinh anh (!danhquai)"""
+        key = ("monster", level, is_elite)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        monster_cog = self.bot.get_cog('Monster')
+        if not monster_cog:
+            return None
+
+        player = self.profile(level, None)
+        enemy = monster_cog.scale_monster_stats(player, is_elite)
+        first, second = monster_cog.build_strikers(player, enemy)
+
+        estimate = await self._simulate(first, player['hp'], second, enemy['hp'], MONSTER_MAX_TURNS)
+        self.cache.set(key, estimate)
+        return estimate
+
+    @staticmethod
+    def level_gap(attacker: Dict[str, Any], defender: Dict[str, Any]) -> int:
+        """Số cảnh giới chênh lệch giữa hai người chơi (dương nếu bên tấn công cao hơn)"""
+        return (level_table.index(attacker.get('level', 'Phàm Nhân'))
+                - level_table.index(defender.get('level', 'Phàm Nhân')))
+
+    @classmethod
+    def can_fight(cls, attacker: Dict[str, Any], defender: Dict[str, Any]) -> bool:
+        """Trận đấu có được phép diễn ra theo luật của !combat không (máu và chênh lệch cảnh giới)"""
+        if attacker.get('hp', 100) <= 0 or defender.get('hp', 100) <= 0:
+            return False
+        return abs(cls.level_gap(attacker, defender)) <= MAX_LEVEL_GAP
+
+    @staticmethod
+    def expected_exp_steal(estimate: Dict[str, Any], defender_exp: int) -> float:
+        """Kỳ vọng exp cướp được: hạ gục cướp đủ, thắng nhờ máu cao hơn cướp một nửa"""
+        full = min(int(defender_exp * EXP_STEAL_PERCENT), MAX_EXP_STEAL)
+        half = min(int(defender_exp * EXP_STEAL_PERCENT * 0.5), MAX_EXP_STEAL)
+        return estimate["knockout_rate"] * full + estimate["timeout_win_rate"] * half
+
+    @staticmethod
+    def expected_monster_exp(estimate: Dict[str, Any], is_elite: bool = False) -> float:
+        """Kỳ vọng exp khi đánh quái (thưởng thêm 20% nếu còn trên 80% máu)"""
+        base = MONSTER_EXP * (2 if is_elite else 1)
+        normal_wins = estimate["knockout_rate"] - estimate["healthy_win_rate"]
+        return normal_wins * base + estimate["healthy_win_rate"] * int(base * 1.2)
+
+    async def find_matches(self, player: Dict[str, Any], candidates: List[Dict[str, Any]],
+                           limit: int = 3, target_rate: float = 0.5) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Chọn các đối thủ có tỷ lệ thắng gần target_rate nhất
+
+        Trả về danh sách (đối thủ, ước tính) đã sắp xếp. Đối thủ không thể khiêu
+        chiến (hết máu, chênh lệch quá MAX_LEVEL_GAP cảnh giới) bị loại trước khi
+        mô phỏng. Các cặp (cảnh giới, môn phái) trùng nhau chỉ được mô phỏng một lần.
+        """
+        level = player.get('level', 'Phàm Nhân')
+        sect = player.get('sect')
+
+        matches = []
+        for candidate in candidates:
+            if candidate.get('user_id') == player.get('user_id'):
+                continue
+            if not self.can_fight(player, candidate):
+                continue
+            estimate = await self.estimate_pvp(level, sect, candidate.get('level', 'Phàm Nhân'),
+                                               candidate.get('sect'))
+            if estimate is None:
+                return []
+            matches.append((candidate, estimate))
+
+        matches.sort(key=lambda match: (abs(match[1]["win_rate"] - target_rate),
+                                        -self.expected_exp_steal(match[1], match[0].get('exp', 0))))
+        return matches[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của bộ ước tính"""
+        return {
+            "samples": self.samples,
+            "cached": len(self.cache),
+            "hit_rate": round(self.cache.hit_rate, 3)
+        }
@@ -0,0 +1,354 @@
+# modules/metrics.py
+import inspect
+import time
+from bisect import bisect_left
+from collections import deque, defaultdict
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+from aiohttp import web
+from database.locks import all_registries
+from config import METRICS_HOST, METRICS_PORT, METRICS_SAMPLE_SIZE
+
+# Mốc histogram (giây) cho thời gian xử lý lệnh và thời gian gọi database
+COMMAND_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Tên lệnh dùng cho các lần gọi database ngoài lệnh (flush bộ đệm, đồng bộ bảng xếp hạng...)
+BACKGROUND = "background"
+
+
+class Histogram:
+    """Histogram theo mốc cố định (xuất Prometheus) kèm các mẫu gần nhất để tính phân vị"""
+    __slots__ = ("buckets", "counts", "sum", "count", "samples")
+
+    def __init__(self, buckets: Sequence[float], sample_size: int = METRICS_SAMPLE_SIZE):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Ô cuối là +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.samples = deque(maxlen=sample_size)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Phân vị trên các mẫu gần nhất"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Số mẫu cộng dồn theo từng mốc (định dạng le của Prometheus)"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((f"{bound:g}", total))
+        result.append(("+Inf", self.count))
+        return result
+
+
+class _Invocation:
+    """Một lần gọi lệnh đang chạy"""
+    __slots__ = ("command", "started", "db_calls")
+
+    def __init__(self, command: str):
+        self.command = command
+        self.started = time.perf_counter()
+        self.db_calls = 0
+
+
+# Lệnh đang chạy trong task hiện tại (đặt ở before_invoke, các lần gọi database bên trong được gán cho lệnh này)
+_current: ContextVar[Optional[_Invocation]] = ContextVar("metrics_invocation", default=None)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """Thu thập thời gian xử lý lệnh, thời gian gọi database, tỷ lệ cache và thời gian chờ lock
+
+    Lệnh được đo qua bot.before_invoke/after_invoke, database được đo bằng
+    cách bọc mọi phương thức async của handler. Số liệu xem bằng !perf hoặc
+    Prometheus scrape tại http://METRICS_HOST:METRICS_PORT/metrics.
+    """
+
+    def __init__(self, bot, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                 sample_size: int = METRICS_SAMPLE_SIZE):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.sample_size = sample_size
+        self._runner: Optional[web.AppRunner] = None
+        self.reset()
+
+    def reset(self):
+        """Xóa toàn bộ số liệu đã thu thập"""
+        self.started_at = time.time()
+        self.commands: Dict[str, Histogram] = {}
+        self.command_errors: Dict[str, int] = defaultdict(int)
+        self.command_db_calls: Dict[str, int] = defaultdict(int)  # Tổng số lần gọi database của mỗi lệnh
+        self.db_methods: Dict[str, Histogram] = {}
+        self.db_errors: Dict[str, int] = defaultdict(int)
+        self.db_calls: Dict[Tuple[str, str], int] = defaultdict(int)  # (lệnh, phương thức) -> số lần gọi
+
+    # Đo lệnh
+    def command_started(self, ctx):
+        """Gọi từ bot.before_invoke"""
+        if ctx.command is not None:
+            _current.set(_Invocation(ctx.command.qualified_name))
+
+    def command_finished(self, ctx):
+        """Gọi từ bot.after_invoke (chạy cả khi lệnh lỗi)"""
+        invocation = _current.get()
+        if invocation is None:
+            return
+        _current.set(None)
+
+        name = invocation.command
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram(COMMAND_BUCKETS, self.sample_size)
+        histogram.observe(time.perf_counter() - invocation.started)
+        self.command_db_calls[name] += invocation.db_calls
+        if getattr(ctx, 'command_failed', False):
+            self.command_errors[name] += 1
+
+    # Đo database
+    def instrument(self, db):
+        """Bọc mọi phương thức async công khai của database handler để đo thời gian và đếm lượt gọi"""
+        for name, method in inspect.getmembers(type(db)):
+            if name.startswith('_'):
+                continue
+            bound = getattr(db, name)
+            if getattr(bound, '__metrics_wrapped__', False):
+                continue
+            if inspect.iscoroutinefunction(method):
+                setattr(db, name, self._wrap_coroutine(name, bound))
+            elif inspect.isasyncgenfunction(method):
+                setattr(db, name, self._wrap_async_generator(name, bound))
+        return db
+
+    def _wrap_coroutine(self, name: str, func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self.record_db(name, time.perf_counter() - started, failed)
+
+        wrapper.__metrics_wrapped__ = True
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def _wrap_async_generator(self, name: str, func):
+        async def wrapper(*args, **kwargs):
+            # Tính cả thời gian duyệt hết kết quả (các batch của cursor)
+            started = time.perf_counter()
+            failed = False
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self.record_db(name, time.perf_counter() - started, failed)
+
+        wrapper.__metrics_wrapped__ = True
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def record_db(self, method: str, elapsed: float, failed: bool = False):
+        histogram = self.db_methods.get(method)
+        if histogram is None:
+            histogram = self.db_methods[method] = Histogram(DB_BUCKETS, self.sample_size)
+        histogram.observe(elapsed)
+        if failed:
+            self.db_errors[method] += 1
+
+        invocation = _current.get()
+        if invocation is not None:
+            invocation.db_calls += 1
+        self.db_calls[(invocation.command if invocation else BACKGROUND, method)] += 1
+
+    # Số liệu lấy tại thời điểm đọc
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Thống kê các cache người chơi, đối thủ và ước tính tỷ lệ thắng"""
+        caches = {}
+        db = self.bot.db
+        if db is not None:
+            for name, attr in (("player", "cache"), ("opponent", "opponent_cache")):
+                cache = getattr(db, attr, None)
+                if cache is not None:
+                    caches[name] = cache.get_stats()
+
+        combat_cog = self.bot.get_cog('Combat')
+        if combat_cog and getattr(combat_cog, 'estimator', None):
+            caches["win_estimate"] = combat_cog.estimator.cache.get_stats()
+        return caches
+
+    @staticmethod
+    def lock_stats() -> Dict[str, Dict[str, float]]:
+        """Thời gian chờ lock gộp theo tên registry"""
+        locks: Dict[str, Dict[str, float]] = {}
+        for registry in all_registries():
+            entry = locks.setdefault(registry.name, {"acquisitions": 0, "waits": 0, "wait_total": 0.0,
+                                                     "wait_max": 0.0})
+            entry["acquisitions"] += registry.acquisitions
+            entry["waits"] += registry.waits
+            entry["wait_total"] += registry.wait_total
+            entry["wait_max"] = max(entry["wait_max"], registry.wait_max)
+        return locks
+
+    def get_stats(self, limit: int = 10) -> Dict[str, Any]:
+        """Tóm tắt cho !perf: lệnh và phương thức database chiếm nhiều thời gian nhất"""
+        commands = []
+        for name, histogram in self.commands.items():
+            commands.append({
+                "name": name,
+                "count": histogram.count,
+                "errors": self.command_errors.get(name, 0),
+                "avg_ms": histogram.mean * 1000,
+                "p50_ms": histogram.quantile(0.5) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "db_calls": self.command_db_calls.get(name, 0) / histogram.count,
+                "total_s": histogram.sum
+            })
+        commands.sort(key=lambda item: item["total_s"], reverse=True)
+
+        db_methods = []
+        for name, histogram in self.db_methods.items():
+            db_methods.append({
+                "name": name,
+                "count": histogram.count,
+                "errors": self.db_errors.get(name, 0),
+                "avg_ms": histogram.mean * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "total_s": histogram.sum
+            })
+        db_methods.sort(key=lambda item: item["total_s"], reverse=True)
+
+        return {
+            "uptime": time.time() - self.started_at,
+            "commands": commands[:limit],
+            "db_methods": db_methods[:limit],
+            "caches": self.cache_stats(),
+            "locks": self.lock_stats()
+        }
+
+    # Xuất Prometheus
+    @staticmethod
+    def _render_histogram(lines: List[str], metric: str, label: str, histograms: Dict[str, Histogram]):
+        for key, histogram in sorted(histograms.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f"{metric}_bucket{_labels(**{label: key, 'le': bound})} {count}")
+            lines.append(f"{metric}_sum{_labels(**{label: key})} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{_labels(**{label: key})} {histogram.count}")
+
+    def render_prometheus(self) -> str:
+        """Toàn bộ số liệu ở định dạng text của Prometheus"""
+        lines = [
+            "# HELP tutien_command_duration_seconds Thời gian xử lý lệnh",
+            "# TYPE tutien_command_duration_seconds histogram"
+        ]
+        self._render_histogram(lines, "tutien_command_duration_seconds", "command", self.commands)
+
+        lines += ["# HELP tutien_command_errors_total Số lần lệnh bị lỗi",
+                  "# TYPE tutien_command_errors_total counter"]
+        for name, count in sorted(self.command_errors.items()):
+            lines.append(f"tutien_command_errors_total{_labels(command=name)} {count}")
+
+        lines += ["# HELP tutien_db_duration_seconds Thời gian gọi database theo phương thức",
+                  "# TYPE tutien_db_duration_seconds histogram"]
+        self._render_histogram(lines, "tutien_db_duration_seconds", "method", self.db_methods)
+
+        lines += ["# HELP tutien_db_errors_total Số lần gọi database bị lỗi",
+                  "# TYPE tutien_db_errors_total counter"]
+        for name, count in sorted(self.db_errors.items()):
+            lines.append(f"tutien_db_errors_total{_labels(method=name)} {count}")
+
+        lines += ["# HELP tutien_db_calls_total Số lần gọi database theo lệnh và phương thức",
+                  "# TYPE tutien_db_calls_total counter"]
+        for (command, method), count in sorted(self.db_calls.items()):
+            lines.append(f"tutien_db_calls_total{_labels(command=command, method=method)} {count}")
+
+        caches = self.cache_stats()
+        lines += ["# HELP tutien_cache_hits_total Số lần đọc trúng cache",
+                  "# TYPE tutien_cache_hits_total counter"]
+        lines += [f"tutien_cache_hits_total{_labels(cache=name)} {stats['hits']}" for name, stats in caches.items()]
+        lines += ["# HELP tutien_cache_misses_total Số lần đọc trượt cache",
+                  "# TYPE tutien_cache_misses_total counter"]
+        lines += [f"tutien_cache_misses_total{_labels(cache=name)} {stats['misses']}"
+                  for name, stats in caches.items()]
+        lines += ["# HELP tutien_cache_size Số mục đang có trong cache",
+                  "# TYPE tutien_cache_size gauge"]
+        lines += [f"tutien_cache_size{_labels(cache=name)} {stats['size']}" for name, stats in caches.items()]
+
+        locks = self.lock_stats()
+        lines += ["# HELP tutien_lock_acquisitions_total Số lần lấy lock",
+                  "# TYPE tutien_lock_acquisitions_total counter"]
+        lines += [f"tutien_lock_acquisitions_total{_labels(registry=name)} {stats['acquisitions']}"
+                  for name, stats in sorted(locks.items())]
+        lines += ["# HELP tutien_lock_waits_total Số lần phải chờ lock đang bị giữ",
+                  "# TYPE tutien_lock_waits_total counter"]
+        lines += [f"tutien_lock_waits_total{_labels(registry=name)} {stats['waits']}"
+                  for name, stats in sorted(locks.items())]
+        lines += ["# HELP tutien_lock_wait_seconds_total Tổng thời gian chờ lock",
+                  "# TYPE tutien_lock_wait_seconds_total counter"]
+        lines += [f"tutien_lock_wait_seconds_total{_labels(registry=name)} {stats['wait_total']:.6f}"
+                  for name, stats in sorted(locks.items())]
+        lines += ["# HELP tutien_lock_wait_seconds_max Thời gian chờ lock lâu nhất",
+                  "# TYPE tutien_lock_wait_seconds_max gauge"]
+        lines += [f"tutien_lock_wait_seconds_max{_labels(registry=name)} {stats['wait_max']:.6f}"
+                  for name, stats in sorted(locks.items())]
+
+        lines += ["# HELP tutien_uptime_seconds Thời gian kể từ lần reset số liệu gần nhất",
+                  "# TYPE tutien_uptime_seconds gauge",
+                  f"tutien_uptime_seconds {time.time() - self.started_at:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    # HTTP /metrics
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.render_prometheus().encode('utf-8'),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def start(self):
+        """Mở cổng HTTP /metrics nếu METRICS_PORT được cấu hình"""
+        if not self.port or self._runner:
+            return
+        try:
+            app = web.Application()
+            app.router.add_get('/metrics', self._handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            print(f"✓ Đang xuất metrics tại http://{self.host}:{self.port}/metrics")
+        except Exception as e:
+            print(f"❌ Lỗi khi mở cổng metrics: {e}")
+            await self.close()
+
+    async def close(self):
+        """Đóng cổng HTTP /metrics"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -4,14 +4,22 @@ from datetime import datetime, timedelta
 import random
 import asyncio
 import math
+from itertools import accumulate
 from typing import Dict, List, Tuple, Optional, Union, Any
 from modules.utils import format_time
 from config import (
     MONSTER_COOLDOWN, BOSS_COOLDOWN,
     MONSTER_HP_MULTIPLIER, MONSTER_ATK_MULTIPLIER,
     BOSS_HP_MULTIPLIER, BOSS_ATK_MULTIPLIER,
-    MONSTER_EXP, BOSS_EXP
+    MONSTER_EXP, BOSS_EXP,
+    BOSS_MAX_ROUNDS, BOSS_COUNTDOWN, BOSS_ROUND_INTERVAL
 )
+from database.locks import LockRegistry
+from modules.combat_stats import combat_stats
+from modules.combat_engine import CombatEngine, CombatLog, StrikeEvent, Striker, BossFightResult, FIRST, pick
+from modules.battle_scheduler import BattleScheduler
+from modules.drop_tables import compile_drop_tables
+from modules.edit_coalescer import submit_edit
 
 
 class Monster(commands.Cog):
@@ -20,15 +28,26 @@ class Monster(commands.Cog):
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.combat_locks = {}  # Lock cho mỗi người chơi
+        self.combat_locks = LockRegistry("monster")  # Lock cho mỗi người chơi
         self.monster_types = self.load_monster_types()
         self.boss_battles = {}  # Lưu thông tin các trận đánh boss nhóm
         self.item_drops = self.load_item_drops()
+        self.drop_tables = compile_drop_tables(self.item_drops)  # Bảng rơi đồ (trọng số cộng dồn)
         self.combat_messages = self.load_combat_messages()
+        self.engine = CombatEngine()  # Bộ máy chiến đấu dùng chung
+        self.battle_scheduler = BattleScheduler(bot)  # Phát lại các trận boss đã tính sẵn
 
         # Tạo task định kỳ để dọn dẹp các trận đánh boss cũ
         self.bot.loop.create_task(self.cleanup_boss_battles())
 
+    async def cog_load(self):
+        """Khởi động bộ phát lại trận boss khi load module"""
+        self.battle_scheduler.start()
+
+    async def cog_unload(self):
+        """Dừng bộ phát lại (các trận đang phát nhảy tới kết quả) khi unload module"""
+        await self.battle_scheduler.stop()
+
     def load_monster_types(self) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
         """Load các loại quái vật và boss với thông tin chi tiết hơn"""
         return {
@@ -223,11 +242,9 @@ class Monster(commands.Cog):
             ]
         }
 
-    async def get_combat_lock(self, user_id: int) -> asyncio.Lock:
-        """Lấy hoặc tạo lock cho người chơi"""
-        if user_id not in self.combat_locks:
-            self.combat_locks[user_id] = asyncio.Lock()
-        return self.combat_locks[user_id]
+    def get_combat_lock(self, user_id: int):
+        """Lấy lock cho người chơi (tự thu hồi khi không còn ai dùng)"""
+        return self.combat_locks.hold(user_id)
 
     async def cleanup_boss_battles(self):
         """Dọn dẹp các trận đánh boss cũ định kỳ"""
@@ -286,161 +303,75 @@ class Monster(commands.Cog):
         return player, last_action
 
     async def simulate_combat(self, player_stats: Dict, enemy_stats: Dict, max_rounds: int = 10) -> Tuple[
-        int, int, List[str]]:
+        int, int, CombatLog]:
         """Mô phỏng trận chiến với nhiều yếu tố ngẫu nhiên và kỹ năng"""
-        player_hp = player_stats['hp']
-        enemy_hp = enemy_stats['hp']
-        battle_log = []
-        rounds = 0
-
-        # Danh sách kỹ năng người chơi dựa trên cảnh giới
-        player_skills = self.get_player_skills(player_stats.get('level', 'Phàm Nhân'))
-
-        # Danh sách kỹ năng của quái/boss
-        enemy_skills = enemy_stats.get('skills', ['Tấn Công Thường'])
-
-        while enemy_hp > 0 and player_hp > 0 and rounds < max_rounds:
-            # Player attacks
-            # Xác định có né tránh không
-            if random.random() < 0.1:  # 10% cơ hội né tránh
-                dodge_msg = random.choice(self.combat_messages['enemy_dodge'])
-                battle_log.append(dodge_msg.format(
-                    enemy=enemy_stats['name'],
-                    player=player_stats.get('name', 'Tu sĩ')
-                ))
-            else:
-                # Xác định có chí mạng không
-                is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                # Chọn kỹ năng ngẫu nhiên
-                skill = random.choice(player_skills)
-
-                # Tính sát thương
-                damage_multiplier = 1.5 if is_crit else (0.8 + random.random() * 0.4)
-                damage = int(player_stats['attack'] * damage_multiplier)
-                enemy_hp -= damage
-
-                # Thêm log chiến đấu
-                if is_crit:
-                    msg = random.choice(self.combat_messages['player_crit'])
-                else:
-                    msg = random.choice(self.combat_messages['player_attack'])
+        player, enemy = self.build_strikers(player_stats, enemy_stats)
+
+        result = self.engine.fight(player, player_stats['hp'], enemy, enemy_stats['hp'], max_turns=max_rounds)
+        names = (player.name, enemy.name)
+        is_boss = 'boss' in enemy_stats
+        battle_log = CombatLog(result.events, lambda event: self.render_strike(event, names, is_boss))
+
+        return result.first_hp, result.second_hp, battle_log
+
+    def build_strikers(self, player_stats: Dict, enemy_stats: Dict) -> Tuple[Striker, Striker]:
+        """Tạo thông số ra đòn của người chơi và quái/boss cho bộ máy chiến đấu"""
+        # Người chơi: né 10% / chí mạng 15%; quái/boss: né 8% / chí mạng 12%; sát thương 0.8-1.2 hoặc x1.5
+        player = Striker(
+            player_stats.get('name', 'Tu sĩ'), player_stats['attack'],
+            self.get_player_skills(player_stats.get('level', 'Phàm Nhân')),
+            dodge_chance=0.1, crit_chance=0.15
+        )
+        enemy = Striker(
+            enemy_stats.get('name', 'Quái vật'), enemy_stats['attack'],
+            enemy_stats.get('skills', ['Tấn Công Thường']),
+            dodge_chance=0.08, crit_chance=0.12
+        )
+        return player, enemy
 
-                battle_log.append(msg.format(
-                    player=player_stats.get('name', 'Tu sĩ'),
-                    target=enemy_stats['name'],
-                    damage=damage,
-                    skill=skill
-                ))
+    @staticmethod
+    def scale_monster_stats(player: Dict, is_elite: bool) -> Dict[str, int]:
+        """Máu và công kích của quái thường theo chỉ số người chơi"""
+        elite_multiplier = 1.5 if is_elite else 1
+        return {
+            'hp': int(player['hp'] * MONSTER_HP_MULTIPLIER * elite_multiplier),
+            'attack': int(player['attack'] * MONSTER_ATK_MULTIPLIER * elite_multiplier)
+        }
 
-            # Enemy counterattack if still alive
-            if enemy_hp > 0:
-                # Xác định có né tránh không
-                if random.random() < 0.08:  # 8% cơ hội né tránh
-                    dodge_msg = random.choice(self.combat_messages['player_dodge'])
-                    battle_log.append(dodge_msg.format(
-                        player=player_stats.get('name', 'Tu sĩ'),
-                        enemy=enemy_stats['name']
-                    ))
-                else:
-                    # Xác định có chí mạng không
-                    is_crit = random.random() < 0.12  # 12% cơ hội chí mạng
-
-                    # Chọn kỹ năng ngẫu nhiên
-                    skill = random.choice(enemy_skills)
-
-                    # Tính sát thương
-                    damage_multiplier = 1.5 if is_crit else (0.8 + random.random() * 0.4)
-                    enemy_damage = int(enemy_stats['attack'] * damage_multiplier)
-                    player_hp -= enemy_damage
-
-                    # Thêm log chiến đấu
-                    if 'boss' in enemy_stats:
-                        if is_crit:
-                            msg = random.choice(self.combat_messages['boss_crit'])
-                        else:
-                            msg = random.choice(self.combat_messages['boss_attack'])
-
-                        battle_log.append(msg.format(
-                            boss=enemy_stats['name'],
-                            player=player_stats.get('name', 'Tu sĩ'),
-                            damage=enemy_damage,
-                            skill=skill
-                        ))
-                    else:
-                        msg = random.choice(self.combat_messages['monster_attack'])
-                        battle_log.append(msg.format(
-                            monster=enemy_stats['name'],
-                            player=player_stats.get('name', 'Tu sĩ'),
-                            damage=enemy_damage
-                        ))
-
-            rounds += 1
-            # Thêm delay nhỏ để tạo cảm giác thực tế
-            await asyncio.sleep(0.1)
-
-        return player_hp, enemy_hp, battle_log
-
-    def get_player_skills(self, level: str) -> List[str]:
+    def render_strike(self, event: StrikeEvent, names: Tuple[str, str], is_boss: bool = False) -> str:
+        """Tạo dòng log cho một đòn đánh (chỉ gọi khi dòng đó được hiển thị)"""
+        player, enemy = names
+        messages = self.combat_messages
+
+        if event.side == FIRST:
+            if event.dodged:
+                return pick(messages['enemy_dodge'], event.roll).format(enemy=enemy, player=player)
+            msg = pick(messages['player_crit'] if event.crit else messages['player_attack'], event.roll)
+            return msg.format(player=player, target=enemy, damage=event.damage, skill=event.skill)
+
+        if event.dodged:
+            return pick(messages['player_dodge'], event.roll).format(player=player, enemy=enemy)
+        if is_boss:
+            msg = pick(messages['boss_crit'] if event.crit else messages['boss_attack'], event.roll)
+            return msg.format(boss=enemy, player=player, damage=event.damage, skill=event.skill)
+        return pick(messages['monster_attack'], event.roll).format(monster=enemy, player=player, damage=event.damage)
+
+    def get_player_skills(self, level: str) -> Tuple[str, ...]:
         """Lấy danh sách kỹ năng người chơi dựa trên cảnh giới"""
-        # Kỹ năng cơ bản
-        basic_skills = ["Quyền Cước", "Kiếm Pháp Cơ Bản", "Chưởng Pháp"]
-
-        # Kỹ năng theo cảnh giới
-        if "Luyện Khí" in level:
-            return basic_skills + ["Linh Khí Quyền", "Ngưng Khí Thuật"]
-        elif "Trúc Cơ" in level:
-            return basic_skills + ["Linh Khí Quyền", "Ngưng Khí Thuật", "Trúc Cơ Kiếm Pháp", "Linh Khí Phá"]
-        elif "Nguyên Anh" in level:
-            return basic_skills + ["Trúc Cơ Kiếm Pháp", "Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất"]
-        elif "Kim Đan" in level or higher_level(level):
-            return ["Linh Khí Phá", "Nguyên Anh Chưởng", "Thiên Địa Hợp Nhất", "Kiếm Khí Trảm", "Đại Đạo Vô Hình",
-                    "Tiên Thiên Công"]
-        else:
-            return basic_skills
-
-    def higher_level(self, level: str) -> bool:
-        """Kiểm tra xem cảnh giới có cao hơn Kim Đan không"""
-        high_levels = ["Hóa Thần", "Luyện Hư", "Đại Thừa", "Diễn Chủ"]
-        return any(high in level for high in high_levels)
+        return combat_stats.skills(level)
 
     async def roll_for_items(self, enemy_type: str, is_elite: bool) -> List[Dict[str, Any]]:
         """Quay ngẫu nhiên vật phẩm rơi ra"""
         category = "boss" if enemy_type == "boss" else "monster"
         rarity = "elite" if is_elite else "normal"
 
-        possible_items = self.item_drops[category][rarity]
-        dropped_items = []
-
         # Số lượng vật phẩm có thể rơi ra
         max_items = 2 if enemy_type == "monster" else 3
         if is_elite:
             max_items += 1
 
-        # Xác định số lượng vật phẩm thực tế
-        num_items = random.randint(1, max_items)
-
-        # Quay ngẫu nhiên vật phẩm
-        for _ in range(num_items):
-            for item in possible_items:
-                if random.random() < item["chance"]:
-                    # Thêm số lượng ngẫu nhiên
-                    quantity = 1
-                    if item["type"] == "Nguyên Liệu":
-                        quantity = random.randint(1, 3)
-                    elif item["type"] == "Tài Nguyên":
-                        quantity = random.randint(1, 2)
-
-                    dropped_items.append({
-                        "name": item["name"],
-                        "type": item["type"],
-                        "rarity": item["rarity"],
-                        "value": item["value"],
-                        "quantity": quantity
-                    })
-                    break
-
-        return dropped_items
+        # Quay tất cả các lượt cùng lúc trên bảng đã biên dịch
+        return self.drop_tables[(category, rarity)].roll(random.randint(1, max_items))
 
     async def create_combat_embed(
             self,
@@ -577,7 +508,7 @@ class Monster(commands.Cog):
     @commands.cooldown(1, MONSTER_COOLDOWN, commands.BucketType.user)
     async def danhquai(self, ctx):
         """Đánh quái thường để nhận kinh nghiệm và vật phẩm"""
-        async with await self.get_combat_lock(ctx.author.id):
+        async with self.get_combat_lock(ctx.author.id):
             try:
                 # Hiển thị thông báo đang tìm quái
                 loading_msg = await ctx.send("🔍 Đang tìm kiếm quái vật...")
@@ -597,8 +528,11 @@ class Monster(commands.Cog):
                 monster_data = random.choice(monster_list)
 
                 # Cập nhật thông báo
-                await loading_msg.edit(content=f"⚔️ Đã phát hiện {monster_data['name']}! Đang chuẩn bị chiến đấu...")
-                await asyncio.sleep(1)
+                await asyncio.gather(
+                    submit_edit(self.bot, loading_msg,
+                                content=f"⚔️ Đã phát hiện {monster_data['name']}! Đang chuẩn bị chiến đấu..."),
+                    asyncio.sleep(1)
+                )
 
                 # Tính chỉ số quái
                 player_stats = {
@@ -610,12 +544,13 @@ class Monster(commands.Cog):
                     'current_hp': player['hp']
                 }
 
+                scaled = self.scale_monster_stats(player, is_elite)
                 monster_stats = {
                     'name': monster_data['name'],
-                    'hp': int(player['hp'] * MONSTER_HP_MULTIPLIER * (1.5 if is_elite else 1)),
-                    'attack': int(player['attack'] * MONSTER_ATK_MULTIPLIER * (1.5 if is_elite else 1)),
+                    'hp': scaled['hp'],
+                    'attack': scaled['attack'],
                     'is_elite': is_elite,
-                    'current_hp': int(player['hp'] * MONSTER_HP_MULTIPLIER * (1.5 if is_elite else 1)),
+                    'current_hp': scaled['hp'],
                     'type': monster_data['type'],
                     'element': monster_data['element'],
                     'description': monster_data['description']
@@ -639,8 +574,6 @@ class Monster(commands.Cog):
                     if hp_percent > 0.8:
                         exp_gained = int(exp_gained * 1.2)  # +20% nếu còn >80% HP
 
-                    new_exp = player['exp'] + exp_gained
-
                     # Quay vật phẩm
                     items_gained = await self.roll_for_items("monster", is_elite)
 
@@ -657,19 +590,17 @@ class Monster(commands.Cog):
                                     item['quantity']
                                 )
 
-                    # Cập nhật thống kê
-                    stats = player.get('stats', {})
-                    monsters_killed = stats.get('monsters_killed', 0) + 1
-                    elite_monsters_killed = stats.get('elite_monsters_killed', 0) + (1 if is_elite else 0)
-
-                    # Cập nhật người chơi
-                    await self.db.update_player(
+                    # Cập nhật exp, thống kê và thời gian trong một lần ghi nguyên tử
+                    updated = await self.db.increment_exp(
                         ctx.author.id,
-                        exp=new_exp,
-                        last_monster=datetime.now(),
-                        stats__monsters_killed=monsters_killed,
-                        stats__elite_monsters_killed=elite_monsters_killed
+                        exp_gained,
+                        stats={
+                            'monsters_killed': 1,
+                            'elite_monsters_killed': 1 if is_elite else 0
+                        },
+                        last_monster=datetime.now()
                     )
+                    new_exp = updated['exp'] if updated else player['exp'] + exp_gained
 
                     # Kiểm tra level up
                     cultivation_cog = self.bot.get_cog('Cultivation')
@@ -694,14 +625,13 @@ class Monster(commands.Cog):
     @commands.cooldown(1, BOSS_COOLDOWN, commands.BucketType.user)
     async def danhboss(self, ctx, *members: discord.Member):
         """Đánh boss (có thể rủ thêm người)"""
-        async with await self.get_combat_lock(ctx.author.id):
+        # Khóa chỉ được giữ trong lúc kiểm tra, tính trận đấu và phát thưởng;
+        # phần hiển thị từng vòng được phát lại sau khi đã nhả khóa
+        async with self.get_combat_lock(ctx.author.id):
             try:
                 # Hiển thị thông báo đang tìm boss
                 loading_msg = await ctx.send("🔍 Đang tìm kiếm boss...")
 
-                # Tạo hiệu ứng tìm kiếm
-                await asyncio.sleep(2)
-
                 # Kiểm tra điều kiện
                 player, last_action = await self.check_combat_conditions(ctx, 'boss')
                 if not player:
@@ -713,7 +643,7 @@ class Monster(commands.Cog):
                 team_stats = [player]
 
                 if members:
-                    await loading_msg.edit(content="⏳ Đang mời các đạo hữu tham gia...")
+                    await submit_edit(self.bot, loading_msg, content="⏳ Đang mời các đạo hữu tham gia...")
 
                     for member in members:
                         if member.bot or member == ctx.author:
@@ -724,7 +654,7 @@ class Monster(commands.Cog):
                             continue
 
                         # Kiểm tra xem người chơi có đang trong trận đấu khác không
-                        if member.id in self.combat_locks and self.combat_locks[member.id].locked():
+                        if self.combat_locks.locked(member.id) or self.in_boss_battle(member.id):
                             continue
 
                         team_members.append(member)
@@ -741,10 +671,6 @@ class Monster(commands.Cog):
                 boss_list = self.monster_types['boss']['elite' if is_elite else 'normal']
                 boss_data = random.choice(boss_list)
 
-                # Cập nhật thông báo
-                await loading_msg.edit(content=f"⚔️ Đã phát hiện {boss_data['name']}! Đang chuẩn bị chiến đấu...")
-                await asyncio.sleep(1.5)
-
                 # Tính chỉ số boss dựa trên số lượng người chơi
                 team_size = len(team_members)
                 team_hp_total = sum(p['hp'] for p in team_stats)
@@ -769,7 +695,7 @@ class Monster(commands.Cog):
 
                 # Tạo thông tin trận đấu
                 team_player_stats = []
-                for i, (member, stats) in enumerate(zip(team_members, team_stats)):
+                for member, stats in zip(team_members, team_stats):
                     player_combat_stats = {
                         'name': member.display_name,
                         'hp': stats['hp'],
@@ -781,15 +707,25 @@ class Monster(commands.Cog):
                     }
                     team_player_stats.append(player_combat_stats)
 
+                # Tính trước toàn bộ trận đấu
+                fight = self.compute_boss_battle(boss_stats, team_player_stats)
+
                 # Lưu thông tin trận đấu
-                self.boss_battles[battle_id] = {
+                battle = {
                     'boss': boss_stats,
                     'team': team_player_stats,
                     'start_time': datetime.now(),
                     'ended': False,
-                    'battle_log': [],
+                    'fight': fight,
+                    'rewards': [],
+                    'items': [],
                     'channel_id': ctx.channel.id
                 }
+                self.boss_battles[battle_id] = battle
+
+                # Phát thưởng ngay khi đã biết kết quả
+                if fight.is_victory:
+                    battle['rewards'], battle['items'] = await self.settle_boss_rewards(ctx, boss_stats, team_player_stats)
 
                 # Tạo embed thông báo bắt đầu trận đấu
                 embed = discord.Embed(
@@ -812,7 +748,7 @@ class Monster(commands.Cog):
 
                 # Thông tin đội
                 team_info = []
-                for i, (member, stats) in enumerate(zip(team_members, team_player_stats)):
+                for member, stats in zip(team_members, team_player_stats):
                     team_info.append(f"• {member.mention} - {stats['level']} - HP: {stats['hp']:,}")
 
                 embed.add_field(
@@ -835,7 +771,7 @@ class Monster(commands.Cog):
                 # Thêm hướng dẫn
                 embed.add_field(
                     name="⚔️ Bắt Đầu Chiến Đấu",
-                    value="Trận chiến sẽ bắt đầu trong 5 giây...",
+                    value=f"Trận chiến sẽ bắt đầu trong {BOSS_COUNTDOWN} giây...",
                     inline=False
                 )
 
@@ -843,312 +779,250 @@ class Monster(commands.Cog):
                 await loading_msg.delete()
                 battle_msg = await ctx.send(embed=embed)
 
-                # Đếm ngược
-                for i in range(5, 0, -1):
-                    await battle_msg.edit(embed=discord.Embed(
-                        title=f"👑 Trận Chiến Boss: {boss_data['name']}",
-                        description=f"Trận chiến sẽ bắt đầu trong {i} giây...",
-                        color=0xff9900
-                    ))
-                    await asyncio.sleep(1)
-
-                # Bắt đầu trận đấu
-                await self.simulate_boss_battle(ctx, battle_id, battle_msg)
+                # Phát lại trận đấu (không giữ khóa, không có coroutine ngủ riêng cho trận)
+                self.schedule_boss_playback(battle_id, battle_msg)
 
             except Exception as e:
                 print(f"Lỗi khi đánh boss: {e}")
                 await ctx.send("Có lỗi xảy ra trong quá trình chiến đấu!")
 
-    async def simulate_boss_battle(self, ctx, battle_id: str, battle_msg):
-        """Mô phỏng trận đấu với boss"""
-        try:
-            battle = self.boss_battles[battle_id]
-            boss = battle['boss']
-            team = battle['team']
-            battle_log = []
-
-            # Số vòng tối đa
-            max_rounds = 20
-            current_round = 0
-
-            # Danh sách người chơi còn sống
-            alive_players = team.copy()
-
-            while boss['current_hp'] > 0 and any(
-                    p['current_hp'] > 0 for p in alive_players) and current_round < max_rounds:
-                current_round += 1
-
-                # Hiển thị thông tin vòng đấu
-                round_embed = discord.Embed(
-                    title=f"👑 Trận Chiến Boss: {boss['name']} - Vòng {current_round}",
-                    description=f"Trận chiến đang diễn ra khốc liệt!",
-                    color=0xff9900
-                )
+    def in_boss_battle(self, user_id: int) -> bool:
+        """Người chơi có đang trong một trận đánh boss chưa phát lại xong không"""
+        return any(
+            not battle['ended'] and any(p['user_id'] == user_id for p in battle['team'])
+            for battle in self.boss_battles.values()
+        )
 
-                # Thông tin HP boss
-                hp_percent = boss['current_hp'] / boss['hp'] * 100
-                hp_bar = self.create_hp_bar(hp_percent)
+    def compute_boss_battle(self, boss: Dict, team: List[Dict]) -> BossFightResult:
+        """Tính trước toàn bộ trận đánh boss và cập nhật máu cuối trận"""
+        boss_striker = self.build_strikers(team[0], boss)[1]
+        team_strikers = [(self.build_strikers(player, boss)[0], player['hp']) for player in team]
+
+        fight = self.engine.boss_fight(team_strikers, boss_striker, boss['hp'], max_rounds=BOSS_MAX_ROUNDS)
+
+        boss['current_hp'] = fight.boss_hp
+        for player, hp in zip(team, fight.team_hp):
+            player['current_hp'] = hp
+        return fight
+
+    async def settle_boss_rewards(self, ctx, boss: Dict, team: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Phát exp và vật phẩm cho đội sau khi thắng boss
+
+        Trả về (phần thưởng từng người, vật phẩm rơi ra). Kiểm tra thăng cấp
+        được hoãn tới khi phát lại xong để không lộ kết quả trước.
+        """
+        base_exp = BOSS_EXP * (3 if boss['is_elite'] else 1)
+
+        # Quay vật phẩm
+        items_gained = await self.roll_for_items("boss", boss['is_elite'])
+
+        # Tính phần thưởng của cả đội trước, rồi ghi một lần
+        rewarded = []
+        for player in team:
+            member = ctx.guild.get_member(player['user_id'])
+            if not member:
+                continue
+
+            player_exp = base_exp // len(team)
+            if player['current_hp'] <= 0:
+                player_exp = player_exp // 2  # Người chơi bị gục nhận một nửa exp
+            rewarded.append((player, member, player_exp))
+
+        # Cập nhật exp và thống kê của cả đội (một bulk_write, một truy vấn $in)
+        updated = await self.db.bulk_increment_rewards(
+            {player['user_id']: player_exp for player, _, player_exp in rewarded},
+            stats={
+                'bosses_killed': 1,
+                'elite_bosses_killed': 1 if boss['is_elite'] else 0
+            },
+            last_boss=datetime.now()
+        )
 
-                round_embed.add_field(
-                    name=f"👑 {boss['name']}",
-                    value=f"HP: {boss['current_hp']:,}/{boss['hp']:,}\n{hp_bar}",
-                    inline=False
-                )
+        # Thêm vật phẩm vào kho đồ (chỉ người còn sống, mỗi người 1-2 vật phẩm)
+        inventory_cog = self.bot.get_cog('Inventory')
+        if items_gained and inventory_cog:
+            async def give_items(user_id: int):
+                for item in random.sample(items_gained, min(2, len(items_gained))):
+                    await inventory_cog.add_item_to_player(
+                        user_id, item['name'], item['type'], item['rarity'], item['quantity'])
+
+            await asyncio.gather(*(give_items(player['user_id'])
+                                   for player, _, _ in rewarded if player['current_hp'] > 0))
+
+        rewards = [
+            {'player': player, 'member': member, 'exp': player_exp, 'data': updated.get(player['user_id'])}
+            for player, member, player_exp in rewarded
+        ]
+        return rewards, items_gained
+
+    def schedule_boss_playback(self, battle_id: str, battle_msg):
+        """Xếp lịch phát lại trận đánh boss đã tính sẵn: đếm ngược, từng vòng, kết quả"""
+        battle = self.boss_battles[battle_id]
+        fight: BossFightResult = battle['fight']
+        boss = battle['boss']
+        team = battle['team']
+
+        names = [player['name'] for player in team]
+        battle_log = CombatLog(
+            fight.events,
+            lambda event: self.render_strike(event, (names[event.member], boss['name']), is_boss=True)
+        )
+        # Số dòng log tính tới hết mỗi vòng
+        log_counts = list(accumulate(len(round_.events) for round_ in fight.rounds))
+
+        countdown = list(range(BOSS_COUNTDOWN, 0, -1))
+        offsets = [float(i) for i in range(len(countdown))]
+        offsets += [BOSS_COUNTDOWN + i * BOSS_ROUND_INTERVAL for i in range(len(fight.rounds))]
+        offsets.append(BOSS_COUNTDOWN + len(fight.rounds) * BOSS_ROUND_INTERVAL)
+
+        def render(index: int) -> Dict[str, Any]:
+            if index < len(countdown):
+                return {"embed": discord.Embed(
+                    title=f"👑 Trận Chiến Boss: {boss['name']}",
+                    description=f"Trận chiến sẽ bắt đầu trong {countdown[index]} giây...",
+                    color=0xff9900
+                )}
 
-                # Lượt của từng người chơi
-                for player in alive_players:
-                    if player['current_hp'] <= 0:
-                        continue
-
-                    # Player attacks
-                    # Xác định có né tránh không
-                    if random.random() < 0.1:  # 10% cơ hội né tránh
-                        dodge_msg = random.choice(self.combat_messages['enemy_dodge'])
-                        log_entry = dodge_msg.format(
-                            enemy=boss['name'],
-                            player=player['name']
-                        )
-                        battle_log.append(log_entry)
-                    else:
-                        # Xác định có chí mạng không
-                        is_crit = random.random() < 0.15  # 15% cơ hội chí mạng
-
-                        # Chọn kỹ năng ngẫu nhiên
-                        player_skills = self.get_player_skills(player['level'])
-                        skill = random.choice(player_skills)
-
-                        # Tính sát thương
-                        damage_multiplier = 1.5 if is_crit else (0.8 + random.random() * 0.4)
-                        damage = int(player['attack'] * damage_multiplier)
-                        boss['current_hp'] -= damage
-
-                        # Thêm log chiến đấu
-                        if is_crit:
-                            msg = random.choice(self.combat_messages['player_crit'])
-                        else:
-                            msg = random.choice(self.combat_messages['player_attack'])
-
-                        log_entry = msg.format(
-                            player=player['name'],
-                            target=boss['name'],
-                            damage=damage,
-                            skill=skill
-                        )
-                        battle_log.append(log_entry)
-
-                    # Cập nhật thông tin trận đấu
-                    battle['battle_log'] = battle_log
-
-                    # Kiểm tra boss đã bị đánh bại chưa
-                    if boss['current_hp'] <= 0:
-                        break
+            round_index = index - len(countdown)
+            if round_index < len(fight.rounds):
+                return {"embed": self.create_boss_round_embed(
+                    boss, team, fight, round_index, battle_log[:log_counts[round_index]][-5:])}
+            return {"embed": self.create_boss_result_embed(battle)}
 
-                # Lượt của boss nếu còn sống
-                if boss['current_hp'] > 0:
-                    # Boss tấn công ngẫu nhiên một người chơi còn sống
-                    alive_targets = [p for p in alive_players if p['current_hp'] > 0]
-                    if alive_targets:
-                        target = random.choice(alive_targets)
-
-                        # Xác định có né tránh không
-                        if random.random() < 0.08:  # 8% cơ hội né tránh
-                            dodge_msg = random.choice(self.combat_messages['player_dodge'])
-                            log_entry = dodge_msg.format(
-                                player=target['name'],
-                                enemy=boss['name']
-                            )
-                            battle_log.append(log_entry)
-                        else:
-                            # Xác định có chí mạng không
-                            is_crit = random.random() < 0.12  # 12% cơ hội chí mạng
-
-                            # Chọn kỹ năng ngẫu nhiên
-                            skill = random.choice(boss.get('skills', ['Tấn Công Thường']))
-
-                            # Tính sát thương
-                            damage_multiplier = 1.5 if is_crit else (0.8 + random.random() * 0.4)
-                            damage = int(boss['attack'] * damage_multiplier)
-                            target['current_hp'] -= damage
-
-                            # Thêm log chiến đấu
-                            if is_crit:
-                                msg = random.choice(self.combat_messages['boss_crit'])
-                            else:
-                                msg = random.choice(self.combat_messages['boss_attack'])
-
-                            log_entry = msg.format(
-                                boss=boss['name'],
-                                player=target['name'],
-                                damage=damage,
-                                skill=skill
-                            )
-                            battle_log.append(log_entry)
-
-                # Hiển thị thông tin người chơi
-                for player in alive_players:
-                    hp_percent = max(0, player['current_hp']) / player['hp'] * 100
-                    hp_bar = self.create_hp_bar(hp_percent)
-                    status = "🟢 Sống" if player['current_hp'] > 0 else "🔴 Gục"
-
-                    round_embed.add_field(
-                        name=f"{player['name']}",
-                        value=f"HP: {max(0, player['current_hp']):,}/{player['hp']:,}\n{hp_bar}\nTrạng thái: {status}",
-                        inline=True
-                    )
+        async def on_finish():
+            battle['ended'] = True
 
-                # Hiển thị log chiến đấu
-                if battle_log:
-                    recent_log = battle_log[-min(5, len(battle_log)):]  # Lấy 5 dòng gần nhất
-                    round_embed.add_field(
-                        name="⚔️ Diễn Biến Chiến Đấu",
-                        value="\n".join(recent_log),
-                        inline=False
-                    )
+            # Kiểm tra thăng cấp sau khi người chơi đã thấy kết quả
+            cultivation_cog = self.bot.get_cog('Cultivation')
+            if cultivation_cog:
+                await asyncio.gather(*(
+                    cultivation_cog.check_level_up(reward['member'], reward['data']['level'], reward['data']['exp'])
+                    for reward in battle['rewards'] if reward['data']
+                ))
 
-                # Cập nhật thông báo
-                await battle_msg.edit(embed=round_embed)
+        self.battle_scheduler.schedule(battle_msg, offsets, render, on_finish=on_finish)
 
-                # Đợi một chút để người chơi theo dõi
-                await asyncio.sleep(2)
+    def create_boss_round_embed(self, boss: Dict, team: List[Dict], fight: BossFightResult, round_index: int,
+                                recent_log: List[str]) -> discord.Embed:
+        """Tạo embed hiển thị một vòng đánh boss"""
+        round_ = fight.rounds[round_index]
+        round_embed = discord.Embed(
+            title=f"👑 Trận Chiến Boss: {boss['name']} - Vòng {round_.number}",
+            description=f"Trận chiến đang diễn ra khốc liệt!",
+            color=0xff9900
+        )
 
-                # Cập nhật danh sách người chơi còn sống
-                alive_players = [p for p in team if p['current_hp'] > 0]
+        # Thông tin HP boss (đầu vòng)
+        boss_hp = fight.rounds[round_index - 1].boss_hp if round_index > 0 else boss['hp']
+        hp_percent = boss_hp / boss['hp'] * 100
+        hp_bar = self.create_hp_bar(hp_percent)
 
-            # Kết thúc trận đấu
-            battle['ended'] = True
+        round_embed.add_field(
+            name=f"👑 {boss['name']}",
+            value=f"HP: {boss_hp:,}/{boss['hp']:,}\n{hp_bar}",
+            inline=False
+        )
 
-            # Xác định kết quả
-            is_victory = boss['current_hp'] <= 0
+        # Hiển thị thông tin người chơi còn sống đầu vòng (máu sau vòng)
+        hp_before = fight.rounds[round_index - 1].team_hp if round_index > 0 else [p['hp'] for p in team]
+        for player, start_hp, current_hp in zip(team, hp_before, round_.team_hp):
+            if start_hp <= 0:
+                continue
+            hp_percent = max(0, current_hp) / player['hp'] * 100
+            hp_bar = self.create_hp_bar(hp_percent)
+            status = "🟢 Sống" if current_hp > 0 else "🔴 Gục"
+
+            round_embed.add_field(
+                name=f"{player['name']}",
+                value=f"HP: {max(0, current_hp):,}/{player['hp']:,}\n{hp_bar}\nTrạng thái: {status}",
+                inline=True
+            )
 
-            # Tạo embed kết quả
-            result_embed = discord.Embed(
-                title=f"👑 Kết Thúc Trận Chiến: {boss['name']}",
-                description="Trận chiến đã kết thúc!",
-                color=0x00ff00 if is_victory else 0xff0000,
-                timestamp=datetime.now()
+        # Hiển thị log chiến đấu
+        if recent_log:
+            round_embed.add_field(
+                name="⚔️ Diễn Biến Chiến Đấu",
+                value="\n".join(recent_log),
+                inline=False
             )
 
-            if is_victory:
-                # Tính exp và phần thưởng
-                base_exp = BOSS_EXP * (3 if boss['is_elite'] else 1)
-                alive_count = len([p for p in team if p['current_hp'] > 0])
+        return round_embed
 
-                # Quay vật phẩm
-                items_gained = await self.roll_for_items("boss", boss['is_elite'])
+    def create_boss_result_embed(self, battle: Dict) -> discord.Embed:
+        """Tạo embed kết quả trận đánh boss"""
+        boss = battle['boss']
+        team = battle['team']
+        is_victory = battle['fight'].is_victory
 
-                # Phân phối phần thưởng
-                result_embed.add_field(
-                    name="🎉 Chiến Thắng!",
-                    value=f"Đội đã đánh bại {boss['name']}!",
-                    inline=False
-                )
+        result_embed = discord.Embed(
+            title=f"👑 Kết Thúc Trận Chiến: {boss['name']}",
+            description="Trận chiến đã kết thúc!",
+            color=0x00ff00 if is_victory else 0xff0000,
+            timestamp=datetime.now()
+        )
 
-                # Hiển thị phần thưởng cho từng người chơi
-                for player in team:
-                    member = ctx.guild.get_member(player['user_id'])
-                    if not member:
-                        continue
-
-                    # Tính exp cho người chơi này
-                    player_exp = base_exp // len(team)
-                    if player['current_hp'] <= 0:
-                        player_exp = player_exp // 2  # Người chơi bị gục nhận một nửa exp
-
-                    # Cập nhật exp và thống kê
-                    player_data = await self.db.get_player(player['user_id'])
-                    if player_data:
-                        new_exp = player_data['exp'] + player_exp
-
-                        stats = player_data.get('stats', {})
-                        bosses_killed = stats.get('bosses_killed', 0) + 1
-                        elite_bosses_killed = stats.get('elite_bosses_killed', 0) + (1 if boss['is_elite'] else 0)
-
-                        # Cập nhật người chơi
-                        await self.db.update_player(
-                            player['user_id'],
-                            exp=new_exp,
-                            last_boss=datetime.now(),
-                            stats__bosses_killed=bosses_killed,
-                            stats__elite_bosses_killed=elite_bosses_killed
-                        )
-
-                        # Kiểm tra level up
-                        cultivation_cog = self.bot.get_cog('Cultivation')
-                        if cultivation_cog:
-                            await cultivation_cog.check_level_up(member, player_data['level'], new_exp)
+        if is_victory:
+            result_embed.add_field(
+                name="🎉 Chiến Thắng!",
+                value=f"Đội đã đánh bại {boss['name']}!",
+                inline=False
+            )
 
-                    # Thêm vật phẩm vào kho đồ người chơi
-                    if items_gained and player['current_hp'] > 0:  # Chỉ người còn sống nhận vật phẩm
-                        inventory_cog = self.bot.get_cog('Inventory')
-                        if inventory_cog:
-                            # Mỗi người nhận ngẫu nhiên 1-2 vật phẩm
-                            player_items = random.sample(items_gained, min(2, len(items_gained)))
-                            for item in player_items:
-                                await inventory_cog.add_item_to_player(
-                                    player['user_id'],
-                                    item['name'],
-                                    item['type'],
-                                    item['rarity'],
-                                    item['quantity']
-                                )
+            # Hiển thị phần thưởng cho từng người chơi
+            for reward in battle['rewards']:
+                player = reward['player']
+                status = "🟢 Sống" if player['current_hp'] > 0 else "🔴 Gục"
+                result_embed.add_field(
+                    name=f"{player['name']} ({status})",
+                    value=f"• EXP: +{reward['exp']:,}\n• HP còn lại: {max(0, player['current_hp']):,}/{player['hp']:,}",
+                    inline=True
+                )
 
-                    # Hiển thị phần thưởng
-                    status = "🟢 Sống" if player['current_hp'] > 0 else "🔴 Gục"
-                    result_embed.add_field(
-                        name=f"{player['name']} ({status})",
-                        value=f"• EXP: +{player_exp:,}\n• HP còn lại: {max(0, player['current_hp']):,}/{player['hp']:,}",
-                        inline=True
-                    )
+            # Hiển thị vật phẩm nhận được
+            items_gained = battle['items']
+            if items_gained:
+                items_text = []
+                for item in items_gained:
+                    rarity_emoji = "⚪" if item["rarity"] == "Phổ Thông" else "🔵" if item[
+                                                                                        "rarity"] == "Hiếm" else "🟣" if \
+                    item["rarity"] == "Quý" else "🟠"
+                    items_text.append(f"{rarity_emoji} {item['name']} x{item['quantity']}")
 
-                # Hiển thị vật phẩm nhận được
-                if items_gained:
-                    items_text = []
-                    for item in items_gained:
-                        rarity_emoji = "⚪" if item["rarity"] == "Phổ Thông" else "🔵" if item[
-                                                                                            "rarity"] == "Hiếm" else "🟣" if \
-                        item["rarity"] == "Quý" else "🟠"
-                        items_text.append(f"{rarity_emoji} {item['name']} x{item['quantity']}")
-
-                    result_embed.add_field(
-                        name="💎 Vật Phẩm Nhận Được",
-                        value="\n".join(items_text),
-                        inline=False
-                    )
-            else:
-                # Thất bại
                 result_embed.add_field(
-                    name="💀 Thất Bại!",
-                    value=f"Đội đã thất bại trước {boss['name']}!",
+                    name="💎 Vật Phẩm Nhận Được",
+                    value="\n".join(items_text),
                     inline=False
                 )
+        else:
+            # Thất bại
+            result_embed.add_field(
+                name="💀 Thất Bại!",
+                value=f"Đội đã thất bại trước {boss['name']}!",
+                inline=False
+            )
 
-                # Hiển thị thông tin người chơi
-                for player in team:
-                    status = "🟢 Sống" if player['current_hp'] > 0 else "🔴 Gục"
-                    result_embed.add_field(
-                        name=f"{player['name']} ({status})",
-                        value=f"• HP còn lại: {max(0, player['current_hp']):,}/{player['hp']:,}",
-                        inline=True
-                    )
-
-                # Thêm gợi ý
+            # Hiển thị thông tin người chơi
+            for player in team:
+                status = "🟢 Sống" if player['current_hp'] > 0 else "🔴 Gục"
                 result_embed.add_field(
-                    name="💡 Gợi Ý",
-                    value=(
-                        "• Tăng cảnh giới để có sức mạnh lớn hơn\n"
-                        "• Sử dụng đan dược để tăng sức mạnh tạm thời\n"
-                        "• Nâng cấp trang bị để tăng chỉ số chiến đấu\n"
-                        "• Rủ thêm đồng đội mạnh hơn"
-                    ),
-                    inline=False
+                    name=f"{player['name']} ({status})",
+                    value=f"• HP còn lại: {max(0, player['current_hp']):,}/{player['hp']:,}",
+                    inline=True
                 )
 
-            # Cập nhật thông báo kết quả
-            await battle_msg.edit(embed=result_embed)
+            # Thêm gợi ý
+            result_embed.add_field(
+                name="💡 Gợi Ý",
+                value=(
+                    "• Tăng cảnh giới để có sức mạnh lớn hơn\n"
+                    "• Sử dụng đan dược để tăng sức mạnh tạm thời\n"
+                    "• Nâng cấp trang bị để tăng chỉ số chiến đấu\n"
+                    "• Rủ thêm đồng đội mạnh hơn"
+                ),
+                inline=False
+            )
 
-        except Exception as e:
-            print(f"Lỗi khi mô phỏng trận đấu boss: {e}")
-            await ctx.send("Có lỗi xảy ra trong quá trình chiến đấu với boss!")
+        return result_embed
 
     def create_hp_bar(self, percent: float, length: int = 10) -> str:
         """Tạo thanh HP trực quan"""
@@ -1,6 +1,8 @@
 import discord
 from discord.ext import commands
 from config import SECTS
+from database.locks import LockRegistry
+from modules.levels import level_table
 import asyncio
 import random
 from datetime import datetime, timedelta
@@ -103,11 +105,8 @@ class SectSelect(discord.ui.Select):
             user_id = interaction.user.id
             selected_sect = self.values[0]
 
-            # Lấy hoặc tạo lock cho người chơi
-            if user_id not in self.cog.sect_locks:
-                self.cog.sect_locks[user_id] = asyncio.Lock()
-
-            async with self.cog.sect_locks[user_id]:
+            # Giữ lock của người chơi
+            async with self.cog.sect_locks.hold(user_id):
                 # Kiểm tra người chơi
                 existing_player = await self.cog.db.get_player(user_id)
 
@@ -123,12 +122,9 @@ class SectSelect(discord.ui.Select):
                     # Kiểm tra thời gian đổi môn phái
                     sect_joined_at = existing_player.get('sect_joined_at')
                     if sect_joined_at:
-                        # Chuyển đổi từ string sang datetime nếu cần
+                        # Dữ liệu đã là datetime; chuỗi còn sót lại là dữ liệu cũ không hợp lệ
                         if isinstance(sect_joined_at, str):
-                            try:
-                                sect_joined_at = datetime.strptime(sect_joined_at, '%Y-%m-%d %H:%M:%S')
-                            except ValueError:
-                                sect_joined_at = datetime.now() - timedelta(days=8)  # Mặc định nếu không parse được
+                            sect_joined_at = datetime.now() - timedelta(days=8)  # Mặc định nếu không parse được
 
                         # Kiểm tra thời gian
                         time_since_join = datetime.now() - sect_joined_at
@@ -362,7 +358,7 @@ class Sect(commands.Cog):
         self.bot = bot
         self.db = db
         self.setup_lock = asyncio.Lock()
-        self.sect_locks = {}  # Lock cho mỗi người chơi
+        self.sect_locks = LockRegistry("sect")  # Lock cho mỗi người chơi
         self.sect_stats_cache = {}  # Cache thống kê môn phái
         self.cache_timeout = 300  # 5 phút
 
@@ -382,26 +378,8 @@ class Sect(commands.Cog):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
             try:
-                # Cập nhật thống kê cho tất cả môn phái
-                all_players = await self.db.get_all_players()
-
-                for sect_name in SECTS:
-                    sect_members = [p for p in all_players if p.get('sect') == sect_name]
-                    total_exp = sum(member.get('exp', 0) for member in sect_members)
-
-                    # Tính các chỉ số khác
-                    avg_exp = total_exp // len(sect_members) if sect_members else 0
-                    highest_level_member = max(sect_members, key=lambda x: x.get('exp', 0)) if sect_members else None
-                    highest_exp = highest_level_member.get('exp', 0) if highest_level_member else 0
-
-                    # Lưu vào cache
-                    self.sect_stats_cache[sect_name] = {
-                        "members_count": len(sect_members),
-                        "total_exp": total_exp,
-                        "avg_exp": avg_exp,
-                        "highest_exp": highest_exp,
-                        "updated_at": datetime.now()
-                    }
+                # Cập nhật thống kê cho tất cả môn phái (một lần aggregate)
+                await self.get_sect_stats(refresh=True)
 
             except Exception as e:
                 print(f"Error updating sect stats: {e}")
@@ -409,6 +387,50 @@ class Sect(commands.Cog):
             # Cập nhật mỗi 5 phút
             await asyncio.sleep(300)
 
+    @staticmethod
+    def empty_sect_stats() -> Dict[str, Any]:
+        """Thống kê rỗng cho môn phái chưa có thành viên"""
+        return {
+            "members": 0,
+            "total_exp": 0,
+            "avg_exp": 0,
+            "highest_exp": 0,
+            "total_daily_streak": 0,
+            "level_distribution": {},
+            "stats": {
+                "monsters_killed": 0,
+                "bosses_killed": 0,
+                "pvp_wins": 0,
+                "pvp_losses": 0,
+                "total_exp_gained": 0
+            }
+        }
+
+    async def get_sect_stats(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Lấy thống kê tất cả môn phái (dùng cache, tính bằng aggregation của database)"""
+        cached = self.sect_stats_cache
+        if not refresh and cached and (
+                datetime.now() - cached["updated_at"]).total_seconds() < self.cache_timeout:
+            return cached["sects"]
+
+        aggregated = await self.db.get_sect_stats()
+        sects = {name: aggregated.get(name, self.empty_sect_stats()) for name in SECTS}
+
+        self.sect_stats_cache = {"sects": sects, "updated_at": datetime.now()}
+        return sects
+
+    def get_highest_level(self, level_distribution: Dict[str, int]) -> Optional[str]:
+        """Tìm cảnh giới cao nhất trong phân bố cảnh giới"""
+        known_levels = [level for level in level_distribution if level in level_table]
+        return max(known_levels, key=level_table.index) if known_levels else None
+
+    def sort_level_distribution(self, level_distribution: Dict[str, int]) -> List[Tuple[str, int]]:
+        """Sắp xếp phân bố cảnh giới theo thứ tự cảnh giới"""
+        return sorted(
+            level_distribution.items(),
+            key=lambda x: level_table.index(x[0], -1)
+        )
+
     @commands.command()
     @commands.has_permissions(administrator=True)
     async def setupsects(self, ctx, channel_name: str = None):
@@ -875,29 +897,9 @@ class Sect(commands.Cog):
 
     async def create_sect_overview_embed(self, sect_name: str) -> discord.Embed:
         """Tạo embed tổng quan về môn phái"""
-        # Lấy thống kê môn phái từ cache hoặc tính toán mới
-        if sect_name in self.sect_stats_cache and (
-                datetime.now() - self.sect_stats_cache[sect_name]["updated_at"]).seconds < self.cache_timeout:
-            sect_stats = self.sect_stats_cache[sect_name]
-        else:
-            # Tính toán thống kê mới
-            all_players = await self.db.get_all_players()
-            sect_members = [p for p in all_players if p.get('sect') == sect_name]
-            total_exp = sum(member.get('exp', 0) for member in sect_members)
-            avg_exp = total_exp // len(sect_members) if sect_members else 0
-            highest_level_member = max(sect_members, key=lambda x: x.get('exp', 0)) if sect_members else None
-            highest_exp = highest_level_member.get('exp', 0) if highest_level_member else 0
-
-            sect_stats = {
-                "members_count": len(sect_members),
-                "total_exp": total_exp,
-                "avg_exp": avg_exp,
-                "highest_exp": highest_exp,
-                "updated_at": datetime.now()
-            }
-
-            # Lưu vào cache
-            self.sect_stats_cache[sect_name] = sect_stats
+        # Lấy thống kê môn phái từ cache hoặc aggregation mới
+        all_stats = await self.get_sect_stats()
+        sect_stats = all_stats.get(sect_name, self.empty_sect_stats())
 
         # Lấy thông tin môn phái
         sect_info = SECTS.get(sect_name, {})
@@ -931,7 +933,7 @@ class Sect(commands.Cog):
         embed.add_field(
             name="📊 Thống Kê",
             value=(
-                f"👥 Số thành viên: {sect_stats['members_count']}\n"
+                f"👥 Số thành viên: {sect_stats['members']}\n"
                 f"📈 Tổng tu vi: {sect_stats['total_exp']:,} EXP\n"
                 f"⚡ Trung bình: {sect_stats['avg_exp']:,} EXP/người\n"
                 f"🔝 Tu vi cao nhất: {sect_stats['highest_exp']:,} EXP"
@@ -972,39 +974,20 @@ class Sect(commands.Cog):
 
     async def create_sect_members_embed(self, sect_name: str) -> discord.Embed:
         """Tạo embed thông tin thành viên của môn phái"""
-        # Lấy danh sách thành viên
-        all_players = await self.db.get_all_players()
-        sect_members = [p for p in all_players if p.get('sect') == sect_name]
-
-        # Sắp xếp theo exp
-        sorted_members = sorted(sect_members, key=lambda x: x.get('exp', 0), reverse=True)
+        # Lấy thống kê môn phái (số thành viên, phân bố cảnh giới) bằng aggregation
+        all_stats = await self.get_sect_stats()
+        sect_stats = all_stats.get(sect_name, self.empty_sect_stats())
 
         # Tạo embed
         embed = discord.Embed(
             title=f"{SECT_EMOJIS.get(sect_name, '🏯')} {sect_name} - Thành Viên",
-            description=f"Danh sách {len(sorted_members)} thành viên của {sect_name}",
+            description=f"Danh sách {sect_stats['members']} thành viên của {sect_name}",
             color=SECT_COLORS.get(sect_name, 0x7289da),
             timestamp=datetime.now()
         )
 
         # Thêm thông tin về phân bố cảnh giới
-        level_distribution = {}
-        for member in sect_members:
-            level = member.get('level', 'Phàm Nhân')
-            if level not in level_distribution:
-                level_distribution[level] = 0
-            level_distribution[level] += 1
-
-        # Sắp xếp cảnh giới theo thứ tự
-        cultivation_cog = self.bot.get_cog('Cultivation')
-        if cultivation_cog and hasattr(cultivation_cog, 'CULTIVATION_RANKS'):
-            sorted_levels = sorted(
-                level_distribution.items(),
-                key=lambda x: cultivation_cog.CULTIVATION_RANKS.index(x[0]) if x[
-                                                                                   0] in cultivation_cog.CULTIVATION_RANKS else -1
-            )
-        else:
-            sorted_levels = sorted(level_distribution.items())
+        sorted_levels = self.sort_level_distribution(sect_stats['level_distribution'])
 
         level_info = []
         for level, count in sorted_levels:
@@ -1017,8 +1000,8 @@ class Sect(commands.Cog):
                 inline=False
             )
 
-        # Thêm danh sách top thành viên
-        top_members = sorted_members[:10]  # Lấy top 10
+        # Thêm danh sách top thành viên (dùng index (sect, exp))
+        top_members = await self.db.get_sect_ranking(sect_name, 10)
 
         if top_members:
             top_text = []
@@ -1037,7 +1020,14 @@ class Sect(commands.Cog):
             )
 
         # Thêm thông tin về thời gian gia nhập
-        recent_members = sorted(sect_members, key=lambda x: x.get('sect_joined_at', datetime.min), reverse=True)[:5]
+        recent_members = [
+            member async for member in self.db.iter_players(
+                {"sect": sect_name},
+                projection=["user_id", "sect_joined_at"],
+                sort=[("sect_joined_at", -1)],
+                limit=5
+            )
+        ]
 
         if recent_members:
             recent_text = []
@@ -1048,10 +1038,7 @@ class Sect(commands.Cog):
 
                 joined_at = member.get('sect_joined_at')
                 if isinstance(joined_at, str):
-                    try:
-                        joined_at = datetime.strptime(joined_at, '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        joined_at = None
+                    joined_at = None
 
                 joined_str = joined_at.strftime('%d/%m/%Y') if joined_at else "Không rõ"
                 recent_text.append(f"• {username} - {joined_str}")
@@ -1066,9 +1053,10 @@ class Sect(commands.Cog):
 
     async def create_sect_activities_embed(self, sect_name: str) -> discord.Embed:
         """Tạo embed thông tin hoạt động của môn phái"""
-        # Lấy danh sách thành viên
-        all_players = await self.db.get_all_players()
-        sect_members = [p for p in all_players if p.get('sect') == sect_name]
+        # Lấy thống kê môn phái bằng aggregation
+        all_stats = await self.get_sect_stats()
+        sect_stats = all_stats.get(sect_name, self.empty_sect_stats())
+        member_stats = sect_stats['stats']
 
         # Tạo embed
         embed = discord.Embed(
@@ -1079,8 +1067,8 @@ class Sect(commands.Cog):
         )
 
         # Thống kê hoạt động săn quái
-        total_monsters = sum(member.get('stats', {}).get('monsters_killed', 0) for member in sect_members)
-        total_bosses = sum(member.get('stats', {}).get('bosses_killed', 0) for member in sect_members)
+        total_monsters = member_stats['monsters_killed']
+        total_bosses = member_stats['bosses_killed']
 
         embed.add_field(
             name="⚔️ Săn Quái & Boss",
@@ -1093,8 +1081,8 @@ class Sect(commands.Cog):
         )
 
         # Thống kê PvP
-        total_pvp_wins = sum(member.get('stats', {}).get('pvp_wins', 0) for member in sect_members)
-        total_pvp_losses = sum(member.get('stats', {}).get('pvp_losses', 0) for member in sect_members)
+        total_pvp_wins = member_stats['pvp_wins']
+        total_pvp_losses = member_stats['pvp_losses']
         total_pvp = total_pvp_wins + total_pvp_losses
 
         embed.add_field(
@@ -1108,8 +1096,8 @@ class Sect(commands.Cog):
         )
 
         # Thống kê điểm danh
-        total_daily_streak = sum(member.get('daily_streak', 0) for member in sect_members)
-        avg_daily_streak = total_daily_streak / len(sect_members) if sect_members else 0
+        total_daily_streak = sect_stats['total_daily_streak']
+        avg_daily_streak = total_daily_streak / sect_stats['members'] if sect_stats['members'] else 0
 
         embed.add_field(
             name="📅 Điểm Danh",
@@ -1149,28 +1137,18 @@ class Sect(commands.Cog):
 
     async def create_sect_rankings_embed(self, sect_name: str) -> discord.Embed:
         """Tạo embed thông tin xếp hạng của môn phái"""
-        # Lấy thống kê tất cả môn phái
-        all_players = await self.db.get_all_players()
+        # Lấy thống kê tất cả môn phái (một lần aggregate)
+        all_stats = await self.get_sect_stats()
 
-        # Tính toán thống kê cho từng môn phái
         sect_stats = {}
-        for name in SECTS:
-            sect_members = [p for p in all_players if p.get('sect') == name]
-            total_exp = sum(member.get('exp', 0) for member in sect_members)
-            avg_exp = total_exp // len(sect_members) if sect_members else 0
-
-            # Tính các chỉ số khác
-            total_monsters = sum(member.get('stats', {}).get('monsters_killed', 0) for member in sect_members)
-            total_bosses = sum(member.get('stats', {}).get('bosses_killed', 0) for member in sect_members)
-            total_pvp_wins = sum(member.get('stats', {}).get('pvp_wins', 0) for member in sect_members)
-
+        for name, stats in all_stats.items():
             sect_stats[name] = {
-                "members": len(sect_members),
-                "total_exp": total_exp,
-                "avg_exp": avg_exp,
-                "monsters": total_monsters,
-                "bosses": total_bosses,
-                "pvp_wins": total_pvp_wins
+                "members": stats["members"],
+                "total_exp": stats["total_exp"],
+                "avg_exp": stats["avg_exp"],
+                "monsters": stats["stats"]["monsters_killed"],
+                "bosses": stats["stats"]["bosses_killed"],
+                "pvp_wins": stats["stats"]["pvp_wins"]
             }
 
         # Tạo embed
@@ -1268,47 +1246,17 @@ class Sect(commands.Cog):
                 timestamp=datetime.now()
             )
 
-            # Lấy tất cả người chơi
-            all_players = await self.db.get_all_players()
+            # Thống kê theo môn phái (một lần aggregate)
+            all_stats = await self.get_sect_stats()
 
-            # Thống kê theo môn phái
             sect_stats = {}
-            for sect_name in SECTS:
-                sect_members = [p for p in all_players if p.get('sect') == sect_name]
-                total_exp = sum(member.get('exp', 0) for member in sect_members)
-
-                # Tính các chỉ số khác
-                highest_level_member = max(sect_members, key=lambda x: x.get('exp', 0)) if sect_members else None
-                highest_exp = highest_level_member.get('exp', 0) if highest_level_member else 0
-
-                # Tính phân bố cảnh giới
-                level_counts = {}
-                for member in sect_members:
-                    level = member.get('level', 'Phàm Nhân')
-                    if level not in level_counts:
-                        level_counts[level] = 0
-                    level_counts[level] += 1
-
-                # Tìm cảnh giới cao nhất
-                highest_level = None
-                if level_counts:
-                    # Sắp xếp cảnh giới theo thứ tự
-                    cultivation_cog = self.bot.get_cog('Cultivation')
-                    if cultivation_cog and hasattr(cultivation_cog, 'CULTIVATION_RANKS'):
-                        sorted_levels = sorted(
-                            level_counts.items(),
-                            key=lambda x: cultivation_cog.CULTIVATION_RANKS.index(x[0]) if x[
-                                                                                               0] in cultivation_cog.CULTIVATION_RANKS else -1,
-                            reverse=True
-                        )
-                        highest_level = sorted_levels[0][0] if sorted_levels else None
-
+            for sect_name, stats in all_stats.items():
                 sect_stats[sect_name] = {
-                    "members": len(sect_members),
-                    "total_exp": total_exp,
-                    "avg_exp": total_exp // len(sect_members) if sect_members else 0,
-                    "highest_exp": highest_exp,
-                    "highest_level": highest_level
+                    "members": stats["members"],
+                    "total_exp": stats["total_exp"],
+                    "avg_exp": stats["avg_exp"],
+                    "highest_exp": stats["highest_exp"],
+                    "highest_level": self.get_highest_level(stats["level_distribution"])
                 }
 
             # Sắp xếp theo tổng exp
@@ -1385,33 +1333,31 @@ class Sect(commands.Cog):
                 await ctx.send(f"Không tìm thấy môn phái nào có tên '{sect_name}'!")
                 return
 
-            # Lấy danh sách thành viên
-            all_players = await self.db.get_all_players()
-            sect_members = [p for p in all_players if p.get('sect') == target_sect]
-
-            # Sắp xếp theo exp
-            sorted_members = sorted(sect_members, key=lambda x: x.get('exp', 0), reverse=True)
+            # Lấy thống kê môn phái bằng aggregation
+            all_stats = await self.get_sect_stats()
+            sect_stats = all_stats.get(target_sect, self.empty_sect_stats())
+            members_count = sect_stats['members']
 
             # Tạo embed
             embed = discord.Embed(
                 title=f"{SECT_EMOJIS.get(target_sect, '🏯')} Thành Viên {target_sect}",
-                description=f"Danh sách {len(sorted_members)} thành viên của {target_sect}",
+                description=f"Danh sách {members_count} thành viên của {target_sect}",
                 color=SECT_COLORS.get(target_sect, 0x7289da),
                 timestamp=datetime.now()
             )
 
             # Chia thành các trang nếu có quá nhiều thành viên
             members_per_page = 10
-            total_pages = math.ceil(len(sorted_members) / members_per_page)
+            total_pages = math.ceil(members_count / members_per_page)
 
-            # Hiển thị trang đầu tiên
+            # Hiển thị trang đầu tiên (chỉ lấy đúng số thành viên cần hiển thị)
             page = 1
             start_idx = (page - 1) * members_per_page
-            end_idx = min(start_idx + members_per_page, len(sorted_members))
+            page_members = await self.db.get_sect_ranking(target_sect, start_idx + members_per_page)
 
             # Hiển thị danh sách thành viên
             members_list = []
-            for i, member in enumerate(sorted_members[start_idx:end_idx], start_idx + 1):
+            for i, member in enumerate(page_members[start_idx:], start_idx + 1):
                 user_id = member.get('user_id')
                 user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
                 username = user.display_name if user else f"ID: {user_id}"
@@ -1426,23 +1372,7 @@ class Sect(commands.Cog):
             )
 
             # Thêm thông tin về phân bố cảnh giới
-            level_distribution = {}
-            for member in sect_members:
-                level = member.get('level', 'Phàm Nhân')
-                if level not in level_distribution:
-                    level_distribution[level] = 0
-                level_distribution[level] += 1
-
-            # Sắp xếp cảnh giới theo thứ tự
-            cultivation_cog = self.bot.get_cog('Cultivation')
-            if cultivation_cog and hasattr(cultivation_cog, 'CULTIVATION_RANKS'):
-                sorted_levels = sorted(
-                    level_distribution.items(),
-                    key=lambda x: cultivation_cog.CULTIVATION_RANKS.index(x[0]) if x[
-                                                                                       0] in cultivation_cog.CULTIVATION_RANKS else -1
-                )
-            else:
-                sorted_levels = sorted(level_distribution.items())
+            sorted_levels = self.sort_level_distribution(sect_stats['level_distribution'])
 
             level_info = []
             for level, count in sorted_levels:
@@ -1473,28 +1403,18 @@ class Sect(commands.Cog):
             # Hiển thị thông báo đang tải
             loading_msg = await ctx.send("⏳ Đang tải bảng xếp hạng môn phái...")
 
-            # Lấy tất cả người chơi
-            all_players = await self.db.get_all_players()
+            # Thống kê theo môn phái (một lần aggregate)
+            all_stats = await self.get_sect_stats()
 
-            # Tính toán thống kê cho từng môn phái
             sect_stats = {}
-            for sect_name in SECTS:
-                sect_members = [p for p in all_players if p.get('sect') == sect_name]
-                total_exp = sum(member.get('exp', 0) for member in sect_members)
-                avg_exp = total_exp // len(sect_members) if sect_members else 0
-
-                # Tính các chỉ số khác
-                total_monsters = sum(member.get('stats', {}).get('monsters_killed', 0) for member in sect_members)
-                total_bosses = sum(member.get('stats', {}).get('bosses_killed', 0) for member in sect_members)
-                total_pvp_wins = sum(member.get('stats', {}).get('pvp_wins', 0) for member in sect_members)
-
+            for sect_name, stats in all_stats.items():
                 sect_stats[sect_name] = {
-                    "members": len(sect_members),
-                    "total_exp": total_exp,
-                    "avg_exp": avg_exp,
-                    "monsters": total_monsters,
-                    "bosses": total_bosses,
-                    "pvp_wins": total_pvp_wins
+                    "members": stats["members"],
+                    "total_exp": stats["total_exp"],
+                    "avg_exp": stats["avg_exp"],
+                    "monsters": stats["stats"]["monsters_killed"],
+                    "bosses": stats["stats"]["bosses_killed"],
+                    "pvp_wins": stats["stats"]["pvp_wins"]
                 }
 
             # Tạo embed
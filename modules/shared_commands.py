@@ -21,12 +21,9 @@ async def handle_daily_command(ctx, db):
         last_daily = player.get('last_daily')
         now = datetime.now()
 
-        # Chuyển đổi từ string sang datetime nếu cần
+        # Dữ liệu đã là datetime; chuỗi còn sót lại là dữ liệu cũ không hợp lệ
         if isinstance(last_daily, str):
-            try:
-                last_daily = datetime.strptime(last_daily, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                last_daily = None
+            last_daily = None
 
         # Kiểm tra xem đã điểm danh hôm nay chưa
         if last_daily and (now - last_daily).total_seconds() < 86400:  # 24 giờ = 86400 giây
@@ -59,13 +56,13 @@ async def handle_daily_command(ctx, db):
         total_exp = base_exp + bonus_exp
 
         # Cập nhật thông tin người chơi
-        new_exp = player.get('exp', 0) + total_exp
-        await db.update_player(
+        updated = await db.increment_exp(
             ctx.author.id,
-            exp=new_exp,
+            total_exp,
             last_daily=now,
             daily_streak=streak
         )
+        new_exp = updated['exp'] if updated else player.get('exp', 0) + total_exp
 
         # Tạo embed thông báo
         embed = discord.Embed(
@@ -4,6 +4,8 @@ from typing import Union, Optional, Dict, Any, List, Tuple, Callable
 import re
 import math
 import random
+from bisect import bisect_right
+from itertools import accumulate
 from bson import ObjectId
 import json
 import unicodedata
@@ -196,6 +198,16 @@ class ExpFormatter:
 class MongoUtils:
     """Các phương thức tiện ích cho MongoDB"""
 
+    # Phiên bản lược đồ lưu trữ: 1 = thời gian lưu dạng chuỗi, 2 = BSON datetime gốc
+    SCHEMA_VERSION = 2
+    LEGACY_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    # Các trường thời gian có thể còn ở dạng chuỗi trong dữ liệu cũ (schema 1)
+    DATETIME_FIELDS = (
+        "last_train", "last_monster", "last_boss", "last_daily", "last_combat",
+        "created_at", "updated_at", "joined_at", "sect_joined_at", "timestamp"
+    )
+
     @staticmethod
     def convert_id(id_: Union[str, ObjectId]) -> ObjectId:
         """Chuyển đổi ID dạng chuỗi thành ObjectId"""
@@ -205,12 +217,10 @@ class MongoUtils:
 
     @staticmethod
     def prepare_for_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
-        """Chuẩn bị dữ liệu để lưu vào MongoDB"""
+        """Chuẩn bị dữ liệu để lưu vào MongoDB (datetime được giữ nguyên dạng BSON)"""
         cleaned = {}
         for key, value in data.items():
-            if isinstance(value, datetime):
-                cleaned[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-            elif isinstance(value, ObjectId):
+            if isinstance(value, ObjectId):
                 cleaned[key] = str(value)
             elif isinstance(value, dict):
                 cleaned[key] = MongoUtils.prepare_for_mongo(value)
@@ -230,29 +240,31 @@ class MongoUtils:
         """Phiên bản bất đồng bộ của prepare_for_mongo"""
         return MongoUtils.prepare_for_mongo(data)
 
+    @staticmethod
+    def parse_legacy_datetime(value: Any) -> Any:
+        """Chuyển chuỗi thời gian kiểu cũ thành datetime, giữ nguyên nếu không phải chuỗi hợp lệ"""
+        if isinstance(value, str):
+            try:
+                return datetime.strptime(value, MongoUtils.LEGACY_DATETIME_FORMAT)
+            except ValueError:
+                return value
+        return value
+
     @staticmethod
     def prepare_from_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
-        """Chuyển đổi dữ liệu từ MongoDB thành dạng Python thích hợp"""
-        converted = {}
-        for key, value in data.items():
-            if isinstance(value, str) and re.match(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', value):
-                try:
-                    converted[key] = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-                    continue
-                except ValueError:
-                    pass
-            if isinstance(value, dict):
-                converted[key] = MongoUtils.prepare_from_mongo(value)
-            elif isinstance(value, list):
-                converted[key] = [
-                    MongoUtils.prepare_from_mongo(item)
-                    if isinstance(item, dict)
-                    else item
-                    for item in value
-                ]
-            else:
-                converted[key] = value
-        return converted
+        """Chuyển đổi dữ liệu từ MongoDB thành dạng Python thích hợp
+
+        Dữ liệu schema mới đã có datetime gốc nên trả về ngay; dữ liệu cũ chỉ
+        chuyển các trường thời gian đã biết, không quét regex mọi chuỗi.
+        """
+        if data.get("schema_version", 1) >= MongoUtils.SCHEMA_VERSION:
+            return data
+
+        for field in MongoUtils.DATETIME_FIELDS:
+            value = data.get(field)
+            if isinstance(value, str):
+                data[field] = MongoUtils.parse_legacy_datetime(value)
+        return data
 
     @staticmethod
     async def prepare_from_mongo_async(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -399,17 +411,10 @@ class RandomUtils:
         if len(choices) != len(weights):
             raise ValueError("Số lượng lựa chọn và trọng số phải bằng nhau")
 
-        total = sum(weights)
-        r = random.uniform(0, total)
-        upto = 0
-
-        for i, w in enumerate(weights):
-            upto += w
-            if upto >= r:
-                return choices[i]
-
-        # Fallback nếu có lỗi làm tròn
-        return choices[-1]
+        # Tìm kiếm nhị phân trên trọng số cộng dồn
+        cumulative = list(accumulate(weights))
+        r = random.random() * cumulative[-1]
+        return choices[min(bisect_right(cumulative, r), len(choices) - 1)]
 
     @staticmethod
     async def weighted_choice_async(choices: List[Any], weights: List[float]) -> Any:
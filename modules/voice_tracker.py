@@ -0,0 +1,237 @@
+# modules/voice_tracker.py
+import asyncio
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from database.storage import PartialWriteError
+from config import VOICE_EXP, VOICE_TICK_INTERVAL
+
+
+class VoiceSession:
+    """Phiên tu luyện voice của một người chơi"""
+    __slots__ = ("member", "started_at", "credited_at", "earned")
+
+    def __init__(self, member, now: float):
+        self.member = member
+        self.started_at = now
+        self.credited_at = now  # Mốc thời gian đã được tính exp đến
+        self.earned = 0  # Exp đã cộng qua các tick
+
+
+class VoiceTracker:
+    """Theo dõi người chơi trong voice dựa trên sự kiện on_voice_state_update
+
+    Chỉ giữ trong bộ nhớ tập người chơi đủ điều kiện (không AFK, không tự tắt
+    loa), mỗi tick cộng exp cho cả tập bằng một lần bulk_write duy nhất thay
+    vì quét toàn bộ kênh voice của mọi server.
+    """
+
+    def __init__(self, bot, db, interval: float = VOICE_TICK_INTERVAL, exp_per_minute: int = VOICE_EXP):
+        self.bot = bot
+        self.db = db
+        self.interval = interval
+        self.exp_per_minute = exp_per_minute
+
+        self.sessions: Dict[int, VoiceSession] = {}  # user_id -> phiên voice
+        self.on_flush: Optional[Callable[[List[Dict[str, Any]], Dict[int, Any]], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._ticking = False  # Vòng lặp đã qua bước chờ bot sẵn sàng và nạp phiên
+
+        # Thống kê
+        self.total_ticks = 0
+        self.last_tick_ms = 0.0
+        self.last_batch_size = 0
+        self.max_tick_ms = 0.0
+
+    @staticmethod
+    def is_eligible(member, state) -> bool:
+        """Người chơi có đủ điều kiện nhận exp voice với trạng thái này không"""
+        return (
+            state is not None
+            and state.channel is not None
+            and not member.bot
+            and not state.afk
+            and not state.self_deaf
+        )
+
+    def start(self):
+        """Khởi động task cộng exp định kỳ"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._ticking = False
+            self._wake.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Dừng task định kỳ
+
+        Không hủy task giữa chừng: tick đang ghi đã dời mốc tính exp của các
+        phiên, hủy lúc đó sẽ làm mất phần exp của lượt ghi. Chỉ đặt cờ dừng,
+        đánh thức vòng lặp và chờ tick hiện tại ghi xong.
+        """
+        if not self._task:
+            return
+
+        if not self._ticking:
+            # Vòng lặp còn đang chờ bot sẵn sàng, chưa có tick nào để chờ
+            self._task.cancel()
+        self._stopping = True
+        self._wake.set()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def close(self):
+        """Dừng task và cộng nốt exp của các phút lẻ chưa được tính (khi tắt bot/unload)"""
+        await self.stop()
+        try:
+            await self.tick(partial=True)
+        except Exception as e:
+            print(f"❌ Lỗi khi cộng nốt exp voice: {e}")
+        self.sessions.clear()
+
+    async def seed(self):
+        """Nạp những người chơi đang ở trong voice khi bot khởi động (chỉ chạy một lần)"""
+        now = time.monotonic()
+        for guild in self.bot.guilds:
+            for voice_channel in guild.voice_channels:
+                for member in voice_channel.members:
+                    if member.id in self.sessions or not self.is_eligible(member, member.voice):
+                        continue
+                    # Giống begin() qua on_voice_state_update: chỉ người đã đăng ký mới có phiên
+                    if not await self.db.get_player(member.id):
+                        continue
+                    # begin() có thể đã tạo phiên trong lúc chờ database
+                    if member.id not in self.sessions:
+                        self.sessions[member.id] = VoiceSession(member, now)
+
+    def begin(self, member) -> bool:
+        """Bắt đầu phiên voice, trả về False nếu đã có phiên"""
+        session = self.sessions.get(member.id)
+        if session:
+            session.member = member
+            return False
+        self.sessions[member.id] = VoiceSession(member, time.monotonic())
+        return True
+
+    def end(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Kết thúc phiên voice, trả về thời gian đã ở, exp chưa được cộng và tổng exp của phiên"""
+        session = self.sessions.pop(user_id, None)
+        if not session:
+            return None
+
+        now = time.monotonic()
+        remaining_exp = int((now - session.credited_at) / 60 * self.exp_per_minute)
+        return {
+            "member": session.member,
+            "duration": now - session.started_at,
+            "exp": remaining_exp,
+            "total_exp": session.earned + remaining_exp
+        }
+
+    async def _run(self):
+        """Vòng lặp tick cộng exp voice"""
+        await self.bot.wait_until_ready()
+        await self.seed()
+        self._ticking = True
+
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            try:
+                batch_size = await self.tick()
+                if batch_size:
+                    print(f"🎙️ Tick exp voice: {batch_size} người chơi, {self.last_tick_ms:.1f}ms")
+            except Exception as e:
+                print(f"❌ Lỗi trong tick exp voice: {e}")
+
+    async def tick(self, partial: bool = False) -> int:
+        """Cộng exp cho mọi phiên đã đủ phút, trả về số người chơi được ghi
+
+        partial: tính cả phút lẻ như khi kết thúc phiên (dùng cho lần tick cuối lúc đóng).
+        """
+        start = time.perf_counter()
+        now = time.monotonic()
+
+        deltas: Dict[int, int] = {}
+        advances: Dict[int, float] = {}
+        members: Dict[int, Any] = {}
+        for user_id, session in self.sessions.items():
+            if partial:
+                seconds = now - session.credited_at
+                amount = int(seconds / 60 * self.exp_per_minute)
+            else:
+                minutes = int((now - session.credited_at) // 60)
+                seconds = minutes * 60
+                amount = minutes * self.exp_per_minute
+            if amount <= 0:
+                continue
+            deltas[user_id] = amount
+            advances[user_id] = seconds
+            members[user_id] = session.member
+
+        # Dời mốc tính exp trước khi ghi để phiên kết thúc giữa chừng không bị cộng trùng
+        for user_id, seconds in advances.items():
+            session = self.sessions[user_id]
+            session.credited_at += seconds
+            session.earned += deltas[user_id]
+
+        players = []
+        if deltas:
+            try:
+                players = await self.db.bulk_increment_exp(deltas)
+            except PartialWriteError as e:
+                # Chỉ trả lại mốc của các thao tác hỏng, phần đã ghi giữ nguyên
+                self._rollback(e.failed, advances, members)
+                players = e.players
+            except Exception:
+                # Ghi thất bại: trả lại mốc để tick sau cộng lại
+                self._rollback(deltas, advances, members)
+                raise
+
+        self.last_tick_ms = (time.perf_counter() - start) * 1000
+        self.max_tick_ms = max(self.max_tick_ms, self.last_tick_ms)
+        self.last_batch_size = len(deltas)
+        self.total_ticks += 1
+
+        if self.on_flush and players:
+            try:
+                await self.on_flush(players, members)
+            except Exception as e:
+                print(f"❌ Lỗi khi xử lý sau tick exp voice: {e}")
+
+        return len(deltas)
+
+    def _rollback(self, deltas: Dict[int, int], advances: Dict[int, float], members: Dict[int, Any]):
+        """Trả lại mốc tính exp của các phiên chưa ghi được
+
+        Phiên đã kết thúc trong lúc ghi (end() tính phần còn lại từ mốc đã dời)
+        thì không còn mốc để trả: đưa exp vào bộ đệm exp để ghi lại sau.
+        """
+        exp_buffer = getattr(self.bot, 'exp_buffer', None)
+        for user_id, amount in deltas.items():
+            session = self.sessions.get(user_id)
+            if session:
+                session.credited_at -= advances[user_id]
+                session.earned -= amount
+            elif exp_buffer:
+                exp_buffer.add(user_id, amount, member=members.get(user_id))
+            else:
+                print(f"❌ Mất {amount} exp voice của người chơi {user_id}: phiên đã kết thúc và không có bộ đệm exp")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin thống kê của bộ theo dõi voice"""
+        return {
+            "active_sessions": len(self.sessions),
+            "total_ticks": self.total_ticks,
+            "last_batch_size": self.last_batch_size,
+            "last_tick_ms": round(self.last_tick_ms, 2),
+            "max_tick_ms": round(self.max_tick_ms, 2)
+        }